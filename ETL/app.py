@@ -4,6 +4,8 @@ from logger_etl import LOGGER
 
 def lambda_handler(event, context):
     LOGGER.info(f"Executing lambda function, event: {event}")
-    run_etl()
+    run_etl(
+        chunked=event.get("chunked", False), segmented=event.get("segmented", False)
+    )
 
     return {"message": "ETL finished"}
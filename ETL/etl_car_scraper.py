@@ -1,193 +1,675 @@
-import datetime
 import os
+import random
 import requests
-from typing import Tuple, List, Iterable
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List, Iterable, Dict, Iterator, Optional
 
 import boto3
+import numpy as np
 import pandas as pd
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+import plotly
 import plotly.express as px
 import plotly.graph_objects as go
-from sklearn.linear_model import LinearRegression
-
-from get_requests import get_responses
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+
+from etl_export import ArtifactUpload
+from etl_features import FeaturePreprocessor
+from etl_link_cache import LinkLivenessCache
+from etl_model import (
+    PriceModel,
+    SegmentedPriceModel,
+    fit_chunked,
+    load_model,
+    save_model,
+)
+from etl_state import (
+    LOCAL_STATE_DIR,
+    load_snapshot,
+    merge_snapshot,
+    save_snapshot,
+    snapshot_writer,
+)
+from get_requests import get_link_statuses, LinkStatus
 from logger_etl import LOGGER
+from metrics_etl import count, stage, with_stages
 
 BUCKET = "car-scraper-vu-bucket"
 FOLDER = "output_files"
-
-
-def scan_full_table(table) -> pd.DataFrame:
-    """Preforms full scan of table in DynamoDB
+TABLE_NAME = "car_table"
+SCAN_SEGMENTS = 4
+# Seconds items are read again before the newest item of the snapshot. Items are
+# stamped when queued by the scraper but stored later in batches, an item
+# stored after the previous ETL run can have an older stamp than its snapshot
+SCRAPED_AT_MARGIN = 15 * 60
+# Number of checked links between progress logs
+LINK_PROGRESS_STEP = 1000
+# s3://bucket/prefix or local folder keeping state between ETL runs
+STATE_LOCATION = os.environ.get("ETL_STATE_LOCATION", f"s3://{BUCKET}/etl_state")
+SNAPSHOT_LOCATION = f"{STATE_LOCATION}/car_table.parquet"
+LINK_CACHE_LOCATION = f"{STATE_LOCATION}/link_liveness.json"
+MODEL_LOCATION = f"{STATE_LOCATION}/models"
+# Max number of links checked in one run
+LINK_CHECK_BUDGET = 5000
+UPDATE_WORKERS = 8
+UPDATE_RETRIES = 5
+UPDATE_BACKOFF_SECONDS = 0.2
+THROTTLING_ERRORS = {
+    "ProvisionedThroughputExceededException",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+}
+# Columns used for training and shown in the final table
+EXTRACT_COLUMNS = [
+    "price",
+    "brand",
+    "model",
+    "year",
+    "engine",
+    "kw",
+    "fuel",
+    "body",
+    "color",
+    "transmission",
+    "milage",
+    "wheel_drive",
+    "defects",
+    "steering_wheel",
+    "doors",
+    "docs",
+    "rims",
+    "first_registration",
+    "consumption_city",
+    "consumption_road",
+    "consumption_mixed",
+    "url",
+    "working_link",
+    "scraped_at",
+]
+INTEGER_COLUMNS = ["price", "kw", "milage", "scraped_at"]
+FLOAT_COLUMNS = ["engine", "consumption_city", "consumption_road", "consumption_mixed"]
+COLUMN_TYPES = {
+    **{column: pa.int64() for column in INTEGER_COLUMNS},
+    **{column: pa.float64() for column in FLOAT_COLUMNS},
+    "working_link": pa.bool_(),
+}
+# Fixed types of chunked mode data, chunks of DynamoDB items can not infer them
+CHUNK_SCHEMA = pa.schema(
+    [(column, COLUMN_TYPES.get(column, pa.string())) for column in EXTRACT_COLUMNS]
+)
+# Types of scored chunked mode data, also kept in snapshot
+SCORED_SCHEMA = CHUNK_SCHEMA.append(pa.field("price_pred", pa.float64())).append(
+    pa.field("model_version", pa.string())
+)
+# Rows per chunk in chunked mode
+CHUNK_ROWS = 10000
+# Columns read for link checks in chunked mode
+LINK_COLUMNS = ["url", "working_link", "scraped_at"]
+# Columns kept in snapshot for incremental runs, not shown in the final table
+STATE_COLUMNS = ["scraped_at", "price_pred", "model_version"]
+# Columns telling if an item scraped again changed since the snapshot
+CONTENT_COLUMNS = [
+    column for column in EXTRACT_COLUMNS if column not in STATE_COLUMNS + ["url"]
+]
+# Rows of final table converted and uploaded at once
+EXPORT_CHUNK_ROWS = 50000
+# Columns shown first in the final table
+MAIN_COLUMNS = [
+    "brand",
+    "model",
+    "year",
+    "engine",
+    "kw",
+    "fuel",
+    "milage",
+    "docs",
+    "transmission",
+    "defects",
+    "true_price",
+    "predicted_price",
+    "price_dif",
+    "url",
+]
+# Columns with few distinct values, stored as categorical in the final table
+CATEGORICAL_COLUMNS = ["brand", "fuel", "body"]
+
+
+def convert_numbers(df: pd.DataFrame):
+    """Converts numeric columns of car table data read as Decimal to numbers, in place"""
+    for column in INTEGER_COLUMNS + FLOAT_COLUMNS:
+        df[column] = pd.to_numeric(df[column])
+
+
+def scan_table_pages(table, **scan_kwargs) -> Iterator[List[dict]]:
+    """Preforms full scan of table in DynamoDB, page by page
     Args:
         table: dynamoDB table
+        scan_kwargs: extra scan params, e.g. segment or projection
 
     Returns:
-        Pandas Dataframe with scanned table data
+        Iterator of scanned item pages
     """
-    response = table.scan()
-    yield from response["Items"]
+    response = table.scan(**scan_kwargs)
+    yield response["Items"]
     while response.get("LastEvaluatedKey"):
-        response = table.scan(ExclusiveStartKey=response["LastEvaluatedKey"])
-        yield from response["Items"]
+        response = table.scan(
+            ExclusiveStartKey=response["LastEvaluatedKey"], **scan_kwargs
+        )
+        yield response["Items"]
 
 
-def extract_data() -> pd.DataFrame:
-    """Extraction of raw data"""
-    client_dynamo = boto3.resource("dynamodb")
-    table = client_dynamo.Table("car_table")
+def projection_params(columns: List[str]) -> dict:
+    """Creates scan params reading only given columns, names are aliased as
+    some of them (e.g. year) are DynamoDB reserved words
+    Args:
+        columns: columns to read
 
-    table_parts = list(scan_full_table(table))
-    data = pd.DataFrame(table_parts)
+    Returns: ProjectionExpression and ExpressionAttributeNames scan params
+    """
+    names = {f"#c{i}": column for i, column in enumerate(columns)}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+def scan_table_segment(
+    segment: int,
+    total_segments: int,
+    columns: List[str],
+    scraped_after: Optional[int] = None,
+) -> Dict[str, list]:
+    """Scans one segment of car table into column lists
+    Args:
+        segment: segment to scan
+        total_segments: number of segments table is split to
+        columns: columns to read
+        scraped_after: read only items scraped at or after this unix time
 
+    Returns: column names mapped to column values
+    """
+    scan_kwargs = projection_params(columns)
+    if scraped_after is not None:
+        scan_kwargs["FilterExpression"] = Attr("scraped_at").gte(scraped_after)
+    # boto3 resources are not thread safe, each segment gets its own session
+    table = boto3.session.Session().resource("dynamodb").Table(TABLE_NAME)
+    data = {column: [] for column in columns}
+    for items in scan_table_pages(
+        table,
+        Segment=segment,
+        TotalSegments=total_segments,
+        **scan_kwargs,
+    ):
+        for column, values in data.items():
+            values.extend(item.get(column) for item in items)
     return data
 
 
-def update_working_links(trained_df):
-    """Requests links and filters dataframe to give back updated working links"""
-    filtered_df = trained_df[trained_df["working_link"].fillna(True)]
-    urls = filtered_df["url"].reset_index(drop=True)
-    LOGGER.info(f"Getting {len(urls)} url status")
-    working_links = pd.Series(get_responses(urls), name="working_link")
-    return pd.concat([urls, working_links], axis=1)
+def scan_car_table(
+    total_segments: int = SCAN_SEGMENTS, scraped_after: Optional[int] = None
+) -> pd.DataFrame:
+    """Scans car table, table segments are scanned in parallel
+    Args:
+        total_segments: number of segments scanned in parallel
+        scraped_after: read only items scraped at or after this unix time
+
+    Returns: DataFrame with car table data
+    """
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = list(
+            executor.map(
+                lambda segment: scan_table_segment(
+                    segment, total_segments, EXTRACT_COLUMNS, scraped_after
+                ),
+                range(total_segments),
+            )
+        )
+
+    data = pd.DataFrame(
+        {
+            column: [value for segment in segments for value in segment[column]]
+            for column in EXTRACT_COLUMNS
+        }
+    )
+    convert_numbers(data)
+    LOGGER.info(f"Scanned {len(data)} rows from {total_segments} segments")
+
+    return data
 
 
-def update_dynamodb_table_working_links(updated_links_df):
-    """Updates dynamo db tables with not working links"""
-    client_dynamo = boto3.resource("dynamodb")
-    table = client_dynamo.Table("car_table")
+@stage("extract_data")
+def extract_data(
+    total_segments: int = SCAN_SEGMENTS,
+    snapshot_location: Optional[str] = SNAPSHOT_LOCATION,
+) -> Tuple[pd.DataFrame, Optional[pd.DataFrame]]:
+    """Extraction of raw data. When snapshot of previous run exists, only items
+    scraped after it are read from DynamoDB and merged into it
+    Args:
+        total_segments: number of segments scanned in parallel
+        snapshot_location: s3://bucket/key or local file of snapshot, None for full scan
 
-    LOGGER.info("Updating working links in DynamoDB")
+    Returns: DataFrame with car table data, and snapshot rows of items that
+        changed since, None after a full scan
+    """
+    snapshot = load_snapshot(snapshot_location) if snapshot_location else None
+    if snapshot is None or snapshot["scraped_at"].isna().all():
+        df = scan_car_table(total_segments)
+        count("scanned_rows", len(df))
+        count("extracted_rows", len(df))
+        return df, None
+
+    # Snapshots of older runs kept numbers as Decimal
+    convert_numbers(snapshot)
+    # Items read again within the margin are merged as unchanged
+    scraped_after = int(snapshot["scraped_at"].max()) - SCRAPED_AT_MARGIN
+    changes = scan_car_table(total_segments, scraped_after)
+    count("scanned_rows", len(changes))
+    df, replaced = merge_snapshot(snapshot, changes, CONTENT_COLUMNS)
+    count("changed_rows", len(replaced))
+    count("extracted_rows", len(df))
+    return df, replaced
+
+
+def items_to_chunk(items: List[dict]) -> pa.Table:
+    """Converts scanned DynamoDB items to chunk of car table data"""
+    df = pd.DataFrame(
+        {column: [item.get(column) for item in items] for column in EXTRACT_COLUMNS}
+    )
+    convert_numbers(df)
+    return pa.Table.from_pandas(df, schema=CHUNK_SCHEMA, preserve_index=False)
 
-    for url in updated_links_df[~updated_links_df["working_link"]]["url"]:
-        table.update_item(
-            Key={"url": url},
-            UpdateExpression="SET working_link = :val1",
-            ExpressionAttributeValues={":val1": False},
+
+def spool_table_segment(
+    segment: int, total_segments: int, path: str, chunk_rows: int = CHUNK_ROWS
+) -> int:
+    """Scans one segment of car table into local parquet file, chunk by chunk
+    Args:
+        segment: segment to scan
+        total_segments: number of segments table is split to
+        path: parquet file to write
+        chunk_rows: rows kept in memory before they are written
+
+    Returns: number of written rows
+    """
+    # boto3 resources are not thread safe, each segment gets its own session
+    table = boto3.session.Session().resource("dynamodb").Table(TABLE_NAME)
+    items, n_rows = [], 0
+    with pq.ParquetWriter(path, CHUNK_SCHEMA) as writer:
+        for page in scan_table_pages(
+            table,
+            Segment=segment,
+            TotalSegments=total_segments,
+            **projection_params(EXTRACT_COLUMNS),
+        ):
+            items.extend(page)
+            if len(items) >= chunk_rows:
+                writer.write_table(items_to_chunk(items))
+                n_rows += len(items)
+                items = []
+        if items:
+            writer.write_table(items_to_chunk(items))
+            n_rows += len(items)
+    return n_rows
+
+
+def spool_car_table(
+    total_segments: int = SCAN_SEGMENTS, chunk_rows: int = CHUNK_ROWS
+) -> List[str]:
+    """Scans car table into local parquet files, one per table segment, keeping
+    at most a chunk of each segment in memory
+    Args:
+        total_segments: number of segments scanned in parallel
+        chunk_rows: rows kept in memory per segment
+
+    Returns: written parquet files
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    paths = [
+        os.path.join(LOCAL_STATE_DIR, f"car_table_segment_{segment}.parquet")
+        for segment in range(total_segments)
+    ]
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        n_rows = sum(
+            executor.map(
+                lambda segment: spool_table_segment(
+                    segment, total_segments, paths[segment], chunk_rows
+                ),
+                range(total_segments),
+            )
         )
+    LOGGER.info(f"Spooled {n_rows} rows from {total_segments} segments")
+    return paths
+
+
+def iter_chunks(
+    paths: List[str], chunk_rows: int = CHUNK_ROWS
+) -> Iterator[pd.DataFrame]:
+    """Reads parquet files chunk by chunk
+    Args:
+        paths: parquet files to read
+        chunk_rows: max rows per chunk
 
-    LOGGER.info("Done updating DynamoDB")
+    Returns: Iterator of car table data chunks
+    """
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
 
 
-def one_hot_encode(df: pd.DataFrame, columns: list) -> pd.DataFrame:
-    """One hot encodes in the given list
+def score_chunked(
+    paths: List[str], chunk_rows: int = CHUNK_ROWS
+) -> Tuple[str, PriceModel]:
+    """Refits price model on car table data in parquet files chunk by chunk and
+    scores it in another pass over them
     Args:
-        df: df to encode
-        columns: list of categorical columns to encode
+        paths: parquet files with car table data
+        chunk_rows: max rows in memory per pass
 
-    Returns: One hot encoded DataFrame
+    Returns: local parquet file with scored car table data, and refit price model
     """
-    return pd.get_dummies(df, columns=columns)
+    model = fit_chunked(lambda: iter_chunks(paths, chunk_rows))
+    preprocessor = model.preprocessor
+
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    scored_path = os.path.join(LOCAL_STATE_DIR, "car_table_scored.parquet")
+    abs_error = 0.0
+    with pq.ParquetWriter(scored_path, SCORED_SCHEMA) as writer:
+        for chunk in iter_chunks(paths, chunk_rows):
+            y = preprocessor.transform_target(chunk)
+            chunk["price_pred"] = model.predict(preprocessor.transform(chunk), chunk)
+            chunk["model_version"] = model.version
+            abs_error += np.abs(chunk["price_pred"].to_numpy() - y).sum()
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=SCORED_SCHEMA, preserve_index=False)
+            )
+    model.train_error = abs_error / model.n_rows
+    return scored_path, model
 
 
-def train_linear_model(df: pd.DataFrame, target: str) -> pd.DataFrame:
-    """Returns trained model, to find given target value
+@stage("extract_scored_chunked")
+def extract_scored_chunked(
+    total_segments: int = SCAN_SEGMENTS, chunk_rows: int = CHUNK_ROWS
+) -> Tuple[str, PriceModel]:
+    """Extraction and scoring of raw data for tables not fitting in memory. Car
+    table is spooled to local disk, price model is refit on it in chunks and
+    scored in another pass over it
     Args:
-        df: df for training
-        target: target column to predict from df
+        total_segments: number of segments scanned in parallel
+        chunk_rows: max rows in memory per pass
 
-    Returns: df with expected car values, and model
+    Returns: local parquet file with scored car table data, and saved price model
     """
-    train_df = df.copy()
-    model = LinearRegression()
-    y = train_df[target]
-    x = train_df.drop(columns=target, axis=1)
+    paths = spool_car_table(total_segments, chunk_rows)
+    scored_path, model = score_chunked(paths, chunk_rows)
+    save_model(model, MODEL_LOCATION)
+
+    for path in paths:
+        os.remove(path)
+    count("extracted_rows", model.n_rows)
+    return scored_path, model
 
-    model.fit(x, y)
-    train_df["price_pred"] = model.predict(x)
-    return train_df
 
+@stage("update_working_links")
+def update_working_links(trained_df, link_cache: Optional[LinkLivenessCache] = None):
+    """Requests links and filters dataframe to give back updated working links
+    Args:
+        trained_df: df with car urls, their working_link flags and scrape times
+        link_cache: previous link checks, only links due for a recheck are
+            requested if given, otherwise all links are requested
+
+    Returns: df with urls and their working_link status
+    """
+    filtered_df = trained_df.loc[
+        trained_df["working_link"].fillna(True).astype(bool), ["url", "scraped_at"]
+    ]
+    urls = filtered_df["url"].reset_index(drop=True)
+    if link_cache is not None:
+        link_cache.track(urls, filtered_df["scraped_at"])
+        urls_to_check = link_cache.select_due(LINK_CHECK_BUDGET)
+    else:
+        urls_to_check = urls
+    LOGGER.info(f"Getting {len(urls_to_check)} of {len(urls)} url status")
+
+    counts = {"checked": 0, "not_working": 0, "errors": 0}
+
+    def count_link_status(link_status: LinkStatus):
+        counts["checked"] += 1
+        counts["not_working"] += not link_status.working
+        counts["errors"] += link_status.error is not None
+        if counts["checked"] % LINK_PROGRESS_STEP == 0:
+            LOGGER.info(f"Link check progress: {counts}")
+
+    link_statuses = get_link_statuses(urls_to_check, on_result=count_link_status)
+    LOGGER.info(f"Finished link check: {counts}")
+    for name, value in counts.items():
+        count(f"links_{name}", value)
+    if link_cache is None:
+        working_links = [link_status.working for link_status in link_statuses]
+    else:
+        for link_status in link_statuses:
+            link_cache.record(link_status)
+        working_links = [link_cache.is_working(url) for url in urls]
+    working_links = pd.Series(working_links, name="working_link", dtype=bool)
+    return pd.concat([urls, working_links], axis=1)
 
-def feature_transform_and_normalization(
-    df: pd.DataFrame, features_to_norm: Iterable[str], date_features: List[str]
-) -> Tuple[pd.DataFrame, dict]:
 
-    transformed_df = df.copy()
-    # Change feature types
-    for feature in features_to_norm:
-        if feature in date_features:
-            transformed_df[feature] = (
-                datetime.datetime.today()
-                - pd.to_datetime(transformed_df[feature], format="%Y-%m")
-            ).dt.days
-        else:
-            transformed_df[feature] = pd.to_numeric(
-                transformed_df[feature], errors="raise"
+def set_link_not_working(table, url: str):
+    """Sets working_link to False for url, retrying throttled requests
+    Args:
+        table: dynamoDB table
+        url: url of car to update
+    """
+    for attempt in range(UPDATE_RETRIES + 1):
+        try:
+            table.update_item(
+                Key={"url": url},
+                UpdateExpression="SET working_link = :val1",
+                ExpressionAttributeValues={":val1": False},
             )
-    # Standardize features
-    scaler_dict = pd.DataFrame(
-        [transformed_df.mean(numeric_only=True), transformed_df.std(numeric_only=True)],
-        index=["mean", "std"],
-    ).to_dict()
-    for feature in features_to_norm:
-        transformed_df[feature] = (
-            transformed_df[feature] - scaler_dict[feature]["mean"]
-        ) / scaler_dict[feature]["std"]
-
-    return transformed_df, scaler_dict
-
-
-def scale_back_price(trained_df, scalar_dict):
-    df = trained_df.copy()
-    df["true_price"] = (
-        df["price"] * scalar_dict["price"]["std"] + scalar_dict["price"]["mean"]
-    ).round()
-    df["predicted_price"] = (
-        (df["price_pred"] * scalar_dict["price"]["std"] + scalar_dict["price"]["mean"])
-        .round()
-        .clip(lower=0)
-    )
-    return df[["true_price", "predicted_price"]]
+            return
+        except ClientError as e:
+            throttled = e.response["Error"]["Code"] in THROTTLING_ERRORS
+            if not throttled or attempt == UPDATE_RETRIES:
+                raise
+            time.sleep(UPDATE_BACKOFF_SECONDS * 2**attempt * random.uniform(0.5, 1.5))
 
 
-def transform_data(df: pd.DataFrame):
-    """Transformation of raw data
+def update_links_chunk(urls: List[str]) -> int:
+    """Marks chunk of urls as not working
     Args:
-        df: DataFrame with raw data
+        urls: urls of cars to update
 
-    Returns:
+    Returns: number of failed updates
     """
-    features_to_use = [
-        "docs",
-        "steering_wheel",
-        "consumption_road",
-        "consumption_city",
-        "consumption_mixed",
-        "wheel_drive",
-        "fuel",
-        "brand",
-        "kw",
-        "doors",
-        "milage",
-        "defects",
-        "year",
-        "price",
-        "engine",
-        "body",
-        "transmission",
-    ]
-    features_to_encode = [
-        "steering_wheel",
-        "wheel_drive",
-        "fuel",
-        "brand",
-        "doors",
-        "defects",
-        "body",
-        "transmission",
-    ]
-    features_to_normalize = set(features_to_use) - set(features_to_encode)
+    # boto3 resources are not thread safe, each chunk gets its own session
+    table = boto3.session.Session().resource("dynamodb").Table(TABLE_NAME)
+    failed = 0
+    for url in urls:
+        try:
+            set_link_not_working(table, url)
+        except ClientError as e:
+            LOGGER.warning(f"Failed to update {url}: {e}")
+            failed += 1
+    return failed
+
+
+@stage("update_dynamodb_table_working_links")
+def update_dynamodb_table_working_links(
+    updated_links_df, max_workers: int = UPDATE_WORKERS
+) -> Dict[str, float]:
+    """Updates dynamo db tables with not working links, using a pool of workers
+    Args:
+        updated_links_df: urls and their working_link status
+        max_workers: number of concurrent update workers
 
-    norm_df, normalization_params = feature_transform_and_normalization(
-        df, features_to_normalize, ["docs", "year"]
-    )
-    one_hot_df = one_hot_encode(norm_df[features_to_use], features_to_encode)
+    Returns: counts of updated and failed links and updates per second
+    """
+    urls = list(updated_links_df[~updated_links_df["working_link"]]["url"])
+    LOGGER.info(f"Updating {len(urls)} not working links in DynamoDB")
+
+    start = time.perf_counter()
+    chunks = [urls[i::max_workers] for i in range(max_workers) if urls[i::max_workers]]
+    failed = 0
+    if chunks:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+            failed = sum(executor.map(update_links_chunk, chunks))
+    seconds = time.perf_counter() - start
+
+    stats = {
+        "updated": len(urls) - failed,
+        "failed": failed,
+        "seconds": round(seconds, 3),
+        "per_second": round(len(urls) / seconds, 1) if urls else 0.0,
+    }
+    LOGGER.info(f"Done updating DynamoDB: {stats}")
+    count("updated_links", stats["updated"])
+    count("failed_updates", failed)
+    return stats
+
+
+def apply_working_links(df: pd.DataFrame, updated_links_df: pd.DataFrame):
+    """Marks links found not working in raw data, in place
+    Args:
+        df: raw car table data
+        updated_links_df: checked urls and their working_link status
+    """
+    not_working = updated_links_df.loc[~updated_links_df["working_link"], "url"]
+    df.loc[df["url"].isin(not_working), "working_link"] = False
+
+
+@stage("train_linear_model")
+def train_linear_model(
+    x: sparse.csr_matrix,
+    y: np.ndarray,
+    preprocessor: FeaturePreprocessor,
+    df: Optional[pd.DataFrame] = None,
+    segmented: bool = False,
+) -> Tuple[PriceModel, np.ndarray]:
+    """Trains linear model to predict target
+    Args:
+        x: model features
+        y: target values
+        preprocessor: preprocessor x and y were transformed with
+        df: raw car data of rows, needed for segmented model
+        segmented: also train per brand and per brand+model models
+
+    Returns: trained model and its predictions of target
+    """
+    model = SegmentedPriceModel(preprocessor) if segmented else PriceModel(preprocessor)
+    model.fit(x, y, df)
+    count("training_rows", x.shape[0])
+    return model, model.predict(x, df)
+
+
+@stage("score_prices")
+def score_prices(
+    df: pd.DataFrame,
+    model: Optional[PriceModel],
+    segmented: bool = False,
+    replaced: Optional[pd.DataFrame] = None,
+) -> Tuple[PriceModel, bool]:
+    """Predicts standardized price of listings not yet scored by the model, in place.
+    Model is updated with these listings, or refit on all data when refit is
+    due or the model drifted
+    Args:
+        df: raw car data, price_pred and model_version columns are kept up to date
+        model: model saved by previous run
+        segmented: use per brand and per brand+model models, model of other kind is refit
+        replaced: previous rows of listings that changed since last run, those
+            the model was updated with are removed from it before it is updated
+            with their current rows
+
+    Returns: up to date model and whether it changed
+    """
+    if "price_pred" not in df:
+        df["price_pred"] = np.nan
+        df["model_version"] = None
+
+    if (
+        model is not None
+        and not model.needs_refit()
+        and isinstance(model, SegmentedPriceModel) == segmented
+    ):
+        to_score = (df["model_version"] != model.version).to_numpy()
+        if not to_score.any():
+            LOGGER.info("All listings already scored")
+            return model, False
+
+        rows = df[to_score]
+        x, y, _ = transform_data(rows, model.preprocessor)
+        if not model.has_drifted(x, y, rows):
+            if replaced is not None:
+                forget_replaced(model, replaced)
+            model.partial_fit(x, y, rows)
+            df.loc[to_score, "price_pred"] = model.predict(x, rows)
+            df.loc[to_score, "model_version"] = model.version
+            LOGGER.info(f"Scored {to_score.sum()} of {len(df)} listings")
+            count("scored_rows", int(to_score.sum()))
+            return model, True
+        LOGGER.info("Price model drifted")
+
+    LOGGER.info("Refitting price model")
+    x, y, preprocessor = transform_data(df)
+    model, y_pred = train_linear_model(x, y, preprocessor, df, segmented)
+    df["price_pred"] = y_pred
+    df["model_version"] = model.version
+    count("scored_rows", len(df))
+    return model, True
+
+
+def forget_replaced(model: PriceModel, replaced: pd.DataFrame):
+    """Removes previous rows of changed listings from model, if it was updated
+    with them
+    Args:
+        model: price model to update
+        replaced: previous rows of listings that changed
+    """
+    rows = replaced[(replaced["model_version"] == model.version).to_numpy()]
+    if rows.empty:
+        return
+    x, y, _ = transform_data(rows, model.preprocessor)
+    model.forget(x, y, rows)
+    LOGGER.info(f"Removed {len(rows)} changed listings from price model")
+    count("forgotten_rows", len(rows))
+
+
+def scale_back_price(df: pd.DataFrame, scalar_dict: Dict[str, Dict[str, float]]):
+    """Adds true and predicted price in EUR to scored car data, in place
+    Args:
+        df: raw car data with standardized price predictions in price_pred
+        scalar_dict: mean and std of price
+    """
+    mean, std = scalar_dict["price"]["mean"], scalar_dict["price"]["std"]
+    df["true_price"] = pd.to_numeric(df["price"]).fillna(mean).round()
+    df["predicted_price"] = (df["price_pred"] * std + mean).round().clip(lower=0)
 
-    return one_hot_df, normalization_params
 
+def transform_data(
+    df: pd.DataFrame, preprocessor: Optional[FeaturePreprocessor] = None
+) -> Tuple[sparse.csr_matrix, np.ndarray, FeaturePreprocessor]:
+    """Transformation of raw data
+    Args:
+        df: DataFrame with raw data
+        preprocessor: fitted preprocessor to reuse, fitted on df if not given
+
+    Returns: model features, standardized target and fitted preprocessor
+    """
+    if preprocessor is None:
+        preprocessor = FeaturePreprocessor()
+        x, y = preprocessor.fit_transform(df)
+        return x, y, preprocessor
+    return preprocessor.transform(df), preprocessor.transform_target(df), preprocessor
 
+
+@stage("create_graph")
 def create_graph(final_df):
-    scale_min = final_df.min(numeric_only=True).min()
-    scale_max = final_df.max(numeric_only=True).max()
+    price_cols = final_df[["true_price", "predicted_price", "price_dif"]]
+    scale_min = price_cols.min().min()
+    scale_max = price_cols.max().max()
     fig = px.scatter(
         final_df,
         x="true_price",
@@ -214,100 +696,294 @@ def create_graph(final_df):
     return fig
 
 
-def create_dataframe_html(dataframe: pd.DataFrame):
-    main_cols = [
-        "brand",
-        "model",
-        "year",
-        "engine",
-        "kw",
-        "fuel",
-        "milage",
-        "docs",
-        "transmission",
-        "defects",
-        "true_price",
-        "predicted_price",
-        "price_dif",
-        "url",
-    ]
-    other_cols = list(set(dataframe.columns) - set(main_cols))
-    df_to_use = dataframe[main_cols + other_cols]
-
-    table_html = df_to_use.to_html(table_id="table", render_links=True, escape=False)
-    html = f"""
-    <html>
-    <header>
-        <link href="https://cdn.datatables.net/1.11.5/css/jquery.dataTables.min.css" rel="stylesheet">
-    </header>
-    <body>
-    {table_html}
-    <script src="https://code.jquery.com/jquery-3.6.0.slim.min.js" integrity="sha256-u7e5khyithlIdTpu22PHhENmPcRdFiHRjhAuHcs05RI=" crossorigin="anonymous"></script>
-    <script type="text/javascript" src="https://cdn.datatables.net/1.11.5/js/jquery.dataTables.min.js"></script>
-    <script>
-        $(document).ready( function () {{
-            $('#table').DataTable({{
-                // paging: true,    
-                // scrollY: 400,
-            }});
-        }});
-    </script>
-    </body>
-    </html>
-    """
-    return html
-
-
-def prepare_final_df(initial_df, output_df):
-    final_df = initial_df.join(output_df)
-    final_df = final_df.astype({"true_price": "int", "predicted_price": "int"})
-    final_df["price_dif"] = final_df["predicted_price"] - final_df["true_price"]
-    return final_df.drop(columns="price").sort_values("price_dif", ascending=False)
-
-
-def filter_out_good_links(final_df: pd.DataFrame, updated_links_df: pd.DataFrame):
-    working_links = updated_links_df[updated_links_df["working_link"]]
-    return final_df.merge(
-        working_links, how="inner", on=["url"], suffixes=("", "_updated")
+def create_table_dataset(
+    final_df: pd.DataFrame, chunk_rows: int = EXPORT_CHUNK_ROWS
+) -> Iterator[pa.Table]:
+    """Creates columnar dataset of final table for the web app chunk by chunk,
+    main columns first, so only one chunk is converted at a time
+    Args:
+        final_df: final table
+        chunk_rows: rows per chunk
+
+    Returns: Arrow tables with the same schema, rows in final table order
+    """
+    other_cols = [column for column in final_df.columns if column not in MAIN_COLUMNS]
+    schema = pa.Schema.from_pandas(final_df, preserve_index=False)
+    schema = pa.schema(
+        [schema.field(column) for column in MAIN_COLUMNS + other_cols],
+        metadata=schema.metadata,
     )
+    for start in range(0, max(len(final_df), 1), chunk_rows):
+        yield pa.Table.from_pandas(
+            final_df.iloc[start : start + chunk_rows],
+            schema=schema,
+            preserve_index=False,
+        )
+
+
+def good_links_mask(df: pd.DataFrame, updated_links_df: pd.DataFrame) -> np.ndarray:
+    """Marks rows whose links were found working
+    Args:
+        df: car data
+        updated_links_df: checked urls and their working_link status
+
+    Returns: boolean mask of rows
+    """
+    working_links = updated_links_df.loc[updated_links_df["working_link"], "url"]
+    return df["url"].isin(working_links).to_numpy()
+
+
+def convert_final_columns(df: pd.DataFrame, scalar_dict: Dict[str, Dict[str, float]]):
+    """Adds, converts and drops columns of scored car data for the final table,
+    in place. Categorical columns are left to the caller
+    Args:
+        df: scored raw car data, it is modified
+        scalar_dict: mean and std of price
+    """
+    scale_back_price(df, scalar_dict)
+    df["true_price"] = df["true_price"].astype(np.int32)
+    df["predicted_price"] = df["predicted_price"].astype(np.int32)
+    df["price_dif"] = df["predicted_price"] - df["true_price"]
+    for column in ["price"] + STATE_COLUMNS:
+        del df[column]
+    for column in df.select_dtypes("integer").columns:
+        df[column] = pd.to_numeric(df[column], downcast="integer")
+    for column in df.select_dtypes("floating").columns:
+        df[column] = pd.to_numeric(df[column], downcast="float")
+
+
+def sort_final_rows(df: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+    """Takes rows of final table sorted by price difference
+    Args:
+        df: converted car data with categorical columns
+        positions: positions of rows to keep
+
+    Returns: final table
+    """
+    order = np.argsort(-df["price_dif"].to_numpy()[positions], kind="stable")
+    final_df = df.take(positions[order])
+    final_df.index = pd.RangeIndex(len(final_df))
+    for column in CATEGORICAL_COLUMNS:
+        final_df[column] = final_df[column].cat.remove_unused_categories()
+    count("final_rows", len(final_df))
+    return final_df
+
+
+@stage("prepare_final_df")
+def prepare_final_df(
+    df: pd.DataFrame, scalar_dict: Dict[str, Dict[str, float]], rows: np.ndarray
+) -> pd.DataFrame:
+    """Turns scored car data into final table sorted by price difference. Columns
+    are added, converted and dropped in place, data is copied only once when
+    final rows are taken
+    Args:
+        df: scored raw car data, it is modified
+        scalar_dict: mean and std of price
+        rows: boolean mask of rows to keep
+
+    Returns: final table
+    """
+    convert_final_columns(df, scalar_dict)
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    return sort_final_rows(df, np.flatnonzero(rows))
+
+
+@stage("prepare_final_df_chunked")
+def prepare_final_df_chunked(
+    scored_path: str,
+    scalar_dict: Dict[str, Dict[str, float]],
+    updated_links_df: pd.DataFrame,
+    snapshot_location: str = SNAPSHOT_LOCATION,
+    chunk_rows: int = CHUNK_ROWS,
+) -> pd.DataFrame:
+    """Saves snapshot and turns scored car data into final table sorted by price
+    difference in one pass over its local parquet file, so besides the final
+    table only one chunk of it is kept in memory
+    Args:
+        scored_path: local parquet file with scored car table data
+        scalar_dict: mean and std of price
+        updated_links_df: checked urls and their working_link status
+        snapshot_location: s3://bucket/key or local file of snapshot
+        chunk_rows: max rows per chunk
+
+    Returns: final table
+    """
+    # Url lookups are indexed once, not per chunk as isin would
+    links = updated_links_df.set_index("url")["working_link"]
+    not_working = links.index[~links.to_numpy()].unique()
+    working = links.index[links.to_numpy()].unique()
+
+    final_chunks = []
+    with snapshot_writer(snapshot_location, SCORED_SCHEMA) as writer:
+        for chunk in iter_chunks([scored_path], chunk_rows):
+            chunk.loc[not_working.get_indexer(chunk["url"]) >= 0, "working_link"] = (
+                False
+            )
+            writer.write_table(
+                pa.Table.from_pandas(chunk, schema=SCORED_SCHEMA, preserve_index=False)
+            )
+            chunk = chunk.take(np.flatnonzero(working.get_indexer(chunk["url"]) >= 0))
+            convert_final_columns(chunk, scalar_dict)
+            final_chunks.append(chunk)
+
+    df = pd.concat(final_chunks, ignore_index=True)
+    del final_chunks
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    return sort_final_rows(df, np.arange(len(df)))
+
+
+def graph_json_chunks(plotly_graph) -> Iterator[str]:
+    """Serializes figure to json trace by trace, so whole figure json is never
+    kept in memory
+    Args:
+        plotly_graph: plotly figure
+
+    Returns: parts of figure json
+    """
+    yield '{"data":['
+    for i, trace in enumerate(plotly_graph.data):
+        yield ("," if i else "") + plotly.io.json.to_json_plotly(trace.to_plotly_json())
+    yield '],"layout":'
+    yield plotly.io.json.to_json_plotly(plotly_graph.layout.to_plotly_json())
+    yield "}"
 
 
-def load_data(plotly_graph, dataframe_content):
+def export_graph(s3, plotly_graph):
+    """Streams figure json to s3 with pre-compressed variants for web app
+    Args:
+        s3: s3 client
+        plotly_graph: plotly figure
+    """
+    with ArtifactUpload(
+        s3, BUCKET, f"{FOLDER}/car_graph.json", "application/json", compress=True
+    ) as upload:
+        for chunk in graph_json_chunks(plotly_graph):
+            upload.write(chunk.encode("utf-8"))
+
+
+def export_table(s3, table_chunks: Iterable[pa.Table]):
+    """Streams final table to s3 as parquet file, a row group per chunk
+    Args:
+        s3: s3 client
+        table_chunks: Arrow tables with the same schema
+    """
+    # Parquet is compressed already
+    with ArtifactUpload(
+        s3,
+        BUCKET,
+        f"{FOLDER}/car_table.parquet",
+        "application/vnd.apache.parquet",
+        compress=False,
+    ) as upload:
+        writer = None
+        for chunk in table_chunks:
+            if writer is None:
+                writer = pq.ParquetWriter(upload, chunk.schema, compression="zstd")
+            writer.write_table(chunk)
+        if writer is not None:
+            writer.close()
+
+
+@stage("load_data")
+def load_data(plotly_graph, table_chunks: Iterable[pa.Table]):
+    """Uploads graph and table for web app concurrently
+    Args:
+        plotly_graph: plotly figure
+        table_chunks: final table as Arrow tables with the same schema
+    """
     s3 = boto3.client("s3")
-    graph_file = "car_graph.json"
-    df_file = "dataframe_html.html"
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        uploads = [
+            executor.submit(with_stages(export_graph), s3, plotly_graph),
+            executor.submit(with_stages(export_table), s3, table_chunks),
+        ]
+        for upload in uploads:
+            upload.result()
 
-    os.makedirs("/tmp", exist_ok=True)
 
-    # Write to temp memory
-    plotly_graph.write_json(f"/tmp/{graph_file}")
-    open(f"/tmp/{df_file}", "w", encoding="utf-8").write(dataframe_content)
+def check_links(df: pd.DataFrame) -> pd.DataFrame:
+    """Checks links due for a recheck and marks not working ones in DynamoDB
+    Args:
+        df: df with car urls, their working_link flags and scrape times
 
-    s3.upload_file(f"/tmp/{graph_file}", BUCKET, f"{FOLDER}/{graph_file}")
-    s3.upload_file(f"/tmp/{df_file}", BUCKET, f"{FOLDER}/{df_file}")
+    Returns: df with urls and their working_link status
+    """
+    link_cache = LinkLivenessCache.load(LINK_CACHE_LOCATION)
+    updated_links_df = update_working_links(df, link_cache)
+    update_dynamodb_table_working_links(updated_links_df)
+    link_cache.save(LINK_CACHE_LOCATION)
+    return updated_links_df
 
 
-def run_etl():
-    LOGGER.info("ETL started")
+def transform_in_memory(segmented: bool = False) -> pd.DataFrame:
+    """Extracts, scores and checks links of car table kept in memory, saving
+    snapshot, price model and link checks for next runs
+    Args:
+        segmented: price listings by per brand and per brand+model models
+            where enough listings exist
 
-    LOGGER.info("Extracting data")
-    df = extract_data()
+    Returns: final table
+    """
+    df, replaced = extract_data()
 
     LOGGER.info("Transforming data")
-    transformed, scalar_dict = transform_data(df)
-    trained_df = train_linear_model(transformed.fillna(0), "price")
-    output_df = scale_back_price(trained_df, scalar_dict)
-    final_df = prepare_final_df(df, output_df)
+    model, model_changed = score_prices(
+        df, load_model(MODEL_LOCATION), segmented, replaced
+    )
+    if model_changed:
+        save_model(model, MODEL_LOCATION)
 
-    updated_links_df = update_working_links(final_df)
-    update_dynamodb_table_working_links(updated_links_df)
+    updated_links_df = check_links(df)
+    apply_working_links(df, updated_links_df)
+    save_snapshot(df, SNAPSHOT_LOCATION)
+
+    rows = good_links_mask(df, updated_links_df)
+    return prepare_final_df(df, model.preprocessor.scaler_dict, rows)
+
+
+def transform_chunked() -> pd.DataFrame:
+    """Extracts, scores and checks links of car table chunk by chunk, saving
+    snapshot, price model and link checks for next runs. Only link check
+    columns and the final table are read whole
+    Returns: final table
+    """
+    scored_path, model = extract_scored_chunked()
+
+    LOGGER.info("Transforming data")
+    links_df = pq.read_table(scored_path, columns=LINK_COLUMNS).to_pandas()
+    updated_links_df = check_links(links_df)
+    del links_df
 
-    final_df_good_links = filter_out_good_links(final_df, updated_links_df)
-    graph = create_graph(final_df_good_links)
-    df_html = create_dataframe_html(final_df_good_links)
+    final_df = prepare_final_df_chunked(
+        scored_path, model.preprocessor.scaler_dict, updated_links_df
+    )
+    os.remove(scored_path)
+    return final_df
+
+
+@stage("run_etl")
+def run_etl(chunked: bool = False, segmented: bool = False):
+    """Runs ETL
+    Args:
+        chunked: extract and refit price model chunk by chunk, for tables not
+            fitting in memory
+        segmented: price listings by per brand and per brand+model models
+            where enough listings exist
+    """
+    LOGGER.info("ETL started")
+    if chunked and segmented:
+        LOGGER.warning("Segmented models are not fitted in chunked mode")
+        segmented = False
+
+    LOGGER.info("Extracting data")
+    final_df = transform_chunked() if chunked else transform_in_memory(segmented)
+    graph = create_graph(final_df)
+    table = create_table_dataset(final_df)
 
     LOGGER.info("Loading data")
-    load_data(graph, df_html)
+    load_data(graph, table)
 
     LOGGER.info("ETL finished")
 
@@ -0,0 +1,208 @@
+import gzip
+import hashlib
+from typing import Dict, List, Optional
+
+import brotli
+
+from logger_etl import LOGGER
+from metrics_etl import count
+
+# Size of parts uploaded to s3, all parts but the last must be at least 5 MiB
+PART_SIZE = 8 * 1024 * 1024
+# Pre-compressed variants published next to artifacts, e.g. car_graph.json.gz
+ENCODING_SUFFIXES = {"gzip": ".gz", "br": ".br"}
+# Artifacts are uploaded under this suffix, then published in one copy
+STAGING_SUFFIX = ".uploading"
+
+
+class S3MultipartWriter:
+    """Writable file uploading its contents to s3 part by part, so at most one
+    part is kept in memory. Upload is completed on close
+    Args:
+        s3: s3 client
+        bucket: s3 bucket
+        key: object key
+        part_size: bytes buffered before a part is uploaded
+        params: extra create_multipart_upload params, e.g. ContentType
+    """
+
+    def __init__(self, s3, bucket: str, key: str, part_size: int = PART_SIZE, **params):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.closed = False
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts: List[dict] = []
+        self.size = 0
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, **params)[
+            "UploadId"
+        ]
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def tell(self) -> int:
+        return self.size
+
+    def upload_part(self, data: bytes):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=data,
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.size += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.upload_part(bytes(self.buffer[: self.part_size]))
+            del self.buffer[: self.part_size]
+        return len(data)
+
+    def close(self):
+        """Uploads last part and completes upload"""
+        if self.closed:
+            return
+        if self.buffer or not self.parts:
+            self.upload_part(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        self.closed = True
+
+    def abort(self):
+        """Drops uploaded parts, nothing is saved to s3"""
+        if self.closed:
+            return
+        self.s3.abort_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+        )
+        self.closed = True
+
+
+class ArtifactUpload:
+    """Writable file streaming an artifact for the web app to s3, optionally
+    compressing it on the fly into pre-compressed variants. Uploads are staged
+    and published on close with sha256 of contents in metadata, so web app
+    never sees a partial artifact and can serve it with content based ETag
+    Args:
+        s3: s3 client
+        bucket: s3 bucket
+        key: artifact key
+        content_type: artifact MIME type
+        compress: also upload gzip and brotli variants
+    """
+
+    def __init__(self, s3, bucket: str, key: str, content_type: str, compress: bool):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.closed = False
+        self.content_type = content_type
+        self.sha256 = hashlib.sha256()
+        self.writers: Dict[Optional[str], S3MultipartWriter] = {}
+        encodings = [None] + (list(ENCODING_SUFFIXES) if compress else [])
+        try:
+            for encoding in encodings:
+                self.writers[encoding] = S3MultipartWriter(
+                    s3, bucket, self.variant_key(encoding) + STAGING_SUFFIX
+                )
+        except Exception:
+            self.abort()
+            raise
+        self.gzip = (
+            gzip.GzipFile(fileobj=self.writers["gzip"], mode="wb", mtime=0)
+            if compress
+            else None
+        )
+        self.brotli = brotli.Compressor() if compress else None
+
+    def variant_key(self, encoding: Optional[str]) -> str:
+        return self.key + (ENCODING_SUFFIXES[encoding] if encoding else "")
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def tell(self) -> int:
+        return self.writers[None].size
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.writers[None].write(data)
+        if self.gzip is not None:
+            self.gzip.write(data)
+        if self.brotli is not None:
+            self.writers["br"].write(self.brotli.process(bytes(data)))
+        return len(data)
+
+    def close(self):
+        """Completes uploads and publishes artifact and its variants"""
+        if self.closed:
+            return
+        try:
+            if self.gzip is not None:
+                self.gzip.close()
+            if self.brotli is not None:
+                self.writers["br"].write(self.brotli.finish())
+            for writer in self.writers.values():
+                writer.close()
+
+            metadata = {"content-sha256": self.sha256.hexdigest()}
+            for encoding, writer in self.writers.items():
+                encoding_params = {"ContentEncoding": encoding} if encoding else {}
+                self.s3.copy_object(
+                    Bucket=self.bucket,
+                    Key=self.variant_key(encoding),
+                    CopySource={"Bucket": self.bucket, "Key": writer.key},
+                    MetadataDirective="REPLACE",
+                    Metadata=metadata,
+                    ContentType=self.content_type,
+                    **encoding_params,
+                )
+                self.s3.delete_object(Bucket=self.bucket, Key=writer.key)
+                LOGGER.info(
+                    f"Published {self.variant_key(encoding)}, {writer.size} bytes"
+                )
+                count("published_bytes", writer.size)
+        except Exception:
+            self.abort()
+            raise
+        self.closed = True
+
+    def abort(self):
+        """Drops all uploads and staged objects, published artifact stays as it
+        was, apart from variants published before the failure"""
+        for writer in self.writers.values():
+            try:
+                if writer.closed:
+                    # Completed or aborted upload, staged object may be left
+                    self.s3.delete_object(Bucket=self.bucket, Key=writer.key)
+                else:
+                    writer.abort()
+            except Exception:
+                LOGGER.exception(f"Could not abort upload of {writer.key}")
+        self.closed = True
+
+    def __enter__(self) -> "ArtifactUpload":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
@@ -0,0 +1,272 @@
+import datetime
+import warnings
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+TARGET = "price"
+DATE_FEATURES = ["docs", "year"]
+NUMERIC_FEATURES = [
+    "docs",
+    "consumption_road",
+    "consumption_city",
+    "consumption_mixed",
+    "kw",
+    "milage",
+    "year",
+    "engine",
+]
+CATEGORICAL_FEATURES = [
+    "steering_wheel",
+    "wheel_drive",
+    "fuel",
+    "doors",
+    "defects",
+    "body",
+    "transmission",
+]
+# High cardinality categorical features, one hot encoded as sparse matrix
+SPARSE_FEATURES = ["brand"]
+
+
+class FeaturePreprocessor:
+    """Learns normalization params and categories of raw car data once, then
+    transforms any batch of it into model features
+    Args:
+        numeric_features: features standardized by mean and std
+        date_features: numeric features given as year-month, turned to days before fit date
+        categorical_features: features one hot encoded into dense columns
+        sparse_features: features one hot encoded into sparse columns
+        target: feature to predict, standardized separately
+    """
+
+    def __init__(
+        self,
+        numeric_features: List[str] = NUMERIC_FEATURES,
+        date_features: List[str] = DATE_FEATURES,
+        categorical_features: List[str] = CATEGORICAL_FEATURES,
+        sparse_features: List[str] = SPARSE_FEATURES,
+        target: str = TARGET,
+    ):
+        self.numeric_features = numeric_features
+        self.date_features = date_features
+        self.categorical_features = categorical_features
+        self.sparse_features = sparse_features
+        self.target = target
+        self.reference_date: Optional[pd.Timestamp] = None
+        self.mean: Optional[np.ndarray] = None
+        self.std: Optional[np.ndarray] = None
+        # Running count of values and sum of squared deviations from mean
+        self.count: Optional[np.ndarray] = None
+        self.sum_sq_dev: Optional[np.ndarray] = None
+        self.categories: Dict[str, list] = {}
+
+    @property
+    def numeric_columns(self) -> List[str]:
+        """Numeric features followed by target"""
+        return self.numeric_features + [self.target]
+
+    def numeric_values(self, df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+        """Converts numeric columns of raw data to float matrix, missing values are NaN
+        Args:
+            df: raw car data
+            columns: numeric features or target to convert
+
+        Returns: matrix with a column per given column
+        """
+        values = np.empty((len(df), len(columns)), dtype=np.float64)
+        for i, feature in enumerate(columns):
+            if feature in self.date_features:
+                dates = pd.to_datetime(df[feature], format="%Y-%m")
+                values[:, i] = (self.reference_date - dates).dt.days
+            else:
+                values[:, i] = pd.to_numeric(df[feature], errors="raise")
+        return values
+
+    def fit(self, df: pd.DataFrame) -> "FeaturePreprocessor":
+        """Learns normalization params and categories
+        Args:
+            df: raw car data
+
+        Returns: fitted preprocessor
+        """
+        self.reference_date = None
+        return self.partial_fit(df)
+
+    def partial_fit(self, df: pd.DataFrame) -> "FeaturePreprocessor":
+        """Updates normalization params and categories with another chunk of
+        data, so they can be learned without loading all data at once
+        Args:
+            df: chunk of raw car data
+
+        Returns: preprocessor fitted on all chunks so far
+        """
+        self._partial_fit(df)
+        return self
+
+    def _partial_fit(
+        self, df: pd.DataFrame
+    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Updates normalization params and categories with chunk of data
+        Args:
+            df: chunk of raw car data
+
+        Returns: numeric columns of chunk and category codes of its categorical
+            and sparse features, so fitted chunk can be transformed without
+            parsing it again
+        """
+        if self.reference_date is None:
+            self.reference_date = pd.Timestamp(datetime.datetime.today())
+            n_columns = len(self.numeric_columns)
+            self.count = np.zeros(n_columns)
+            self.mean = np.full(n_columns, np.nan)
+            self.sum_sq_dev = np.zeros(n_columns)
+            self.categories = {
+                feature: []
+                for feature in self.categorical_features + self.sparse_features
+            }
+
+        values = self.numeric_values(df, self.numeric_columns)
+        count = np.sum(~np.isnan(values), axis=0)
+        with warnings.catch_warnings():
+            # Columns without values get NaN params, they are transformed to 0
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            mean = np.nanmean(values, axis=0)
+            sum_sq_dev = np.nansum((values - mean) ** 2, axis=0)
+            # Merges chunk statistics into running ones (Chan et al.)
+            total = self.count + count
+            delta = np.where(count > 0, mean - np.nan_to_num(self.mean), 0.0)
+            self.mean = np.where(
+                count > 0, np.nan_to_num(self.mean) + delta * count / total, self.mean
+            )
+            self.sum_sq_dev += np.where(
+                count > 0, sum_sq_dev + delta**2 * self.count * count / total, 0.0
+            )
+            self.count = total
+            self.std = np.sqrt(self.sum_sq_dev / (self.count - 1))
+        self.std[self.count < 2] = np.nan
+
+        codes = {}
+        for feature, categories in self.categories.items():
+            # Values are hashed once, their codes are mapped to fitted categories
+            value_codes, values_seen = pd.factorize(df[feature])
+            new_categories = set(values_seen) - set(categories)
+            if new_categories:
+                categories = sorted(categories + list(new_categories), key=str)
+                self.categories[feature] = categories
+            # Missing values have code -1, which picks the trailing -1
+            category_idx = np.append(pd.Index(categories).get_indexer(values_seen), -1)
+            codes[feature] = category_idx[value_codes]
+        return values, codes
+
+    def fit_transform(self, df: pd.DataFrame) -> Tuple[sparse.csr_matrix, np.ndarray]:
+        """Learns normalization params and categories, then transforms the same
+        data without parsing it again
+        Args:
+            df: raw car data
+
+        Returns: float32 feature matrix, columns ordered as feature_names, and
+            standardized target
+        """
+        self.reference_date = None
+        values, codes = self._partial_fit(df)
+        n_numeric = len(self.numeric_features)
+        x = self.encode(values[:, :n_numeric], codes)
+        y = self.standardize(values[:, n_numeric:], [self.target])[:, 0]
+        return x, y
+
+    def standardize(self, values: np.ndarray, columns: List[str]) -> np.ndarray:
+        """Standardizes numeric values, missing values become the mean (0)
+        Args:
+            values: numeric values matrix
+            columns: numeric features or target of values columns
+
+        Returns: standardized values
+        """
+        idx = [self.numeric_columns.index(column) for column in columns]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            standardized = (values - self.mean[idx]) / self.std[idx]
+        return np.nan_to_num(standardized, nan=0.0, posinf=0.0, neginf=0.0)
+
+    @property
+    def feature_names(self) -> List[str]:
+        """Names of transformed feature columns"""
+        return self.numeric_features + [
+            f"{feature}_{category}"
+            for feature in self.categorical_features + self.sparse_features
+            for category in self.categories[feature]
+        ]
+
+    @property
+    def n_dense_features(self) -> int:
+        """Number of leading transformed feature columns kept dense"""
+        return len(self.numeric_features) + sum(
+            len(self.categories[feature]) for feature in self.categorical_features
+        )
+
+    @property
+    def scaler_dict(self) -> Dict[str, Dict[str, float]]:
+        """Mean and std of each numeric feature and target"""
+        return {
+            feature: {"mean": mean, "std": std}
+            for feature, mean, std in zip(self.numeric_columns, self.mean, self.std)
+        }
+
+    def category_codes(self, df: pd.DataFrame, feature: str) -> np.ndarray:
+        """Index of each value among fitted categories, -1 for missing or unknown"""
+        return pd.Categorical(df[feature], categories=self.categories[feature]).codes
+
+    def transform(self, df: pd.DataFrame) -> sparse.csr_matrix:
+        """Transforms raw car data into model features
+        Args:
+            df: raw car data
+
+        Returns: float32 feature matrix, columns ordered as feature_names
+        """
+        codes = {
+            feature: self.category_codes(df, feature)
+            for feature in self.categorical_features + self.sparse_features
+        }
+        return self.encode(self.numeric_values(df, self.numeric_features), codes)
+
+    def encode(
+        self, values: np.ndarray, codes: Dict[str, np.ndarray]
+    ) -> sparse.csr_matrix:
+        """Builds feature matrix from parsed data. Each row has a slot for every
+        numeric feature and one per categorical or sparse feature, slots of
+        zero values and missing categories are dropped
+        Args:
+            values: numeric features matrix
+            codes: index of each value among fitted categories of each
+                categorical and sparse feature, -1 for missing or unknown
+
+        Returns: float32 feature matrix, columns ordered as feature_names
+        """
+        n_rows, n_numeric = values.shape
+        encoded_features = self.categorical_features + self.sparse_features
+        n_slots = n_numeric + len(encoded_features)
+        index_dtype = np.int32 if n_rows * n_slots < 2**31 else np.int64
+        data = np.ones((n_rows, n_slots), dtype=np.float32)
+        indices = np.empty((n_rows, n_slots), dtype=index_dtype)
+        data[:, :n_numeric] = self.standardize(values, self.numeric_features)
+        indices[:, :n_numeric] = np.arange(n_numeric)
+        present = data != 0
+
+        offset = n_numeric
+        for slot, feature in enumerate(encoded_features, start=n_numeric):
+            indices[:, slot] = offset + codes[feature]
+            present[:, slot] = codes[feature] >= 0
+            offset += len(self.categories[feature])
+
+        indptr = np.zeros(n_rows + 1, dtype=index_dtype)
+        indptr[1:] = np.cumsum(present.sum(axis=1))
+        return sparse.csr_matrix(
+            (data[present], indices[present], indptr), shape=(n_rows, offset)
+        )
+
+    def transform_target(self, df: pd.DataFrame) -> np.ndarray:
+        """Standardized target of raw car data"""
+        values = self.numeric_values(df, [self.target])
+        return self.standardize(values, [self.target])[:, 0]
@@ -0,0 +1,94 @@
+import time
+from typing import Iterable, List, Optional
+
+import pandas as pd
+
+from etl_state import read_json_state, write_json_state
+from get_requests import LinkStatus
+
+DAY = 24 * 60 * 60
+# Listings younger than this are rarely gone, they are rechecked less often
+FRESH_LISTING_AGE = 7 * DAY
+FRESH_RECHECK_INTERVAL = 3 * DAY
+OLD_RECHECK_INTERVAL = DAY
+
+
+class LinkLivenessCache:
+    """Last check time and result of each link, so links are rechecked only
+    when their recheck interval has passed
+    Args:
+        entries: url mapped to first_seen and checked_at unix times and working flag
+    """
+
+    def __init__(self, entries: Optional[dict] = None):
+        self.entries = entries or {}
+
+    @classmethod
+    def load(cls, location: str) -> "LinkLivenessCache":
+        """Loads link checks saved by previous runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        return cls(read_json_state(location).get("entries"))
+
+    def save(self, location: str):
+        """Saves link checks for next runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        write_json_state(location, {"entries": self.entries})
+
+    @staticmethod
+    def recheck_interval(entry: dict, now: float) -> float:
+        """Seconds between checks of link, depending on listing age"""
+        if now - entry["first_seen"] < FRESH_LISTING_AGE:
+            return FRESH_RECHECK_INTERVAL
+        return OLD_RECHECK_INTERVAL
+
+    def track(self, urls: Iterable[str], scraped_at: Iterable[Optional[float]]):
+        """Keeps entries only of given urls, adding new ones. Links count as
+        checked when scraped, links without scrape time are checked right away
+        Args:
+            urls: links currently considered working
+            scraped_at: unix time each link was scraped at
+        """
+        entries = {}
+        for url, scrape_time in zip(urls, scraped_at):
+            if url in self.entries:
+                entries[url] = self.entries[url]
+            else:
+                scrape_time = 0 if pd.isna(scrape_time) else float(scrape_time)
+                entries[url] = {
+                    "first_seen": scrape_time,
+                    "checked_at": scrape_time,
+                    "working": True,
+                }
+        self.entries = entries
+
+    def select_due(self, budget: int, now: Optional[float] = None) -> List[str]:
+        """Selects links to check in this run, most overdue first
+        Args:
+            budget: max number of links to check
+            now: current unix time
+
+        Returns: links to check
+        """
+        now = now or time.time()
+        overdue = {
+            url: now - entry["checked_at"] - self.recheck_interval(entry, now)
+            for url, entry in self.entries.items()
+        }
+        due = [url for url, seconds in overdue.items() if seconds >= 0]
+        return sorted(due, key=overdue.get, reverse=True)[:budget]
+
+    def record(self, link_status: LinkStatus, now: Optional[float] = None):
+        """Saves result of link check, links that could not be checked stay due"""
+        if link_status.error is not None:
+            return
+        entry = self.entries[link_status.url]
+        entry["checked_at"] = now or time.time()
+        entry["working"] = link_status.working
+
+    def is_working(self, url: str) -> bool:
+        """Last known link status"""
+        return self.entries[url]["working"]
@@ -0,0 +1,462 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from etl_features import FeaturePreprocessor
+from etl_state import (
+    delete_state,
+    read_json_state,
+    write_json_state,
+    read_pickle_state,
+    write_pickle_state,
+)
+from logger_etl import LOGGER
+
+# Model is refit from scratch when older than this
+REFIT_INTERVAL = 7 * 24 * 60 * 60
+# Model is refit when error on new listings grows over this ratio of training error
+DRIFT_RATIO = 1.5
+# Min number of new listings to judge drift from
+MIN_DRIFT_ROWS = 50
+# Segments priced by own models, from least to most specific
+SEGMENT_LEVELS = [["brand"], ["brand", "model"]]
+# Min listings for a segment to get its own model
+MIN_SEGMENT_ROWS = 50
+SEGMENT_WORKERS = os.cpu_count() or 1
+# Min listings for process pool startup to pay off when fitting segments
+PARALLEL_SEGMENT_ROWS = 200000
+# Latest saved model artifacts kept for rollback, older ones are deleted
+MODEL_ARTIFACTS_KEPT = 3
+# Features shared by parent process, set in segment worker processes
+SHARED_FEATURES = {}
+
+Features = Union[sparse.spmatrix, np.ndarray]
+
+
+class LeastSquares:
+    """Linear least squares solved from accumulated normal equations (X^T X, X^T y),
+    so it can be updated with new rows without reloading previous ones
+    Args:
+        n_features: number of feature columns
+    """
+
+    def __init__(self, n_features: int):
+        n_coef = n_features + 1
+        self.xtx = np.zeros((n_coef, n_coef))
+        self.xty = np.zeros(n_coef)
+        self.n_rows = 0
+        self.coef = np.zeros(n_coef)
+
+    @staticmethod
+    def with_intercept(x: Features) -> Features:
+        """Adds intercept column to features"""
+        ones = np.ones((x.shape[0], 1))
+        if sparse.issparse(x):
+            return sparse.hstack([x, ones], format="csr", dtype=np.float64)
+        return np.hstack([x, ones])
+
+    def accumulate(self, x: Features, y: np.ndarray, sign: int = 1):
+        """Adds rows to normal equations without solving them
+        Args:
+            x: features
+            y: target
+            sign: -1 removes rows added before instead
+        """
+        x = self.with_intercept(x)
+        xtx = x.T @ x
+        self.xtx += sign * (xtx.toarray() if sparse.issparse(xtx) else xtx)
+        self.xty += sign * (x.T @ y)
+        self.n_rows += sign * x.shape[0]
+
+    def solve(self) -> "LeastSquares":
+        """Solves accumulated normal equations"""
+        # Least squares solution handles collinear one hot columns
+        self.coef = np.linalg.lstsq(self.xtx, self.xty, rcond=None)[0]
+        return self
+
+    def predict(self, x: Features) -> np.ndarray:
+        """Predicts target"""
+        return self.with_intercept(x) @ self.coef
+
+
+class PriceModel(LeastSquares):
+    """Linear price model, updated with new listings without reloading
+    previous ones
+    Args:
+        preprocessor: fitted preprocessor producing model features
+    """
+
+    def __init__(self, preprocessor: FeaturePreprocessor):
+        super().__init__(len(preprocessor.feature_names))
+        self.preprocessor = preprocessor
+        self.train_error: Optional[float] = None
+        self.trained_at = time.time()
+        # Predictions stay comparable while preprocessing is the same
+        self.version = time.strftime("%Y%m%d%H%M%S", time.gmtime(self.trained_at))
+
+    def partial_fit(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "PriceModel":
+        """Adds rows to normal equations and solves them again
+        Args:
+            x: model features
+            y: standardized target
+            df: raw car data of rows, used by segmented models
+
+        Returns: updated model
+        """
+        self.accumulate(x, y)
+        return self.solve()
+
+    def forget(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "PriceModel":
+        """Removes rows the model was updated with before, e.g. previous rows of
+        changed listings, and solves normal equations again
+        Args:
+            x: model features of removed rows
+            y: standardized target of removed rows
+            df: raw car data of removed rows, used by segmented models
+
+        Returns: updated model
+        """
+        self.accumulate(x, y, sign=-1)
+        return self.solve()
+
+    def fit(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "PriceModel":
+        """Fits model from scratch
+        Args:
+            x: model features
+            y: standardized target
+            df: raw car data of rows, used by segmented models
+
+        Returns: fitted model
+        """
+        self.partial_fit(x, y, df)
+        self.train_error = self.error(x, y, df)
+        return self
+
+    def predict(
+        self, x: sparse.spmatrix, df: Optional[pd.DataFrame] = None
+    ) -> np.ndarray:
+        """Predicts standardized target
+        Args:
+            x: model features
+            df: raw car data of rows, used by segmented models
+
+        Returns: predictions
+        """
+        return super().predict(x)
+
+    def error(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> float:
+        """Mean absolute error of standardized target"""
+        return float(np.mean(np.abs(self.predict(x, df) - y)))
+
+    def needs_refit(self, now: Optional[float] = None) -> bool:
+        """Checks if scheduled refit is due"""
+        return (now or time.time()) - self.trained_at > REFIT_INTERVAL
+
+    def has_drifted(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> bool:
+        """Checks if model got notably worse on new listings than on training data"""
+        if x.shape[0] < MIN_DRIFT_ROWS or not self.train_error:
+            return False
+        return self.error(x, y, df) > DRIFT_RATIO * self.train_error
+
+
+def attach_shared_features(x_name: str, x_shape: Tuple[int, int], y_name: str):
+    """Attaches features shared by parent process, initializer of segment workers"""
+    x_memory = shared_memory.SharedMemory(name=x_name)
+    y_memory = shared_memory.SharedMemory(name=y_name)
+    SHARED_FEATURES["memory"] = [x_memory, y_memory]
+    SHARED_FEATURES["x"] = np.ndarray(x_shape, dtype=np.float32, buffer=x_memory.buf)
+    SHARED_FEATURES["y"] = np.ndarray(x_shape[0], dtype=np.float64, buffer=y_memory.buf)
+
+
+def fit_segment(
+    rows: np.ndarray, x: Optional[np.ndarray] = None, y: Optional[np.ndarray] = None
+) -> LeastSquares:
+    """Fits model of one segment
+    Args:
+        rows: row positions of segment
+        x: dense features, read from shared memory if not given
+        y: standardized target, read from shared memory if not given
+
+    Returns: fitted segment model
+    """
+    if x is None:
+        x, y = SHARED_FEATURES["x"], SHARED_FEATURES["y"]
+    model = LeastSquares(x.shape[1])
+    model.accumulate(x[rows], y[rows])
+    return model.solve()
+
+
+def fit_segments_in_processes(
+    x: np.ndarray,
+    y: np.ndarray,
+    segment_rows: Dict[tuple, np.ndarray],
+    max_workers: int,
+) -> Dict[tuple, LeastSquares]:
+    """Fits segment models in process pool. Features are put to shared memory
+    once instead of being pickled to every worker
+    Args:
+        x: dense float32 features
+        y: standardized target
+        segment_rows: row positions of each segment
+        max_workers: number of processes
+
+    Returns: segment keys mapped to fitted models
+    """
+    x_memory = shared_memory.SharedMemory(create=True, size=x.nbytes)
+    y = y.astype(np.float64)
+    y_memory = shared_memory.SharedMemory(create=True, size=y.nbytes)
+    try:
+        np.ndarray(x.shape, dtype=np.float32, buffer=x_memory.buf)[:] = x
+        np.ndarray(y.shape, dtype=np.float64, buffer=y_memory.buf)[:] = y
+        keys = list(segment_rows)
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=attach_shared_features,
+            initargs=(x_memory.name, x.shape, y_memory.name),
+        ) as executor:
+            models = executor.map(
+                fit_segment,
+                (segment_rows[key] for key in keys),
+                chunksize=max(1, len(keys) // (max_workers * 4)),
+            )
+            return dict(zip(keys, models))
+    finally:
+        for memory in (x_memory, y_memory):
+            memory.close()
+            memory.unlink()
+
+
+def fit_segments(
+    x: np.ndarray,
+    y: np.ndarray,
+    segment_rows: Dict[tuple, np.ndarray],
+    max_workers: int = SEGMENT_WORKERS,
+) -> Dict[tuple, LeastSquares]:
+    """Fits segment models, in parallel processes when available. AWS Lambda has
+    no shared memory, there models are fitted one after another
+    Args:
+        x: dense float32 features
+        y: standardized target
+        segment_rows: row positions of each segment
+        max_workers: number of processes
+
+    Returns: segment keys mapped to fitted models
+    """
+    if max_workers > 1 and len(segment_rows) > 1 and len(x) >= PARALLEL_SEGMENT_ROWS:
+        try:
+            return fit_segments_in_processes(x, y, segment_rows, max_workers)
+        except OSError as e:
+            LOGGER.warning(f"Fitting segments serially, no process pool: {e!r}")
+    return {key: fit_segment(rows, x, y) for key, rows in segment_rows.items()}
+
+
+class SegmentedPriceModel(PriceModel):
+    """Global price model refined by per brand and per brand+model models, each
+    listing is priced by the most specific model fitted for it. Segment models
+    use dense features only, as brand columns are constant within a segment
+    Args:
+        preprocessor: fitted preprocessor producing model features
+        min_segment_rows: min listings for a segment to get its own model
+        max_workers: processes fitting segment models
+    """
+
+    def __init__(
+        self,
+        preprocessor: FeaturePreprocessor,
+        min_segment_rows: int = MIN_SEGMENT_ROWS,
+        max_workers: int = SEGMENT_WORKERS,
+    ):
+        super().__init__(preprocessor)
+        self.min_segment_rows = min_segment_rows
+        self.max_workers = max_workers
+        self.segments: Dict[tuple, LeastSquares] = {}
+        # Segment keys mapped to rows, MAE of segment and global model in EUR
+        self.segment_errors: Dict[tuple, dict] = {}
+
+    @staticmethod
+    def segment_rows(df: pd.DataFrame) -> Dict[tuple, np.ndarray]:
+        """Row positions of each segment, less specific segments first
+        Args:
+            df: raw car data
+
+        Returns: segment keys, e.g. (brand,) or (brand, model), mapped to row positions
+        """
+        rows = {}
+        for level in SEGMENT_LEVELS:
+            for key, positions in df.groupby(level, sort=False).indices.items():
+                rows[key if isinstance(key, tuple) else (key,)] = positions
+        return rows
+
+    def dense_features(self, x: sparse.spmatrix) -> np.ndarray:
+        """Dense features used by segment models"""
+        return x[:, : self.preprocessor.n_dense_features].toarray()
+
+    def partial_fit(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "SegmentedPriceModel":
+        """Updates global model and models of segments that have one, new
+        segments get their models on next refit"""
+        super().partial_fit(x, y)
+        dense = self.dense_features(x)
+        for key, rows in self.segment_rows(df).items():
+            if key in self.segments:
+                self.segments[key].accumulate(dense[rows], y[rows])
+                self.segments[key].solve()
+        return self
+
+    def forget(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "SegmentedPriceModel":
+        """Removes rows from global model and from models of their segments"""
+        super().forget(x, y)
+        dense = self.dense_features(x)
+        for key, rows in self.segment_rows(df).items():
+            if key in self.segments:
+                self.segments[key].accumulate(dense[rows], y[rows], sign=-1)
+                self.segments[key].solve()
+        return self
+
+    def fit(
+        self, x: sparse.spmatrix, y: np.ndarray, df: Optional[pd.DataFrame] = None
+    ) -> "SegmentedPriceModel":
+        """Fits global model and models of segments with enough listings"""
+        super().partial_fit(x, y)
+        segment_rows = {
+            key: rows
+            for key, rows in self.segment_rows(df).items()
+            if len(rows) >= self.min_segment_rows
+        }
+        dense = self.dense_features(x)
+        start = time.perf_counter()
+        self.segments = fit_segments(dense, y, segment_rows, self.max_workers)
+        LOGGER.info(
+            f"Fitted {len(self.segments)} segment models in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+        self.train_error = self.error(x, y, df)
+        self.report_segment_errors(x, y, segment_rows)
+        return self
+
+    def predict(
+        self, x: sparse.spmatrix, df: Optional[pd.DataFrame] = None
+    ) -> np.ndarray:
+        """Predicts standardized target by most specific model of each row"""
+        predictions = super().predict(x)
+        dense = self.dense_features(x)
+        for key, rows in self.segment_rows(df).items():
+            if key in self.segments:
+                predictions[rows] = self.segments[key].predict(dense[rows])
+        return predictions
+
+    def report_segment_errors(
+        self, x: sparse.spmatrix, y: np.ndarray, segment_rows: Dict[tuple, np.ndarray]
+    ):
+        """Saves and logs training MAE of each segment model next to MAE of
+        global model on the same listings"""
+        price_std = self.preprocessor.scaler_dict[self.preprocessor.target]["std"]
+        global_errors = np.abs(super().predict(x) - y) * price_std
+        dense = self.dense_features(x)
+        self.segment_errors = {
+            key: {
+                "rows": len(rows),
+                "mae": float(
+                    np.mean(np.abs(self.segments[key].predict(dense[rows]) - y[rows]))
+                    * price_std
+                ),
+                "global_mae": float(np.mean(global_errors[rows])),
+            }
+            for key, rows in segment_rows.items()
+        }
+        for level in SEGMENT_LEVELS:
+            errors = [
+                error
+                for key, error in self.segment_errors.items()
+                if len(key) == len(level)
+            ]
+            if not errors:
+                continue
+            rows = sum(error["rows"] for error in errors)
+            mae = sum(error["mae"] * error["rows"] for error in errors) / rows
+            global_mae = sum(error["global_mae"] * error["rows"] for error in errors)
+            LOGGER.info(
+                f"{'+'.join(level)} models: {len(errors)} segments, {rows} listings, "
+                f"MAE {mae:.0f} EUR vs {global_mae / rows:.0f} EUR of global model"
+            )
+
+
+def fit_chunked(chunks: Callable[[], Iterable[pd.DataFrame]]) -> PriceModel:
+    """Fits model without loading all data at once. Preprocessor is fitted in
+    one pass over the chunks and normal equations are accumulated in another
+    Args:
+        chunks: returns new iterator over chunks of raw car data on each call
+
+    Returns: fitted model, its training error is left to the scoring pass
+    """
+    preprocessor = FeaturePreprocessor()
+    for chunk in chunks():
+        preprocessor.partial_fit(chunk)
+
+    model = PriceModel(preprocessor)
+    for chunk in chunks():
+        model.accumulate(
+            preprocessor.transform(chunk), preprocessor.transform_target(chunk)
+        )
+    LOGGER.info(f"Fitted price model on {model.n_rows} rows in chunks")
+    return model.solve()
+
+
+def load_model(location: str) -> Optional[PriceModel]:
+    """Loads latest saved model
+    Args:
+        location: s3://bucket/prefix or local folder of model artifacts
+
+    Returns: model, None if no model is saved
+    """
+    latest = read_json_state(f"{location}/latest.json")
+    if not latest:
+        return None
+    model = read_pickle_state(f"{location}/{latest['artifact']}")
+    LOGGER.info(f"Loaded price model {latest['artifact']}")
+    return model
+
+
+def save_model(model: PriceModel, location: str, keep: int = MODEL_ARTIFACTS_KEPT):
+    """Saves model as new versioned artifact and marks it as latest, only the
+    latest artifacts are kept
+    Args:
+        model: model to save
+        location: s3://bucket/prefix or local folder of model artifacts
+        keep: number of latest artifacts kept
+    """
+    latest = read_json_state(f"{location}/latest.json")
+    # Earlier runs recorded only the latest artifact
+    artifacts = latest.get("artifacts", [latest["artifact"]] if latest else [])
+    saved_at = time.strftime("%Y%m%d%H%M%S", time.gmtime())
+    artifact = f"price_model_{model.version}_{saved_at}.pkl"
+    write_pickle_state(f"{location}/{artifact}", model)
+    artifacts = [artifact] + [
+        previous for previous in artifacts if previous != artifact
+    ]
+    write_json_state(
+        f"{location}/latest.json", {"artifact": artifact, "artifacts": artifacts[:keep]}
+    )
+    # Deleted only after latest.json stops listing them
+    for previous in artifacts[keep:]:
+        delete_state(f"{location}/{previous}")
+    LOGGER.info(f"Saved price model {artifact}, deleted {len(artifacts[keep:])} old")
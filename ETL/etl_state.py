@@ -0,0 +1,220 @@
+import json
+import os
+import pickle
+import shutil
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from botocore.exceptions import ClientError
+
+from logger_etl import LOGGER
+
+LOCAL_STATE_DIR = "/tmp/etl_state"
+
+
+def split_s3_location(location: str) -> Optional[Tuple[str, str]]:
+    """Splits s3://bucket/key location
+    Args:
+        location: s3 location or local file path
+
+    Returns: bucket and key, None for local file path
+    """
+    if not location.startswith("s3://"):
+        return None
+    bucket, _, key = location[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def fetch_to_local(location: str) -> Optional[str]:
+    """Makes state file available on local disk
+    Args:
+        location: s3://bucket/key location or local file path
+
+    Returns: local file path, None if nothing is saved at location
+    """
+    s3_location = split_s3_location(location)
+    if not s3_location:
+        return location if os.path.exists(location) else None
+
+    bucket, key = s3_location
+    local_path = os.path.join(LOCAL_STATE_DIR, key.replace("/", "_"))
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    try:
+        boto3.client("s3").download_file(bucket, key, local_path)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return local_path
+
+
+def publish_from_local(local_path: str, location: str):
+    """Saves local file to state location
+    Args:
+        local_path: file to save
+        location: s3://bucket/key location or local file path
+    """
+    s3_location = split_s3_location(location)
+    if s3_location:
+        bucket, key = s3_location
+        boto3.client("s3").upload_file(local_path, bucket, key)
+    elif os.path.abspath(local_path) != os.path.abspath(location):
+        os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+        shutil.move(local_path, location)
+
+
+def read_json_state(location: str) -> dict:
+    """Reads json state saved by previous runs
+    Args:
+        location: s3://bucket/key location or local file path
+
+    Returns: saved state, empty if nothing saved yet
+    """
+    local_path = fetch_to_local(location)
+    if not local_path:
+        return {}
+    with open(local_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_state(location: str, state: dict):
+    """Saves json state for next runs
+    Args:
+        location: s3://bucket/key location or local file path
+        state: state to save
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    local_path = os.path.join(LOCAL_STATE_DIR, os.path.basename(location) + ".tmp")
+    with open(local_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    publish_from_local(local_path, location)
+
+
+def read_pickle_state(location: str):
+    """Reads pickled object saved by previous runs
+    Args:
+        location: s3://bucket/key location or local file path
+
+    Returns: saved object, None if nothing saved yet
+    """
+    local_path = fetch_to_local(location)
+    if not local_path:
+        return None
+    with open(local_path, "rb") as f:
+        return pickle.load(f)
+
+
+def write_pickle_state(location: str, obj):
+    """Saves pickled object for next runs
+    Args:
+        location: s3://bucket/key location or local file path
+        obj: object to save
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    local_path = os.path.join(LOCAL_STATE_DIR, os.path.basename(location) + ".tmp")
+    with open(local_path, "wb") as f:
+        pickle.dump(obj, f)
+    publish_from_local(local_path, location)
+
+
+def delete_state(location: str):
+    """Deletes state saved by previous runs, nothing happens if it is not saved
+    Args:
+        location: s3://bucket/key location or local file path
+    """
+    s3_location = split_s3_location(location)
+    if s3_location:
+        bucket, key = s3_location
+        boto3.client("s3").delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(location):
+        os.remove(location)
+
+
+def load_snapshot(location: str) -> Optional[pd.DataFrame]:
+    """Loads columnar snapshot of car table saved by previous run
+    Args:
+        location: s3://bucket/key location or local parquet file path
+
+    Returns: snapshot data, None if no snapshot is saved
+    """
+    local_path = fetch_to_local(location)
+    if not local_path:
+        return None
+    snapshot = pq.read_table(local_path, memory_map=True).to_pandas()
+    LOGGER.info(f"Loaded snapshot with {len(snapshot)} rows")
+    return snapshot
+
+
+def save_snapshot(df: pd.DataFrame, location: str):
+    """Saves columnar snapshot of car table for next runs
+    Args:
+        df: car table data
+        location: s3://bucket/key location or local parquet file path
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    local_path = os.path.join(LOCAL_STATE_DIR, "car_table_snapshot.parquet")
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), local_path)
+    publish_from_local(local_path, location)
+    LOGGER.info(f"Saved snapshot with {len(df)} rows")
+
+
+@contextmanager
+def snapshot_writer(location: str, schema: pa.Schema) -> Iterator[pq.ParquetWriter]:
+    """Saves columnar snapshot of car table for next runs chunk by chunk, it is
+    saved once all chunks are written
+    Args:
+        location: s3://bucket/key location or local parquet file path
+        schema: types of car table columns
+
+    Returns: parquet writer of car table data chunks as Arrow tables
+    """
+    os.makedirs(LOCAL_STATE_DIR, exist_ok=True)
+    local_path = os.path.join(LOCAL_STATE_DIR, "car_table_snapshot.parquet")
+    with pq.ParquetWriter(local_path, schema) as writer:
+        yield writer
+    publish_from_local(local_path, location)
+    LOGGER.info("Saved snapshot chunk by chunk")
+
+
+def merge_snapshot(
+    snapshot: pd.DataFrame, changes: pd.DataFrame, content_columns: List[str]
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Merges new and changed items into snapshot. Items scraped again with the
+    same content keep the state columns of their snapshot rows, e.g. price
+    predictions, so they are not processed again
+    Args:
+        snapshot: car table data from previous run
+        changes: items scraped since snapshot was saved
+        content_columns: columns compared to tell if an item changed, besides url
+
+    Returns: up to date car table data, and snapshot rows of changed items
+    """
+    if changes.empty:
+        return snapshot, snapshot.iloc[:0]
+    changes = changes.drop_duplicates("url", keep="last").reset_index(drop=True)
+    previous = snapshot.drop_duplicates("url", keep="last").set_index("url")
+    known = changes["url"].isin(previous.index).to_numpy()
+    previous = previous.reindex(changes["url"]).reset_index(drop=True)
+
+    unchanged = known.copy()
+    for column in content_columns:
+        old, new = previous[column].to_numpy(), changes[column].to_numpy()
+        unchanged &= (old == new) | (pd.isna(old) & pd.isna(new))
+
+    for column in snapshot.columns.difference(changes.columns):
+        changes[column] = previous[column].where(unchanged).to_numpy()
+    replaced_urls = changes.loc[known & ~unchanged, "url"]
+
+    merged = pd.concat(
+        [snapshot[~snapshot["url"].isin(changes["url"])], changes], ignore_index=True
+    )
+    replaced = snapshot[snapshot["url"].isin(replaced_urls)].reset_index(drop=True)
+    LOGGER.info(
+        f"Merged {len(changes)} scraped items into snapshot: "
+        f"{(~known).sum()} new, {len(replaced_urls)} changed, {unchanged.sum()} unchanged"
+    )
+    return merged, replaced
@@ -1,28 +1,106 @@
 import asyncio
+import random
+import time
+from typing import Callable, Iterable, List, NamedTuple, Optional
 
 import aiohttp
 
+from metrics_etl import record_http
 
-async def fetch(s, url):
-    async with s.get(url) as r:
-        return False if r.status >= 400 else True
+MAX_CONCURRENCY = 100
+LIMIT_PER_HOST = 20
+REQUEST_TIMEOUT = 10
+RETRIES = 3
+BACKOFF_SECONDS = 0.5
+# Throttling and temporary server errors, link is checked again after backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
 
-async def fetch_all(s, urls):
-    tasks = []
-    for url in urls:
-        task = asyncio.create_task(fetch(s, url))
-        tasks.append(task)
-    res = await asyncio.gather(*tasks)
-    return res
+class LinkStatus(NamedTuple):
+    """Result of checking a link
+    Args:
+        url: checked link
+        working: False only if server confirmed link is gone
+        status: last HTTP status, None if no response was received
+        error: last error, None if link was checked
+    """
 
+    url: str
+    working: bool
+    status: Optional[int] = None
+    error: Optional[str] = None
 
-async def main(urls):
-    async with aiohttp.ClientSession() as session:
-        responses = await fetch_all(session, urls)
+
+async def request_status(s, method, url) -> int:
+    start = time.perf_counter()
+    try:
+        async with s.request(method, url, allow_redirects=True) as r:
+            record_http(r.status, time.perf_counter() - start, r.content_length or 0)
+            return r.status
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        record_http(None, time.perf_counter() - start)
+        raise
+
+
+async def fetch(s, url) -> LinkStatus:
+    """Checks link with HEAD request, GET is used to confirm failed HEAD as
+    some servers do not support it. Throttled and failed requests are retried
+    with exponential backoff
+    """
+    status, error = None, None
+    for attempt in range(RETRIES + 1):
+        if attempt:
+            await asyncio.sleep(
+                BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            )
+        try:
+            status = await request_status(s, "HEAD", url)
+            if status >= 400 and status not in RETRY_STATUSES:
+                status = await request_status(s, "GET", url)
+            error = None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            status, error = None, repr(e)
+            continue
+        if status not in RETRY_STATUSES:
+            return LinkStatus(url, status < 400, status)
+    # Link could not be checked, it is kept as working
+    return LinkStatus(url, True, status, error or f"status {status}")
+
+
+async def fetch_all(s, urls, on_result=None) -> List[LinkStatus]:
+    results = [None] * len(urls)
+    pending = iter(enumerate(urls))
+
+    async def worker():
+        for i, url in pending:
+            results[i] = await fetch(s, url)
+            if on_result:
+                on_result(results[i])
+
+    workers = min(MAX_CONCURRENCY, len(urls))
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    return results
+
+
+async def main(urls, on_result=None):
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONCURRENCY, limit_per_host=LIMIT_PER_HOST
+    )
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        responses = await fetch_all(session, urls, on_result)
 
     return responses
 
 
-def get_responses(urls):
-    return asyncio.run(main(urls))
+def get_link_statuses(
+    urls: Iterable[str], on_result: Optional[Callable[[LinkStatus], None]] = None
+) -> List[LinkStatus]:
+    """Checks links concurrently
+    Args:
+        urls: links to check
+        on_result: called with each link status as soon as it is checked
+
+    Returns: link statuses in the order of urls
+    """
+    return asyncio.run(main(list(urls), on_result))
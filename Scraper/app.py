@@ -1,9 +1,19 @@
 from logger_scraper import LOGGER
+from scraper_client import MAX_WORKERS
 from scraper_main import run_scraper
 
 def lambda_handler(event, context):
     LOGGER.info(f"Executing lambda function, event: {event}")
     pages_to_scrape = event.get("pages") or 2
-    run_scraper(pages=pages_to_scrape)
+    max_workers = event.get("max_workers") or MAX_WORKERS
+    incremental = bool(event.get("incremental"))
+    run_scraper(
+        pages=pages_to_scrape,
+        max_workers=max_workers,
+        incremental=incremental,
+        cache_dir=event.get("cache_dir"),
+        replay=bool(event.get("replay")),
+        streaming=bool(event.get("streaming")),
+    )
 
     return {"message": "Scraper finished"}
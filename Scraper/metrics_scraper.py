@@ -0,0 +1,307 @@
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import resource
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Set
+
+from logger_scraper import LOGGER
+
+SERVICE = "Scraper"
+# CloudWatch namespace of metrics logged in embedded metric format
+METRICS_NAMESPACE = "CarScraper"
+# Stage profiled with cProfile, e.g. PROFILE_STAGE=scrape_pages
+PROFILE_STAGE = os.environ.get("PROFILE_STAGE", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "/tmp/profiles")
+# Functions listed in logged profile summary
+PROFILE_TOP_FUNCTIONS = 20
+# Upper bounds of latency histogram buckets in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+METRIC_UNITS = {"_seconds": "Seconds", "_mb": "Megabytes", "_bytes": "Bytes"}
+# Seconds between resident memory samples while stages run
+RSS_SAMPLE_SECONDS = 0.02
+
+# Metrics are logged as bare json lines, so CloudWatch can parse them
+METRICS_LOGGER = logging.getLogger(f"Car Scraper {SERVICE} metrics")
+METRICS_LOGGER.setLevel(logging.INFO)
+METRICS_LOGGER.propagate = False
+metrics_handler = logging.StreamHandler()
+metrics_handler.setFormatter(logging.Formatter("%(message)s"))
+METRICS_LOGGER.addHandler(metrics_handler)
+
+
+class Histogram:
+    """Counts of observed values per bucket, e.g. of request latencies
+    Args:
+        buckets: ascending upper bounds of buckets, larger values go to last bucket
+    """
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self.lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of bucket holding q quantile, at most max value"""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            labels = [f"le_{bound}" for bound in self.buckets] + ["le_inf"]
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 4),
+                "max": round(self.max, 4),
+                "p50": round(self.quantile(0.5), 4) if self.count else None,
+                "p95": round(self.quantile(0.95), 4) if self.count else None,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class StageStats:
+    """Item counts, HTTP request stats and resident memory collected while a
+    stage runs
+    Args:
+        name: stage name
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.counts = Counter()
+        self.http_latency = Histogram()
+        self.start_rss_mb = self.peak_rss_mb = current_rss_mb()
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1):
+        with self.lock:
+            self.counts[name] += value
+
+    def record_http(self, status: int, seconds: float, n_bytes: int = 0):
+        """Adds HTTP request, status None for requests that got no response"""
+        with self.lock:
+            self.counts["http_requests"] += 1
+            self.counts[f"http_{status // 100}xx" if status else "http_errors"] += 1
+            self.counts["http_bytes"] += n_bytes
+        self.http_latency.observe(seconds)
+
+    def observe_rss(self, rss_mb: float):
+        with self.lock:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb)
+
+
+# Stages running in each thread, counts are added to all of them so nested
+# stages report to their parents. Worker threads of a stage report to it when
+# their work is wrapped with with_stages
+THREAD_STAGES = threading.local()
+# Stages running in any thread, their memory is sampled in background
+RUNNING_STAGES: Set[StageStats] = set()
+RUNNING_STAGES_CHANGED = threading.Condition()
+# Process the memory sampler thread was started in, forked processes start their own
+SAMPLER_PID = {"pid": None}
+
+
+def current_stages() -> List[StageStats]:
+    """Stages running in calling thread, or handed to it by with_stages"""
+    return getattr(THREAD_STAGES, "stages", [])
+
+
+def with_stages(function: Callable) -> Callable:
+    """Wraps function so counts it adds in another thread, e.g. a worker of a
+    pool, go to the stages running in calling thread
+    Args:
+        function: work to run in another thread
+
+    Returns: wrapped function
+    """
+    stages = current_stages()
+
+    @functools.wraps(function)
+    def run_in_stages(*args, **kwargs):
+        previous = current_stages()
+        THREAD_STAGES.stages = previous + [s for s in stages if s not in previous]
+        try:
+            return function(*args, **kwargs)
+        finally:
+            THREAD_STAGES.stages = previous
+
+    return run_in_stages
+
+
+def count(name: str, value: int = 1):
+    """Adds items processed to stages of calling thread"""
+    for stats in current_stages():
+        stats.count(name, value)
+
+
+def record_http(status: int, seconds: float, n_bytes: int = 0):
+    """Adds HTTP request to stages of calling thread
+    Args:
+        status: response status, None if no response was received
+        seconds: request duration
+        n_bytes: response body size
+    """
+    for stats in current_stages():
+        stats.record_http(status, seconds, n_bytes)
+
+
+def current_rss_mb() -> float:
+    """Resident memory of process now, peak so far where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_rss():
+    """Keeps peak resident memory of running stages, runs in background thread"""
+    while True:
+        with RUNNING_STAGES_CHANGED:
+            while not RUNNING_STAGES:
+                RUNNING_STAGES_CHANGED.wait()
+            stages = list(RUNNING_STAGES)
+        rss_mb = current_rss_mb()
+        for stats in stages:
+            stats.observe_rss(rss_mb)
+        time.sleep(RSS_SAMPLE_SECONDS)
+
+
+def start_running(stats: StageStats):
+    """Adds stage to calling thread and to memory sampling"""
+    THREAD_STAGES.stages = current_stages() + [stats]
+    with RUNNING_STAGES_CHANGED:
+        if SAMPLER_PID["pid"] != os.getpid():
+            SAMPLER_PID["pid"] = os.getpid()
+            threading.Thread(target=sample_rss, daemon=True).start()
+        RUNNING_STAGES.add(stats)
+        RUNNING_STAGES_CHANGED.notify()
+
+
+def stop_running(stats: StageStats):
+    """Removes stage from calling thread and from memory sampling"""
+    THREAD_STAGES.stages = [s for s in current_stages() if s is not stats]
+    with RUNNING_STAGES_CHANGED:
+        RUNNING_STAGES.discard(stats)
+    stats.observe_rss(current_rss_mb())
+
+
+def emit_metrics(stats: StageStats, measurements: Dict[str, float]):
+    """Logs stage metrics as json in CloudWatch embedded metric format
+    Args:
+        stats: counts collected by stage
+        measurements: resource use of stage
+    """
+    metrics = {**measurements, **stats.counts}
+    record = {
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Service", "Stage"]],
+                    "Metrics": [
+                        {
+                            "Name": name,
+                            "Unit": next(
+                                (
+                                    unit
+                                    for suffix, unit in METRIC_UNITS.items()
+                                    if name.endswith(suffix)
+                                ),
+                                "Count",
+                            ),
+                        }
+                        for name in metrics
+                    ],
+                }
+            ],
+        },
+        "Service": SERVICE,
+        "Stage": stats.name,
+        **metrics,
+    }
+    if stats.http_latency.count:
+        record["http_latency"] = stats.http_latency.snapshot()
+    METRICS_LOGGER.info(json.dumps(record))
+
+
+def dump_profile(name: str, profiler: cProfile.Profile):
+    """Saves profile of stage to PROFILE_DIR and logs its slowest functions"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}_{int(time.time())}.prof")
+    profiler.dump_stats(path)
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(
+        PROFILE_TOP_FUNCTIONS
+    )
+    LOGGER.info(f"Saved profile of {name} to {path}\n{summary.getvalue()}")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[StageStats]:
+    """Measures wall time, CPU time and peak memory of a stage and logs them
+    with counts added while it runs. Works as decorator too. Memory is sampled
+    for the whole process, so it includes other threads running meanwhile.
+    Stage named by PROFILE_STAGE env variable is profiled, only in the thread
+    running it
+    Args:
+        name: stage name
+
+    Returns: stats to add stage counts to
+    """
+    stats = StageStats(name)
+    start_running(stats)
+    profiler = cProfile.Profile() if name == PROFILE_STAGE else None
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    if profiler:
+        profiler.enable()
+    failed = 0
+    try:
+        yield stats
+    except BaseException:
+        failed = 1
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        stop_running(stats)
+        wall_seconds = time.perf_counter() - start_wall
+        emit_metrics(
+            stats,
+            {
+                "wall_seconds": round(wall_seconds, 4),
+                "cpu_seconds": round(time.process_time() - start_cpu, 4),
+                "peak_rss_mb": round(stats.peak_rss_mb, 1),
+                "rss_delta_mb": round(stats.peak_rss_mb - stats.start_rss_mb, 1),
+                "failed": failed,
+            },
+        )
+        LOGGER.info(f"Stage {name} took {wall_seconds:.2f}s")
+        if profiler:
+            dump_profile(name, profiler)
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+CACHE_DIR = "/tmp/scraper_cache"
+CACHE_TTL = 60 * 60
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class HttpCache:
+    """On disk cache of fetched pages. Page bodies are stored by their content
+    hash, index keeps validators and access times of each url
+    Args:
+        directory: cache folder
+        ttl: seconds a page is served without revalidating it
+        max_bytes: max size of stored bodies, least recently used are evicted
+        replay: serve only from cache, never request the website
+    """
+
+    def __init__(
+        self,
+        directory: str = CACHE_DIR,
+        ttl: float = CACHE_TTL,
+        max_bytes: int = CACHE_MAX_BYTES,
+        replay: bool = False,
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(directory, "index.json")
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        if os.path.exists(self._index_path):
+            with open(self._index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        self._sizes = {entry["digest"]: entry["size"] for entry in self.index.values()}
+        self._refs = Counter(entry["digest"] for entry in self.index.values())
+        self._total_bytes = sum(self._sizes.values())
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", f"{digest}.html")
+
+    def get_entry(self, url: str) -> Optional[dict]:
+        """Gets copy of cached entry of url, None if url is not cached"""
+        with self._lock:
+            entry = self._get_entry(url)
+            return dict(entry) if entry else None
+
+    def _get_entry(self, url: str) -> Optional[dict]:
+        """Gets entry of url, dropping it if its body is gone. Lock must be held"""
+        entry = self.index.get(url)
+        if entry and not os.path.exists(self._object_path(entry["digest"])):
+            self._remove(url)
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        """Checks if entry can be served without revalidation"""
+        return self.replay or time.time() - entry["fetched_at"] < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry: Optional[dict]) -> Dict[str, str]:
+        """Creates headers for conditional request of cached entry"""
+        if not entry:
+            return {}
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def _read(self, entry: dict) -> str:
+        """Reads cached page of entry and marks it as recently used. Lock must be held"""
+        entry["accessed_at"] = time.time()
+        with open(self._object_path(entry["digest"]), encoding="utf-8") as f:
+            return f.read()
+
+    def read_fresh(self, url: str) -> Optional[str]:
+        """Reads cached page of url if it can be served without revalidation.
+        Lookup and read happen under one lock, so other workers cannot evict
+        the page in between
+        Args:
+            url: link to the page
+
+        Returns: page HTML, None if url is not cached or is stale
+        """
+        with self._lock:
+            entry = self._get_entry(url)
+            if not entry or not self.is_fresh(entry):
+                return None
+            return self._read(entry)
+
+    def revalidate(self, url: str) -> Optional[str]:
+        """Marks cached page as fresh after server replied it is not modified
+        Args:
+            url: link to the page
+
+        Returns: page HTML, None if page was evicted since the request was sent
+        """
+        with self._lock:
+            entry = self._get_entry(url)
+            if not entry:
+                return None
+            entry["fetched_at"] = time.time()
+            return self._read(entry)
+
+    def store(
+        self,
+        url: str,
+        text: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ):
+        """Stores fetched page
+        Args:
+            url: link to the page
+            text: page HTML
+            etag: ETag header of response
+            last_modified: Last-Modified header of response
+        """
+        content = text.encode("utf-8")
+        digest = hashlib.sha256(content).hexdigest()
+        now = time.time()
+        with self._lock:
+            if url in self.index:
+                self._remove(url)
+            if digest not in self._sizes:
+                with open(self._object_path(digest), "wb") as f:
+                    f.write(content)
+                self._sizes[digest] = len(content)
+                self._total_bytes += len(content)
+            self._refs[digest] += 1
+            self.index[url] = {
+                "digest": digest,
+                "size": len(content),
+                "etag": etag,
+                "last_modified": last_modified,
+                "fetched_at": now,
+                "accessed_at": now,
+            }
+            self._evict()
+
+    def _remove(self, url: str):
+        """Removes url from index, and its body once no other url refers to it"""
+        digest = self.index.pop(url)["digest"]
+        self._refs[digest] -= 1
+        if self._refs[digest] <= 0:
+            del self._refs[digest]
+            self._total_bytes -= self._sizes.pop(digest, 0)
+            if os.path.exists(self._object_path(digest)):
+                os.remove(self._object_path(digest))
+
+    def _evict(self):
+        """Removes least recently used pages until cache fits max_bytes"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        for url in sorted(self.index, key=lambda u: self.index[u]["accessed_at"]):
+            self._remove(url)
+            if self._total_bytes <= self.max_bytes:
+                break
+
+    def save(self):
+        """Saves cache index for next runs"""
+        with self._lock:
+            tmp_path = f"{self._index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.index, f)
+            os.replace(tmp_path, self._index_path)
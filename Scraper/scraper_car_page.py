@@ -1,10 +1,20 @@
-import json
+import os
 import re
 from decimal import Decimal
 from typing import Dict, Tuple, Optional
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+
+from scraper_client import ScraperClient
+
+# BeautifulSoup backend, "lxml" is faster than the default "html.parser"
+HTML_PARSER = os.environ.get("SCRAPER_HTML_PARSER", "html.parser")
+# Only car parameter subtrees are built when parsing car page
+CAR_PAGE_STRAINER = SoupStrainer("div", class_="param")
+# Liters are the first number that is followed by "l", power is the number before "kW"
+LITERS_PATTERN = re.compile(r"(\d[\d.]*).*l")
+KW_PATTERN = re.compile(r"(\d+) kW")
 
 
 def extract_engine_and_kw(s: str) -> Tuple[Optional[float], Optional[int]]:
@@ -15,14 +25,12 @@ def extract_engine_and_kw(s: str) -> Tuple[Optional[float], Optional[int]]:
     Returns:
         Tuple containing liters and KW
     """
-    try:
-        liters = float(re.findall(r"[\d.]+", (re.findall(r"\d+.*l", s)[0]))[0])
-    except (IndexError, TypeError):
-        liters = None
-    try:
-        kw = int(re.findall(r"\d+", (re.findall(r"\d+ kW", s)[0]))[0])
-    except (IndexError, TypeError):
-        kw = None
+    if not s:
+        return None, None
+    liters_match = LITERS_PATTERN.search(s)
+    kw_match = KW_PATTERN.search(s)
+    liters = float(liters_match.group(1)) if liters_match else None
+    kw = int(kw_match.group(1)) if kw_match else None
     return liters, kw
 
 
@@ -44,6 +52,32 @@ class Car:
         kwargs: other details about car
     """
 
+    __slots__ = (
+        "price",
+        "brand",
+        "model",
+        "year",
+        "engine",
+        "kw",
+        "fuel",
+        "body",
+        "color",
+        "transmission",
+        "milage",
+        "wheel_drive",
+        "defects",
+        "steering_wheel",
+        "doors",
+        "docs",
+        "rims",
+        "first_registration",
+        "consumption_city",
+        "consumption_road",
+        "consumption_mixed",
+        "url",
+        "working_link",
+    )
+
     def __init__(self, link: str, **kwargs):
         self.price = extract_mileage_or_price(kwargs.get("Kaina"))
         self.brand = kwargs.get("Markė")
@@ -76,35 +110,56 @@ class Car:
         self.working_link = True
 
     def get_json(self):
-        """Creates Json output of all information"""
-        return json.loads(json.dumps(self.__dict__), parse_float=Decimal)
+        """Creates DynamoDB item of all information, floats are stored as Decimal"""
+        item = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            item[field] = Decimal(repr(value)) if isinstance(value, float) else value
+        return item
 
     def __repr__(self):
         return f"{self.brand} {self.model}, {self.year}, {self.price} eur."
 
 
-def get_car_details(link: str, header: Dict[str, str]) -> Car:
-    """Get details about a car provided via link
+def parse_car_details(page_text: str, parser: str = HTML_PARSER) -> Dict[str, str]:
+    """Parses car parameters from car page
     Args:
-        link: link to the page of a car
-        header: header params to use
+        page_text: car page HTML
+        parser: BeautifulSoup parser backend
 
-    Returns: Car data model
+    Returns: parameter names mapped to their values
     """
-    page = requests.get(link, headers=header)
-    soup = BeautifulSoup(page.text, "html.parser")
+    soup = BeautifulSoup(page_text, parser, parse_only=CAR_PAGE_STRAINER)
 
     params = filter(
         lambda tag: tag["class"] == ["param"], soup.find_all("div", class_="param")
     )
 
-    car_details = {
+    return {
         (param.find("div", class_="left").text.strip()): (
             param.find("div", class_="right").text.strip()
         )
         for param in params
     }
 
+
+def get_car_details(
+    link: str, header: Dict[str, str], client: Optional[ScraperClient] = None
+) -> Car:
+    """Get details about a car provided via link
+    Args:
+        link: link to the page of a car
+        header: header params to use
+        client: shared pooled client, plain request is made if not given
+
+    Returns: Car data model
+    """
+    if client:
+        page_text = client.get_text(link, header)
+    else:
+        page_text = requests.get(link, headers=header).text
+    car_details = parse_car_details(page_text)
+
     try:
         car = Car(link=link, **car_details)
     except Exception as e:
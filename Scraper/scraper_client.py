@@ -0,0 +1,308 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from logger_scraper import LOGGER
+from metrics_scraper import count, record_http
+from scraper_cache import HttpCache
+
+MAX_WORKERS = 8
+REQUESTS_PER_SECOND = 5.0
+# Requests a host can get at once after being idle
+BURST_SIZE = 5
+REQUEST_TIMEOUT = 30
+# Throttled, failed on server or unanswered requests are retried this many times
+MAX_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Backoff before retry n is random up to min(BACKOFF_CAP, BACKOFF_BASE * 2 ** n) seconds
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+# Longest Retry-After waited for, so a throttled run still ends within Lambda timeout
+MAX_RETRY_AFTER = 120.0
+MIN_CONCURRENCY = 1
+# Fine responses in a row needed to allow one more request in flight, at
+# least as many as the current limit
+INCREASE_AFTER = 25
+# Responses this many times slower than the fastest seen, and slower than
+# SLOW_RESPONSE_SECONDS, mean the site is overloaded
+LATENCY_TOLERANCE = 3.0
+SLOW_RESPONSE_SECONDS = 1.0
+# Concurrency is cut at most once per this many seconds, or per smoothed
+# latency if longer
+DECREASE_INTERVAL = 1.0
+# Weight of the latest response in smoothed latency
+LATENCY_SMOOTHING = 0.2
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Reads Retry-After header, given either in seconds or as HTTP date
+    Args:
+        value: header value
+
+    Returns: seconds to wait, at most MAX_RETRY_AFTER, None if header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so workers do not retry in lockstep
+    Args:
+        attempt: number of retries made so far
+
+    Returns: seconds to wait before retrying
+    """
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+
+
+class HostRateLimiter:
+    """Token bucket per host, requests to a host are spaced to requests_per_second
+    on average with bursts of up to burst_size. Hosts can be paused, e.g. when
+    they ask to retry later
+    Args:
+        requests_per_second: max requests per second to a single host, None disables limiting
+        burst_size: max requests sent to a host at once after it was idle
+    """
+
+    def __init__(
+        self,
+        requests_per_second: Optional[float] = REQUESTS_PER_SECOND,
+        burst_size: int = BURST_SIZE,
+    ):
+        self.rate = requests_per_second
+        self.burst_size = burst_size
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url: str):
+        """Blocks until a request to the host of url is allowed
+        Args:
+            url: url about to be requested
+        """
+        host = urlparse(url).netloc
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                delay = self._paused_until.get(host, now) - now
+                if delay <= 0:
+                    if not self.rate:
+                        return
+                    tokens, updated_at = self._buckets.get(host, (self.burst_size, now))
+                    tokens = min(
+                        self.burst_size, tokens + (now - updated_at) * self.rate
+                    )
+                    if tokens >= 1:
+                        self._buckets[host] = (tokens - 1, now)
+                        return
+                    self._buckets[host] = (tokens, now)
+                    delay = (1 - tokens) / self.rate
+            time.sleep(delay)
+
+    def pause(self, url: str, seconds: float):
+        """Holds all requests to the host of url
+        Args:
+            url: url of the host
+            seconds: pause duration
+        """
+        host = urlparse(url).netloc
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until[host] = max(self._paused_until.get(host, 0.0), until)
+
+
+class AdaptiveConcurrency:
+    """Limits requests in flight, limit is tuned with AIMD: it grows by one after
+    a run of responses came back fine and is halved when the site throttles,
+    fails or slows down
+    Args:
+        max_limit: most requests in flight, also the starting limit
+        min_limit: fewest requests in flight
+    """
+
+    def __init__(self, max_limit: int = MAX_WORKERS, min_limit: int = MIN_CONCURRENCY):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        self.successes = 0
+        self.smoothed_latency: Optional[float] = None
+        self.best_latency: Optional[float] = None
+        self.decreased_at = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Blocks until there is room for another request"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, seconds: Optional[float], overloaded: bool = False):
+        """Frees room of a finished request and adjusts limit
+        Args:
+            seconds: request latency, None if no response was received
+            overloaded: site throttled or failed the request
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if seconds is not None:
+                self.smoothed_latency = (
+                    seconds
+                    if self.smoothed_latency is None
+                    else (1 - LATENCY_SMOOTHING) * self.smoothed_latency
+                    + LATENCY_SMOOTHING * seconds
+                )
+                self.best_latency = min(
+                    self.best_latency or self.smoothed_latency, self.smoothed_latency
+                )
+                overloaded = overloaded or (
+                    self.smoothed_latency > LATENCY_TOLERANCE * self.best_latency
+                    and self.smoothed_latency > SLOW_RESPONSE_SECONDS
+                )
+
+            now = time.monotonic()
+            if overloaded:
+                # Requests sent before the limit was cut report the same overload
+                interval = max(DECREASE_INTERVAL, self.smoothed_latency or 0.0)
+                if now - self.decreased_at > interval:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.decreased_at = now
+                    self.successes = 0
+                    count("concurrency_decreases")
+                    LOGGER.info(
+                        f"Site overloaded, concurrency cut to {int(self.limit)}"
+                    )
+            else:
+                self.successes += 1
+                if (
+                    self.successes >= max(INCREASE_AFTER, self.limit)
+                    and self.limit < self.max_limit
+                ):
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.successes = 0
+            self._condition.notify_all()
+
+
+class ScraperClient:
+    """HTTP client with one pooled session shared by search and car page scraping.
+    Requests are rate limited per host, retried with backoff when throttled or
+    failed, and their concurrency adapts to how the site copes with the load
+    Args:
+        max_workers: number of car pages fetched concurrently at most
+        requests_per_second: per host request rate limit, None for no limit
+        cache: on disk cache of pages, pages are always requested if not given
+    """
+
+    def __init__(
+        self,
+        max_workers: int = MAX_WORKERS,
+        requests_per_second: Optional[float] = REQUESTS_PER_SECOND,
+        cache: Optional[HttpCache] = None,
+    ):
+        self.max_workers = max_workers
+        self.cache = cache
+        self.rate_limiter = HostRateLimiter(requests_per_second)
+        self.concurrency = AdaptiveConcurrency(max_workers)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, url: str, header: Dict[str, str]) -> requests.Response:
+        """Gets url, retrying throttled, failed on server and unanswered requests
+        Args:
+            url: link to the page
+            header: header params to use
+
+        Returns: response, HTTPError is raised if retries run out
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.wait(url)
+            self.concurrency.acquire()
+            start = time.perf_counter()
+            try:
+                page = self.session.get(url, headers=header, timeout=REQUEST_TIMEOUT)
+            except requests.RequestException as e:
+                record_http(None, time.perf_counter() - start)
+                self.concurrency.release(None, overloaded=True)
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = backoff_delay(attempt)
+                reason = type(e).__name__
+            else:
+                seconds = time.perf_counter() - start
+                record_http(page.status_code, seconds, len(page.content))
+                retry = page.status_code in RETRY_STATUSES
+                self.concurrency.release(seconds, overloaded=retry)
+                if not retry:
+                    return page
+                if attempt == MAX_RETRIES:
+                    page.raise_for_status()
+                if page.status_code == 429:
+                    count("throttled")
+                retry_after = parse_retry_after(page.headers.get("Retry-After"))
+                if retry_after is None:
+                    delay = backoff_delay(attempt)
+                else:
+                    # Site asked all requests to wait, not just this one
+                    self.rate_limiter.pause(url, retry_after)
+                    delay = retry_after
+                reason = f"status {page.status_code}"
+
+            count("retries")
+            LOGGER.warning(f"Retrying {url} in {delay:.1f}s after {reason}")
+            time.sleep(delay)
+
+    def get_text(self, url: str, header: Dict[str, str]) -> str:
+        """Fetches page content
+        Args:
+            url: link to the page
+            header: header params to use
+
+        Returns: page HTML
+        """
+        entry = None
+        request_header = header
+        if self.cache:
+            text = self.cache.read_fresh(url)
+            if text is not None:
+                count("cache_hits")
+                return text
+            if self.cache.replay:
+                raise LookupError(f"{url} is not cached, cannot replay it")
+            entry = self.cache.get_entry(url)
+            request_header = {**header, **self.cache.conditional_headers(entry)}
+
+        page = self.request(url, request_header)
+
+        if self.cache:
+            if page.status_code == 304 and entry:
+                text = self.cache.revalidate(url)
+                if text is not None:
+                    count("cache_revalidations")
+                    return text
+                # Page was evicted while waiting for the answer, fetch it in full
+                page = self.request(url, header)
+            if page.ok:
+                self.cache.store(
+                    url,
+                    page.text,
+                    etag=page.headers.get("ETag"),
+                    last_modified=page.headers.get("Last-Modified"),
+                )
+        return page.text
@@ -1,20 +1,184 @@
-from typing import List, Dict
-
-import boto3
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Iterator, Tuple
 
 from logger_scraper import LOGGER
-from scraper_car_page import Car
-from scraper_search_page import get_info_from_search_page
+from metrics_scraper import count, stage, with_stages
+from scraper_cache import HttpCache
+from scraper_car_page import Car, get_car_details
+from scraper_client import ScraperClient, MAX_WORKERS
+from scraper_search_page import get_listings_from_search_page
+from scraper_sink import DynamoDbSink
+from scraper_state import (
+    SeenListings,
+    Checkpoint,
+    SEEN_LISTINGS_LOCATION,
+    CHECKPOINT_LOCATION,
+)
 
 HEADER = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
 }
 MAIN_PAGE = "https://autogidas.lt/"
 SEARCH_PAGE = "https://autogidas.lt/skelbimai/automobiliai/?f_13=Vilnius&s=1411740949&f_50=atnaujinimo_laika_asc&page={page_nr}"
+# Car links allowed to wait for a worker, per worker
+LINKS_PER_WORKER = 4
+# Search pages written between sink flushes and checkpoints when streaming
+FLUSH_PAGES = 1
+
+
+def produce_car_links(
+    pages_to_scrape: int,
+    initial_link: str,
+    main_page: str,
+    header: Dict[str, str],
+    client: ScraperClient,
+    executor: ThreadPoolExecutor,
+    pages_queue: queue.Queue,
+    stop: threading.Event,
+    seen_listings: Optional[SeenListings] = None,
+    stop_on_known_page: bool = False,
+    first_page: int = 1,
+):
+    """Walks search pages and submits their car links to detail workers
+    Args:
+        pages_to_scrape: number of pages to scrape
+        initial_link: search page link
+        main_page: main page link
+        header: header params to use
+        client: shared pooled client
+        executor: pool of car detail workers
+        pages_queue: queue receiving page number, car futures and listings of each page
+        stop: event signaling the pipeline to stop producing
+        seen_listings: listings already scraped, only new or changed ones are submitted
+        stop_on_known_page: stop at the first page containing only seen listings
+        first_page: search page to start from
+    """
+    backpressure = threading.BoundedSemaphore(client.max_workers * LINKS_PER_WORKER)
+    try:
+        for page_nr in range(first_page, first_page + pages_to_scrape):
+            listings, last_page = get_listings_from_search_page(
+                initial_link.format(page_nr=page_nr),
+                main_page=main_page,
+                header=header,
+                client=client,
+            )
+            if seen_listings is not None:
+                listings = {
+                    url: fingerprint
+                    for url, fingerprint in listings.items()
+                    if not seen_listings.is_known(url, fingerprint)
+                }
+                if not listings and stop_on_known_page:
+                    LOGGER.info(f"Page {page_nr} has only seen listings, stopping")
+                    return
+            car_futures = []
+            for car_link in listings:
+                backpressure.acquire()
+                if stop.is_set():
+                    backpressure.release()
+                    return
+                future = executor.submit(
+                    with_stages(get_car_details), car_link, header, client
+                )
+                future.add_done_callback(lambda _: backpressure.release())
+                car_futures.append(future)
+            pages_queue.put((page_nr, car_futures, listings))
+            if page_nr >= last_page or stop.is_set():
+                return
+    except Exception as e:
+        pages_queue.put(e)
+    finally:
+        pages_queue.put(None)
+
 
+def iter_scraped_pages(
+    pages_to_scrape: int,
+    initial_link: str,
+    main_page: str,
+    header: Dict[str, str],
+    client: Optional[ScraperClient] = None,
+    seen_listings: Optional[SeenListings] = None,
+    stop_on_known_page: bool = False,
+    first_page: int = 1,
+) -> Iterator[Tuple[int, List[Car]]]:
+    """Scrapes search pages and car pages as a pipeline, next search page is
+    requested while car pages of the previous one are still being fetched
+    Args:
+        pages_to_scrape: number of pages to scrape
+        initial_link: search page link
+        main_page: main page link
+        header: header params to use
+        client: shared pooled client for concurrent fetching
+        seen_listings: listings already scraped, skipped unless changed and
+            updated with newly scraped ones
+        stop_on_known_page: stop at the first page containing only seen listings
+        first_page: search page to start from
+
+    Returns: Iterator of page number and cars from that page, in page order
+    """
+    client = client or ScraperClient()
+    pages_queue = queue.Queue()
+    stop = threading.Event()
+
+    with ThreadPoolExecutor(max_workers=client.max_workers) as executor:
+        producer = threading.Thread(
+            target=with_stages(produce_car_links),
+            args=(
+                pages_to_scrape,
+                initial_link,
+                main_page,
+                header,
+                client,
+                executor,
+                pages_queue,
+                stop,
+                seen_listings,
+                stop_on_known_page,
+                first_page,
+            ),
+            daemon=True,
+        )
+        producer.start()
+        try:
+            while True:
+                item = pages_queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                page_nr, car_futures, listings = item
+                cars = [future.result() for future in car_futures]
+                if seen_listings is not None:
+                    for url, fingerprint in listings.items():
+                        seen_listings.add(url, fingerprint)
+                count("pages")
+                count("cars", len(cars))
+                yield page_nr, cars
+        finally:
+            stop.set()
+            # Cancel work of pages not consumed, which also unblocks the producer
+            while producer.is_alive() or not pages_queue.empty():
+                try:
+                    item = pages_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if isinstance(item, tuple):
+                    for future in item[1]:
+                        future.cancel()
+            producer.join()
 
+
+@stage("scrape_pages")
 def scrape_pages(
-    pages_to_scrape: int, initial_link: str, main_page: str, header: Dict[str, str]
+    pages_to_scrape: int,
+    initial_link: str,
+    main_page: str,
+    header: Dict[str, str],
+    client: Optional[ScraperClient] = None,
+    seen_listings: Optional[SeenListings] = None,
+    stop_on_known_page: bool = False,
 ) -> List[Car]:
     """Scrapes pages to get information about cars
     Args:
@@ -22,46 +186,187 @@ def scrape_pages(
         initial_link: search page link
         main_page: main page link
         header: header params to use
+        client: shared pooled client for concurrent fetching
+        seen_listings: listings already scraped, skipped unless changed
+        stop_on_known_page: stop at the first page containing only seen listings
 
     Returns: List of cars from pages
     """
     LOGGER.info("Start Scraping pages")
     cars_from_pages = list()
-    for i in range(1, pages_to_scrape + 1):
-        cars, last_page = get_info_from_search_page(
-            initial_link.format(page_nr=i), main_page=main_page, header=header
-        )
+    for _, cars in iter_scraped_pages(
+        pages_to_scrape,
+        initial_link,
+        main_page,
+        header,
+        client,
+        seen_listings,
+        stop_on_known_page,
+    ):
         cars_from_pages += cars
-        if i >= last_page:
-            break
     LOGGER.info(f"Finished Scraping pages, cars from pages: {len(cars_from_pages)}")
     return cars_from_pages
 
 
+@stage("write_to_db")
 def write_to_db(cars_from_pages: List[Car]):
     """Writes scraped car info to DynamoDB
     Args:
         cars_from_pages (): List of cars to write to db
     """
     LOGGER.info("Start writing to DynamoDB")
-    client_dynamo = boto3.resource("dynamodb")
-    table = client_dynamo.Table("car_table")
-    with table.batch_writer() as batch:
-        for car in cars_from_pages:
-            batch.put_item(Item=car.get_json())
+    with DynamoDbSink() as sink:
+        sink.write(cars_from_pages)
+    count("written_cars", len(cars_from_pages))
     LOGGER.info("Finished writing to DynamoDB")
 
 
-def run_scraper(pages: int = 5):
-    """Main function for running full scraper"""
-    LOGGER.info(f"Start running scraper, pages={pages}")
-    scraped_cars = scrape_pages(
-        pages_to_scrape=pages,
-        initial_link=SEARCH_PAGE,
-        main_page=MAIN_PAGE,
-        header=HEADER,
+def stream_to_sink(
+    scraped_pages: Iterator[Tuple[int, List[Car]]],
+    sink,
+    on_flush=None,
+    flush_pages: int = FLUSH_PAGES,
+) -> int:
+    """Writes cars to sink as their pages are scraped, without keeping them all in memory
+    Args:
+        scraped_pages: iterator of page number and cars from that page
+        sink: context manager with write(cars) and flush() methods, e.g. DynamoDbSink
+        on_flush: called with last written page number after each flush
+        flush_pages: number of pages written between flushes
+
+    Returns: number of last written page, 0 if no pages were scraped
+    """
+    last_page_nr = 0
+    pages_since_flush = 0
+    with sink:
+        for page_nr, cars in scraped_pages:
+            sink.write(cars)
+            count("written_cars", len(cars))
+            last_page_nr = page_nr
+            pages_since_flush += 1
+            if pages_since_flush >= flush_pages:
+                sink.flush()
+                pages_since_flush = 0
+                if on_flush:
+                    on_flush(page_nr)
+    if pages_since_flush and on_flush:
+        on_flush(last_page_nr)
+    return last_page_nr
+
+
+@stage("stream_scraper")
+def stream_scraper(
+    pages: int,
+    client: ScraperClient,
+    seen_listings: Optional[SeenListings] = None,
+    seen_listings_location: str = SEEN_LISTINGS_LOCATION,
+    checkpoint_location: str = CHECKPOINT_LOCATION,
+    sink=None,
+):
+    """Scrapes pages straight into sink, saving progress after every flush
+    Args:
+        pages: number of search pages to scrape
+        client: shared pooled client for concurrent fetching
+        seen_listings: listings already scraped, incremental mode is used if given
+        seen_listings_location: s3://bucket/key or local file keeping seen listings
+        checkpoint_location: s3://bucket/key or local file keeping streaming progress
+        sink: sink to write cars to, DynamoDbSink is used if not given
+    """
+    checkpoint = Checkpoint.load(checkpoint_location)
+    first_page = checkpoint.last_completed_page + 1
+    LOGGER.info(f"Start streaming pages from page {first_page}")
+
+    def save_progress(page_nr: int):
+        checkpoint.last_completed_page = page_nr
+        checkpoint.save(checkpoint_location)
+        if seen_listings is not None:
+            seen_listings.save(seen_listings_location)
+
+    sink = sink or DynamoDbSink()
+    last_page_nr = stream_to_sink(
+        iter_scraped_pages(
+            pages,
+            SEARCH_PAGE,
+            MAIN_PAGE,
+            HEADER,
+            client,
+            seen_listings,
+            stop_on_known_page=seen_listings is not None,
+            first_page=first_page,
+        ),
+        sink,
+        on_flush=save_progress,
     )
+    if last_page_nr < first_page + pages - 1:
+        # Walk ended before page limit, next run starts from the first page
+        save_progress(0)
+    LOGGER.info(f"Finished streaming pages, last written page: {last_page_nr}")
+
+
+@stage("run_scraper")
+def run_scraper(
+    pages: int = 5,
+    max_workers: int = MAX_WORKERS,
+    incremental: bool = False,
+    seen_listings_location: str = SEEN_LISTINGS_LOCATION,
+    cache_dir: Optional[str] = None,
+    replay: bool = False,
+    streaming: bool = False,
+    checkpoint_location: str = CHECKPOINT_LOCATION,
+):
+    """Main function for running full scraper
+    Args:
+        pages: number of search pages to scrape
+        max_workers: number of car pages fetched concurrently
+        incremental: scrape only listings that are new or changed since previous
+            runs, stopping at the first page with no such listings
+        seen_listings_location: s3://bucket/key or local file keeping seen listings
+        cache_dir: folder of on disk page cache, pages are not cached if not given
+        replay: run only from pages in cache_dir, without requesting the website
+        streaming: write cars to DynamoDB page by page, resuming after the last
+            page completed by previous run
+        checkpoint_location: s3://bucket/key or local file keeping streaming progress
+    """
+    LOGGER.info(
+        f"Start running scraper, pages={pages}, max_workers={max_workers}, "
+        f"incremental={incremental}, cache_dir={cache_dir}, replay={replay}, "
+        f"streaming={streaming}"
+    )
+    cache = HttpCache(cache_dir, replay=replay) if cache_dir else None
+    seen_listings = SeenListings.load(seen_listings_location) if incremental else None
+    if streaming:
+        try:
+            stream_scraper(
+                pages=pages,
+                client=ScraperClient(max_workers=max_workers, cache=cache),
+                seen_listings=seen_listings,
+                seen_listings_location=seen_listings_location,
+                checkpoint_location=checkpoint_location,
+            )
+        finally:
+            if cache:
+                cache.save()
+        LOGGER.info(f"Finished running scraper")
+        return
+
+    try:
+        scraped_cars = scrape_pages(
+            pages_to_scrape=pages,
+            initial_link=SEARCH_PAGE,
+            main_page=MAIN_PAGE,
+            header=HEADER,
+            client=ScraperClient(max_workers=max_workers, cache=cache),
+            seen_listings=seen_listings,
+            stop_on_known_page=incremental,
+        )
+    finally:
+        if cache:
+            cache.save()
     write_to_db(scraped_cars)
+    if incremental:
+        # Saved only after writing, so failed runs do not skip unsaved listings
+        seen_listings.save(seen_listings_location)
+        LOGGER.info(f"Saved {len(seen_listings)} seen listings")
     LOGGER.info(f"Finished running scraper")
 
 
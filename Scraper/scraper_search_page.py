@@ -1,9 +1,11 @@
-from typing import Tuple, List, Dict
+import hashlib
+from typing import Tuple, Dict, Optional
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 
-from scraper_car_page import get_car_details, Car
+from scraper_car_page import HTML_PARSER
+from scraper_client import ScraperClient
 
 HEADER = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_1) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/39.0.2171.95 Safari/537.36"
@@ -12,38 +14,85 @@ MAIN_PAGE = "https://autogidas.lt/"
 SEARCH_PAGE = "https://autogidas.lt/skelbimai/automobiliai/?f_13=Vilnius&s=1411740949&f_50=atnaujinimo_laika_asc&page=1"
 
 
-def get_info_from_search_page(
-    search_page: str, main_page: str, header: Dict[str, str]
-) -> Tuple[List[Car], int]:
-    """Gets info of all not sold cars in given search page
+def is_search_page_content(name: str, attrs: Optional[dict] = None) -> bool:
+    """Checks if tag is needed from search page, listing articles and page numbers
     Args:
-        search_page: link to the search page
+        name: tag name
+        attrs: tag attributes, not passed by newer BeautifulSoup versions
+
+    Returns: True if tag subtree should be parsed
+    """
+    if name == "article":
+        return True
+    if name != "div":
+        return False
+    if attrs is None:
+        return True
+    classes = attrs.get("class") or ""
+    return "page" in (classes.split() if isinstance(classes, str) else classes)
+
+
+# Only listing articles and page number subtrees are built when parsing search page
+SEARCH_PAGE_STRAINER = SoupStrainer(is_search_page_content)
+
+
+def get_article_fingerprint(article) -> str:
+    """Fingerprints search page article, changes when listing details shown on search page change
+    Args:
+        article: article tag of a listing
+
+    Returns: fingerprint of article text
+    """
+    text = " ".join(article.get_text(" ").split())
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def parse_search_page(
+    page_text: str, main_page: str, parser: str = HTML_PARSER
+) -> Tuple[Dict[str, str], int]:
+    """Parses not sold car listings and last page number from search page
+    Args:
+        page_text: search page HTML
         main_page: main website domain
-        header: header params to use
+        parser: BeautifulSoup parser backend
 
-    Returns: List of car details and last page number
+    Returns: Car links sorted and mapped to their fingerprints, last page number
     """
-    # fetch link
-    page = requests.get(search_page, headers=header)
-    # Get HTML content
-    soup = BeautifulSoup(page.text, "html.parser")
+    soup = BeautifulSoup(page_text, parser, parse_only=SEARCH_PAGE_STRAINER)
 
     articles = soup.find_all("article")
-    car_links = sorted(
-        {
-            a.find(class_="item-link")["href"]
-            for a in articles
-            if not a.find("div", class_="sold-item")  # Skip sold items
-        }
-    )
-
-    cars = [
-        get_car_details(link=main_page + car_link, header=HEADER)
-        for car_link in car_links
-    ]
+    listings = {
+        a.find(class_="item-link")["href"]: get_article_fingerprint(a)
+        for a in articles
+        if not a.find("div", class_="sold-item")  # Skip sold items
+    }
 
     last_page = int(
         max(soup.find_all("div", class_="page"), key=lambda el: el.text).text
     )
 
-    return cars, last_page
+    return {main_page + link: listings[link] for link in sorted(listings)}, last_page
+
+
+def get_listings_from_search_page(
+    search_page: str,
+    main_page: str,
+    header: Dict[str, str],
+    client: Optional[ScraperClient] = None,
+) -> Tuple[Dict[str, str], int]:
+    """Gets links and fingerprints of all not sold cars in given search page
+    Args:
+        search_page: link to the search page
+        main_page: main website domain
+        header: header params to use
+        client: shared pooled client, plain request is made if not given
+
+    Returns: Car links sorted and mapped to their fingerprints, last page number
+    """
+    # fetch link
+    if client:
+        page_text = client.get_text(search_page, header)
+    else:
+        page_text = requests.get(search_page, headers=header).text
+
+    return parse_search_page(page_text, main_page)
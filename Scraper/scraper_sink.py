@@ -0,0 +1,50 @@
+import time
+from typing import Iterable
+
+import boto3
+
+from scraper_car_page import Car
+
+TABLE_NAME = "car_table"
+
+
+class DynamoDbSink:
+    """Writes cars to DynamoDB through one long lived batch writer, used as
+    context manager. Any object with the same write/flush methods can be used
+    as a sink when streaming scraped cars
+    Args:
+        table: DynamoDB table resource, car_table is used if not given
+    """
+
+    def __init__(self, table=None):
+        self.table = table or boto3.resource("dynamodb").Table(TABLE_NAME)
+        self.written = 0
+        self._batch = None
+
+    def __enter__(self) -> "DynamoDbSink":
+        self._batch = self.table.batch_writer()
+        self._batch.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._batch.__exit__(exc_type, exc_val, exc_tb)
+        self._batch = None
+
+    def write(self, cars: Iterable[Car]):
+        """Queues cars for writing, batches of 25 are sent as they fill up
+        Args:
+            cars: cars to write
+        """
+        # Lets ETL read only items scraped since its previous run
+        scraped_at = int(time.time())
+        for car in cars:
+            item = car.get_json()
+            item["scraped_at"] = scraped_at
+            self._batch.put_item(Item=item)
+            self.written += 1
+
+    def flush(self):
+        """Sends all queued cars to DynamoDB"""
+        self._batch.__exit__(None, None, None)
+        self._batch = self.table.batch_writer()
+        self._batch.__enter__()
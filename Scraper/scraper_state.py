@@ -0,0 +1,127 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+import boto3
+from botocore.exceptions import ClientError
+
+BUCKET = "car-scraper-vu-bucket"
+SEEN_LISTINGS_LOCATION = f"s3://{BUCKET}/scraper_state/seen_listings.json"
+CHECKPOINT_LOCATION = f"s3://{BUCKET}/scraper_state/checkpoint.json"
+
+
+def split_s3_location(location: str) -> Optional[Tuple[str, str]]:
+    """Splits s3://bucket/key location
+    Args:
+        location: s3 location or local file path
+
+    Returns: bucket and key, None for local file path
+    """
+    if not location.startswith("s3://"):
+        return None
+    bucket, _, key = location[len("s3://") :].partition("/")
+    return bucket, key
+
+
+def read_json_state(location: str) -> dict:
+    """Reads json state saved by previous runs
+    Args:
+        location: s3://bucket/key location or local file path
+
+    Returns: saved state, empty if nothing saved yet
+    """
+    s3_location = split_s3_location(location)
+    if s3_location:
+        bucket, key = s3_location
+        try:
+            body = boto3.client("s3").get_object(Bucket=bucket, Key=key)["Body"]
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return {}
+            raise
+        return json.loads(body.read())
+
+    if not os.path.exists(location):
+        return {}
+    with open(location, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json_state(location: str, state: dict):
+    """Saves json state for next runs
+    Args:
+        location: s3://bucket/key location or local file path
+        state: state to save
+    """
+    content = json.dumps(state).encode("utf-8")
+    s3_location = split_s3_location(location)
+    if s3_location:
+        bucket, key = s3_location
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=content)
+        return
+
+    os.makedirs(os.path.dirname(location) or ".", exist_ok=True)
+    with open(location, "wb") as f:
+        f.write(content)
+
+
+class SeenListings:
+    """Listings scraped in previous runs
+    Args:
+        fingerprints: search page fingerprint of each scraped listing, keyed by url
+    """
+
+    def __init__(self, fingerprints: Optional[Dict[str, str]] = None):
+        self.fingerprints = fingerprints or {}
+
+    @classmethod
+    def load(cls, location: str = SEEN_LISTINGS_LOCATION) -> "SeenListings":
+        """Loads listings seen in previous runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        return cls(read_json_state(location).get("fingerprints"))
+
+    def save(self, location: str = SEEN_LISTINGS_LOCATION):
+        """Saves seen listings for next runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        write_json_state(location, {"fingerprints": self.fingerprints})
+
+    def is_known(self, url: str, fingerprint: str) -> bool:
+        """Checks if listing was already scraped and has not changed since"""
+        return self.fingerprints.get(url) == fingerprint
+
+    def add(self, url: str, fingerprint: str):
+        """Marks listing as scraped"""
+        self.fingerprints[url] = fingerprint
+
+    def __len__(self):
+        return len(self.fingerprints)
+
+
+class Checkpoint:
+    """Last search page whose cars were fully written, lets a timed out run
+    be resumed from the next page
+    Args:
+        last_completed_page: last fully written search page, 0 if none
+    """
+
+    def __init__(self, last_completed_page: int = 0):
+        self.last_completed_page = last_completed_page
+
+    @classmethod
+    def load(cls, location: str = CHECKPOINT_LOCATION) -> "Checkpoint":
+        """Loads checkpoint saved by previous runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        return cls(read_json_state(location).get("last_completed_page", 0))
+
+    def save(self, location: str = CHECKPOINT_LOCATION):
+        """Saves checkpoint for next runs
+        Args:
+            location: s3://bucket/key location or local file path
+        """
+        write_json_state(location, {"last_completed_page": self.last_completed_page})
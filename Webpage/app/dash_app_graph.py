@@ -1,13 +1,87 @@
 import webbrowser
+from typing import Optional
 
 import dash
 import flask
-import plotly
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 
 from logger_webpage import LOGGER
 from utilities import get_graph_data
 
+DEFAULT_VIEW = {"x_range": [0, 10000], "y_range": [0, 10000], "hidden_traces": []}
+FIGURE_LAYOUT = dict(
+    updatemenus=[
+        dict(
+            type="buttons",
+            direction="left",
+            buttons=list(
+                [
+                    dict(
+                        args=["visible", "legendonly"],
+                        label="Deselect All",
+                        method="restyle",
+                    ),
+                    dict(
+                        args=["visible", True],
+                        label="Select All",
+                        method="restyle",
+                    ),
+                ]
+            ),
+            pad={"r": 10, "t": 10},
+            showactive=False,
+            x=1,
+            xanchor="right",
+            y=1.1,
+            yanchor="top",
+        ),
+    ]
+)
+
+
+def axis_range(relayout_data: dict, axis: str, current: Optional[list]):
+    """Reads axis range set by zooming or panning graph
+    Args:
+        relayout_data: relayoutData of graph
+        axis: xaxis or yaxis
+        current: range before relayout
+
+    Returns: new range, None for whole axis
+    """
+    if relayout_data.get(f"{axis}.autorange"):
+        return None
+    if f"{axis}.range" in relayout_data:
+        return relayout_data[f"{axis}.range"]
+    if f"{axis}.range[0]" in relayout_data:
+        return [relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]]
+    return current
+
+
+def hidden_traces(restyle_data: list, n_traces: int, current: list) -> list:
+    """Reads traces hidden by clicking legend or select buttons
+    Args:
+        restyle_data: restyleData of graph, changes and indexes of changed traces
+        n_traces: number of traces in graph
+        current: hidden traces before restyle
+
+    Returns: indexes of hidden traces
+    """
+    changes, indexes = restyle_data
+    if "visible" not in changes:
+        return current
+    if indexes is None:
+        indexes = range(n_traces)
+    visible = changes["visible"]
+    if not isinstance(visible, list):
+        visible = [visible]
+    hidden = set(current)
+    for i, index in enumerate(indexes):
+        if visible[i % len(visible)] is True:
+            hidden.discard(index)
+        else:
+            hidden.add(index)
+    return sorted(hidden)
+
 
 def create_dash_app_graph(requests_pathname_prefix: str) -> dash.Dash:
     """Creates dash application
@@ -16,41 +90,15 @@ def create_dash_app_graph(requests_pathname_prefix: str) -> dash.Dash:
 
     Returns: Dash app
     """
+
     # Create Figure
-    def create_figure():
-        graph_json = get_graph_data()
-        fig = plotly.io.from_json(graph_json)
-        fig.update_layout(yaxis_range=[0, 10000], xaxis_range=[0, 10000])
-        fig.update_layout(
-            dict(
-                updatemenus=[
-                    dict(
-                        type="buttons",
-                        direction="left",
-                        buttons=list(
-                            [
-                                dict(
-                                    args=["visible", "legendonly"],
-                                    label="Deselect All",
-                                    method="restyle",
-                                ),
-                                dict(
-                                    args=["visible", True],
-                                    label="Select All",
-                                    method="restyle",
-                                ),
-                            ]
-                        ),
-                        pad={"r": 10, "t": 10},
-                        showactive=False,
-                        x=1,
-                        xanchor="right",
-                        y=1.1,
-                        yanchor="top",
-                    ),
-                ]
-            )
+    def create_figure(view: dict) -> dict:
+        """Creates figure with only the points visible in view"""
+        graph_data = get_graph_data()
+        fig = graph_data.figure(
+            view["x_range"], view["y_range"], hidden_traces=view["hidden_traces"]
         )
+        fig["layout"].update(FIGURE_LAYOUT)
         return fig
 
     # create server and app
@@ -66,15 +114,40 @@ def create_dash_app_graph(requests_pathname_prefix: str) -> dash.Dash:
             [
                 dash.dcc.Graph(
                     id="fig",
-                    figure=create_figure(),
+                    figure=create_figure(DEFAULT_VIEW),
                     style={"width": "90v", "height": "90vh"},
                 ),
+                dash.dcc.Store(id="view", data=DEFAULT_VIEW),
                 dash.html.Div(id="debug"),
             ]
         )
 
     app.layout = serve_layout
 
+    @app.callback(
+        Output("fig", "figure"),
+        Output("view", "data"),
+        Input("fig", "relayoutData"),
+        Input("fig", "restyleData"),
+        State("view", "data"),
+        prevent_initial_call=True,
+    )
+    def update_view(relayout_data, restyle_data, view):
+        """Redraws graph with points visible after zoom, pan or legend click"""
+        new_view = dict(view)
+        if dash.ctx.triggered[0]["prop_id"] == "fig.relayoutData":
+            for axis in ["xaxis", "yaxis"]:
+                key = f"{axis[0]}_range"
+                new_view[key] = axis_range(relayout_data or {}, axis, view[key])
+        elif restyle_data:
+            n_traces = len(get_graph_data().traces)
+            new_view["hidden_traces"] = hidden_traces(
+                restyle_data, n_traces, view["hidden_traces"]
+            )
+        if new_view == view:
+            raise dash.exceptions.PreventUpdate
+        return create_figure(new_view), new_view
+
     @app.callback(
         Output("debug", "children"),
         Input("fig", "clickData"),
@@ -0,0 +1,148 @@
+import copy
+import json
+from typing import Collection, List, Optional, Tuple
+
+import numpy as np
+
+# Max points sent to the browser for one view of the graph
+MAX_POINTS = 20000
+# Cells per axis of the grid points are thinned out with, at most one point
+# per cell is drawn when a view has more than MAX_POINTS points
+GRID_SIZE = 150
+# Seed of the point order picking which point represents a grid cell
+SAMPLE_SEED = 0
+
+Range = Optional[Tuple[float, float]]
+
+
+class GraphData:
+    """Scatter graph kept in memory as point arrays, so each view of it is
+    drawn with only the points visible at the current zoom
+    Args:
+        figure: plotly figure dict with a scatter trace per brand
+        version: content hash of graph file, identifies graph in the browser
+    """
+
+    def __init__(self, figure: dict, version: str = ""):
+        self.layout = figure.get("layout", {})
+        self.version = version
+        self.traces: List[dict] = []
+        self.trace_x: List[np.ndarray] = []
+        self.trace_y: List[np.ndarray] = []
+        self.trace_customdata: List[Optional[np.ndarray]] = []
+        for trace in figure.get("data", []):
+            x = np.asarray(trace.get("x", []))
+            y = np.asarray(trace.get("y", []))
+            customdata = trace.get("customdata")
+            self.trace_x.append(x)
+            self.trace_y.append(y)
+            self.trace_customdata.append(
+                None if customdata is None else np.asarray(customdata, dtype=object)
+            )
+            # WebGL trace draws thousands of points without slowing the page down
+            self.traces.append(
+                {
+                    **{
+                        key: value
+                        for key, value in trace.items()
+                        if key not in ("x", "y", "customdata")
+                    },
+                    "type": "scattergl",
+                }
+            )
+
+        # All points in random order, so the first point of a grid cell is a
+        # fair sample of it
+        sizes = [len(x) for x in self.trace_x]
+        trace = np.repeat(np.arange(len(sizes)), sizes)
+        position = np.concatenate([np.arange(size) for size in sizes] or [[]])
+        order = np.random.default_rng(SAMPLE_SEED).permutation(len(trace))
+        self.point_trace = trace[order]
+        self.point_position = position[order].astype(np.int64)
+        self.point_x = np.concatenate(self.trace_x or [[]]).astype(np.float64)[order]
+        self.point_y = np.concatenate(self.trace_y or [[]]).astype(np.float64)[order]
+
+    @classmethod
+    def from_json(cls, data: bytes, version: str = "") -> "GraphData":
+        """Loads graph from plotly json file contents"""
+        return cls(json.loads(data), version)
+
+    def __len__(self) -> int:
+        return len(self.point_trace)
+
+    def select_points(
+        self,
+        x_range: Range = None,
+        y_range: Range = None,
+        hidden_traces: Collection[int] = (),
+    ) -> np.ndarray:
+        """Picks points to draw for a view, at most MAX_POINTS
+        Args:
+            x_range: visible x axis range, whole axis if None
+            y_range: visible y axis range, whole axis if None
+            hidden_traces: indexes of traces hidden from graph
+
+        Returns: indexes of points to draw
+        """
+        mask = np.ones(len(self), dtype=bool)
+        if hidden_traces:
+            mask &= ~np.isin(self.point_trace, list(hidden_traces))
+        for values, axis_range in [(self.point_x, x_range), (self.point_y, y_range)]:
+            if axis_range is not None:
+                low, high = sorted(axis_range)
+                mask &= (values >= low) & (values <= high)
+        points = np.flatnonzero(mask)
+        if len(points) <= MAX_POINTS:
+            return points
+
+        # Too many points to draw, keeps one point per grid cell
+        cells = np.zeros(len(points), dtype=np.int64)
+        for values in [self.point_x[points], self.point_y[points]]:
+            low, high = np.nanmin(values), np.nanmax(values)
+            scale = GRID_SIZE / (high - low) if high > low else 0
+            cell = np.clip(((values - low) * scale).astype(np.int64), 0, GRID_SIZE - 1)
+            cells = cells * GRID_SIZE + cell
+        _, first = np.unique(cells, return_index=True)
+        return points[np.sort(first)][:MAX_POINTS]
+
+    def figure(
+        self,
+        x_range: Range = None,
+        y_range: Range = None,
+        hidden_traces: Collection[int] = (),
+    ) -> dict:
+        """Creates figure of graph view with points picked by select_points
+        Args:
+            x_range: visible x axis range, whole axis if None
+            y_range: visible y axis range, whole axis if None
+            hidden_traces: indexes of traces hidden from graph
+
+        Returns: plotly figure dict
+        """
+        points = self.select_points(x_range, y_range, hidden_traces)
+        points = points[np.argsort(self.point_trace[points], kind="stable")]
+        bounds = np.searchsorted(
+            self.point_trace[points], np.arange(len(self.traces) + 1)
+        )
+
+        data = []
+        for i, trace in enumerate(self.traces):
+            positions = np.sort(self.point_position[points[bounds[i] : bounds[i + 1]]])
+            view_trace = {
+                **trace,
+                "x": self.trace_x[i][positions],
+                "y": self.trace_y[i][positions],
+            }
+            if self.trace_customdata[i] is not None:
+                view_trace["customdata"] = self.trace_customdata[i][positions]
+            if i in hidden_traces:
+                view_trace["visible"] = "legendonly"
+            data.append(view_trace)
+
+        layout = copy.deepcopy(self.layout)
+        for axis, axis_range in [("xaxis", x_range), ("yaxis", y_range)]:
+            if axis_range is not None:
+                layout.setdefault(axis, {})["range"] = list(axis_range)
+        # Keeps zoom and legend state of browser when figure is replaced
+        layout["uirevision"] = self.version
+        return {"data": data, "layout": layout}
@@ -1,15 +1,63 @@
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Optional
+
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.wsgi import WSGIMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from dash_app_graph import create_dash_app_graph
-from utilities import get_dataframe_data
+from metrics_webpage import Histogram
+from utilities import (
+    ARTIFACT_CACHE,
+    ENCODING_SUFFIXES,
+    GRAPH_FILE,
+    TABLE_FILE,
+    get_encoded_artifact,
+    get_table_data,
+)
+
+# Files published by ETL that can be downloaded as they are
+PUBLISHED_FILES = {"car_graph.json": GRAPH_FILE, "car_table.parquet": TABLE_FILE}
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+# Request latency per route and response counts per status class, since start
+REQUEST_SECONDS: Dict[str, Histogram] = defaultdict(Histogram)
+RESPONSE_STATUSES = Counter()
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Mounted apps, e.g. dash graph, are reported under their mount path
+    route = request.scope.get("route")
+    path = route.path if route else request.scope.get("root_path") or "unmatched"
+    REQUEST_SECONDS[path].observe(time.perf_counter() - start)
+    RESPONSE_STATUSES[f"{response.status_code // 100}xx"] += 1
+    return response
+
+
+@app.on_event("startup")
+def warm_up_cache():
+    """Loads published files before first request"""
+    graph_variants = [GRAPH_FILE + suffix for suffix in ENCODING_SUFFIXES.values()]
+    ARTIFACT_CACHE.warm([TABLE_FILE, GRAPH_FILE] + graph_variants)
+
+
+@app.get("/metrics")
+def get_metrics():
+    return {
+        "cache": ARTIFACT_CACHE.metrics(),
+        "requests": {
+            path: histogram.snapshot() for path, histogram in REQUEST_SECONDS.items()
+        },
+        "responses": dict(RESPONSE_STATUSES),
+    }
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -18,8 +66,85 @@ def landing_page(request: Request):
 
 
 @app.get("/table", response_class=HTMLResponse)
-def get_status():
-    return get_dataframe_data()
+def get_status(request: Request):
+    table = get_table_data()
+    return templates.TemplateResponse(
+        "table.html",
+        {
+            "request": request,
+            "columns": table.columns,
+            "url_column": table.columns.index("url"),
+        },
+    )
+
+
+@app.get("/api/table")
+def get_table_page(
+    draw: int = Query(0, ge=0),
+    start: int = Query(0, ge=0),
+    length: int = Query(10, ge=-1),
+    search: str = Query("", alias="search[value]"),
+    order_column: Optional[int] = Query(None, alias="order[0][column]", ge=0),
+    order_dir: str = Query("asc", alias="order[0][dir]"),
+    output_format: str = Query("json", alias="format"),
+):
+    """Serves one page of car table, takes DataTables server side processing
+    params: draw, start, length, search[value], order[0][column], order[0][dir].
+    Page is returned as Arrow IPC stream when format=arrow
+    """
+    table = get_table_data()
+    if order_column is not None and order_column >= len(table.columns):
+        raise HTTPException(
+            status_code=422,
+            detail=f"order[0][column] must be less than {len(table.columns)}",
+        )
+    page, filtered = table.query(
+        start=start,
+        length=length,
+        search=search,
+        order_column=order_column,
+        descending=order_dir == "desc",
+    )
+    if output_format == "arrow":
+        return Response(
+            table.to_arrow(page),
+            media_type="application/vnd.apache.arrow.stream",
+            headers={
+                "X-Records-Total": str(len(table.df)),
+                "X-Records-Filtered": str(filtered),
+            },
+        )
+    return Response(
+        table.to_datatables_json(page, draw, filtered), media_type="application/json"
+    )
+
+
+@app.get("/data/{file_name}")
+def get_published_file(file_name: str, request: Request):
+    """Serves file published by ETL, pre-compressed if client accepts it.
+    Response has content based ETag, unchanged file gets 304 without body
+    """
+    if file_name not in PUBLISHED_FILES:
+        raise HTTPException(status_code=404)
+    artifact = get_encoded_artifact(
+        PUBLISHED_FILES[file_name], request.headers.get("accept-encoding", "")
+    )
+    if artifact is None:
+        raise HTTPException(status_code=404)
+
+    encoding = artifact.content_encoding
+    etag = (
+        f'"{artifact.content_hash}-{encoding}"'
+        if encoding
+        else f'"{artifact.content_hash}"'
+    )
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().replace("W/", "") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(artifact.body, media_type=artifact.content_type, headers=headers)
 
 
 # A bit odd, but the only way I've been able to get prefixing of the Dash app
@@ -0,0 +1,127 @@
+import io
+import json
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Max rows returned in one page
+MAX_PAGE_LENGTH = 1000
+# Number of recent search masks kept
+SEARCH_CACHE_SIZE = 32
+
+
+class TableData:
+    """Car table kept in memory and queried page by page, so only requested
+    rows are sent to the browser
+    Args:
+        df: car table, rows in default order
+        version: content hash of table file, identifies table in ETags
+    """
+
+    def __init__(self, df: pd.DataFrame, version: str = ""):
+        self.df = df.reset_index(drop=True)
+        self.version = version
+        self.columns = list(self.df.columns)
+        self.factorized: Dict[str, Tuple[np.ndarray, pd.Series]] = {}
+        self.sort_orders: Dict[str, np.ndarray] = {}
+        self.search_masks: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_parquet(cls, data: bytes, version: str = "") -> "TableData":
+        """Loads table from parquet file contents"""
+        return cls(pq.read_table(io.BytesIO(data)).to_pandas(), version)
+
+    def sort_order(self, column: str) -> np.ndarray:
+        """Row positions sorted by column ascending, missing values last"""
+        if column not in self.sort_orders:
+            values = self.df[column]
+            self.sort_orders[column] = values.sort_values(
+                kind="mergesort", na_position="last"
+            ).index.to_numpy()
+        return self.sort_orders[column]
+
+    def column_values(self, column: str) -> Tuple[np.ndarray, pd.Series]:
+        """Codes of column values and their lowercase text, -1 for missing"""
+        if column not in self.factorized:
+            codes, uniques = pd.factorize(self.df[column])
+            self.factorized[column] = (
+                codes,
+                pd.Series(uniques).astype(str).str.lower(),
+            )
+        return self.factorized[column]
+
+    def search_mask(self, search: str) -> np.ndarray:
+        """Rows containing search text in any column, case insensitive. Text is
+        matched against distinct values of each column, not every row"""
+        # Cache is shared by request threads, one of them may clear it any time
+        mask = self.search_masks.get(search)
+        if mask is None:
+            mask = np.zeros(len(self.df), dtype=bool)
+            for column in self.columns:
+                codes, texts = self.column_values(column)
+                matches = texts.str.contains(search.lower(), regex=False).to_numpy()
+                # Missing values (code -1) never match
+                mask |= np.append(matches, False)[codes]
+            if len(self.search_masks) >= SEARCH_CACHE_SIZE:
+                self.search_masks.clear()
+            self.search_masks[search] = mask
+        return mask
+
+    def query(
+        self,
+        start: int = 0,
+        length: int = MAX_PAGE_LENGTH,
+        search: str = "",
+        order_column: Optional[int] = None,
+        descending: bool = False,
+    ) -> Tuple[pd.DataFrame, int]:
+        """Filters, sorts and slices table
+        Args:
+            start: first row of page
+            length: rows in page, capped by MAX_PAGE_LENGTH, -1 for max
+            search: text rows have to contain
+            order_column: index of column to sort by, default order if None
+            descending: sort descending
+
+        Returns: page rows and number of rows passing the filter
+        """
+        if order_column is None:
+            positions = np.arange(len(self.df))
+        else:
+            positions = self.sort_order(self.columns[order_column])
+        if descending:
+            positions = positions[::-1]
+        if search:
+            positions = positions[self.search_mask(search)[positions]]
+
+        if length < 0 or length > MAX_PAGE_LENGTH:
+            length = MAX_PAGE_LENGTH
+        page = positions[start : start + length]
+        return self.df.take(page), len(positions)
+
+    def to_datatables_json(self, page: pd.DataFrame, draw: int, filtered: int) -> str:
+        """Creates DataTables server side processing response
+        Args:
+            page: page rows
+            draw: draw counter sent by DataTables
+            filtered: number of rows passing the filter
+
+        Returns: response json
+        """
+        meta = json.dumps(
+            {"draw": draw, "recordsTotal": len(self.df), "recordsFiltered": filtered}
+        )
+        data = page.to_json(orient="values", date_format="iso", double_precision=6)
+        return f'{meta[:-1]}, "data": {data}}}'
+
+    @staticmethod
+    def to_arrow(page: pd.DataFrame) -> bytes:
+        """Serializes page rows as Arrow IPC stream"""
+        table = pa.Table.from_pandas(page, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
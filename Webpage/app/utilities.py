@@ -1,40 +1,281 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, NamedTuple, Optional
+
 import boto3
-import cachetools.func
+from botocore.exceptions import ClientError
 
 from logger_webpage import LOGGER
-
+from metrics_webpage import Histogram, stage
+from graph_data import GraphData
+from table_data import TableData
 
 BUCKET = "car-scraper-vu-bucket"
-DATAFRAME_FILE = "output_files/dataframe_html.html"
+TABLE_FILE = "output_files/car_table.parquet"
 GRAPH_FILE = "output_files/car_graph.json"
+# Pre-compressed variants published by ETL, in order of preference
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
 
 CACHE_TIME = 60 * 60
+# Seconds before failed refresh of a stale file is retried
+REFRESH_RETRY_TIME = 60
+REFRESH_WORKERS = 2
+METRIC_COUNTS = ["hits", "misses", "stale_hits", "refreshes", "refresh_errors"]
+
+
+class S3Artifact(NamedTuple):
+    """File published by ETL, kept in memory
+    Args:
+        body: file contents
+        s3_etag: ETag of s3 object, used to revalidate it
+        content_hash: sha256 of uncompressed contents, same for all variants
+        content_type: MIME type
+        content_encoding: encoding of body, None if not compressed
+    """
+
+    body: bytes
+    s3_etag: str
+    content_hash: str
+    content_type: str
+    content_encoding: Optional[str] = None
+
+
+def fetch_s3_artifact(
+    file_path: str, cached: Optional[S3Artifact] = None
+) -> Optional[S3Artifact]:
+    """Downloads file from s3, cached file is downloaded only if it changed
+    Args:
+        file_path: file location on s3 bucket
+        cached: previously downloaded file
+
+    Returns: up to date file, None if it does not exist
+    """
+    params = {"Bucket": BUCKET, "Key": file_path}
+    if cached is not None:
+        params["IfNoneMatch"] = cached.s3_etag
+    try:
+        response = boto3.client("s3").get_object(**params)
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code in ("304", "NotModified"):
+            return cached
+        if code in ("404", "NoSuchKey"):
+            return None
+        raise
+    s3_etag = response["ETag"]
+    return S3Artifact(
+        body=response["Body"].read(),
+        s3_etag=s3_etag,
+        content_hash=response["Metadata"].get("content-sha256", s3_etag.strip('"')),
+        content_type=response.get("ContentType", "application/octet-stream"),
+        content_encoding=response.get("ContentEncoding"),
+    )
+
+
+class CacheEntry(NamedTuple):
+    """Cached file
+    Args:
+        artifact: file, None if it does not exist
+        value: object loaded from file, the file itself if it has no loader
+        checked_at: unix time file was last revalidated
+        expires_at: unix time after which file is revalidated again
+    """
+
+    artifact: Optional[S3Artifact]
+    value: Any
+    checked_at: float
+    expires_at: float
+
+
+class ArtifactCache:
+    """Stale-while-revalidate cache of s3 files. Once a file gets stale, its
+    last good version is still served while a background refresh revalidates
+    it. Only one refresh per file runs at a time, requests for a file not yet
+    cached wait for it instead of downloading it again
+    Args:
+        ttl: seconds after which file is revalidated
+        max_workers: number of background refresh threads
+    """
+
+    def __init__(self, ttl: float = CACHE_TIME, max_workers: int = REFRESH_WORKERS):
+        self.ttl = ttl
+        self.loaders: Dict[str, Callable[[S3Artifact], Any]] = {}
+        self.entries: Dict[str, CacheEntry] = {}
+        self.refreshes: Dict[str, Future] = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="cache-refresh"
+        )
+        self.counts = Counter()
+        self.refresh_seconds = Histogram()
+
+    def register(self, file_path: str, loader: Callable[[S3Artifact], Any]):
+        """Sets function loading cached value from file, it is called in
+        background refresh only when file changed"""
+        self.loaders[file_path] = loader
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def refresh(self, file_path: str) -> Future:
+        """Starts background refresh of file, unless one is already running
+        Args:
+            file_path: file location on s3 bucket
+
+        Returns: future of refreshed entry
+        """
+        with self.lock:
+            future = self.refreshes.get(file_path)
+            if future is None:
+                future = self.executor.submit(self.revalidate, file_path)
+                self.refreshes[file_path] = future
+            return future
+
+    def revalidate(self, file_path: str) -> CacheEntry:
+        """Revalidates file with s3, loading its value again if it changed.
+        Stale entry is kept when s3 fails
+        Args:
+            file_path: file location on s3 bucket
+
+        Returns: up to date entry
+        """
+        entry = self.entries.get(file_path)
+        cached = entry.artifact if entry else None
+        start = time.perf_counter()
+        try:
+            with stage("cache_refresh"):
+                artifact = fetch_s3_artifact(file_path, cached)
+                if entry is not None and artifact is cached:
+                    value = entry.value
+                elif artifact is not None and file_path in self.loaders:
+                    value = self.loaders[file_path](artifact)
+                else:
+                    value = artifact
+            now = time.time()
+            entry = CacheEntry(artifact, value, now, now + self.ttl)
+            self.count("refreshes")
+        except Exception:
+            self.count("refresh_errors")
+            if entry is None:
+                raise
+            LOGGER.exception(f"Serving stale {file_path}, refresh failed")
+            entry = entry._replace(expires_at=time.time() + REFRESH_RETRY_TIME)
+        finally:
+            seconds = time.perf_counter() - start
+            self.refresh_seconds.observe(seconds)
+            with self.lock:
+                if entry is not None:
+                    self.entries[file_path] = entry
+                self.refreshes.pop(file_path, None)
+        LOGGER.info(f"Revalidated {file_path} from s3 in {seconds:.2f}s")
+        return entry
+
+    def get(self, file_path: str) -> CacheEntry:
+        """Gets cached file, stale file is returned while it is refreshed
+        Args:
+            file_path: file location on s3 bucket
+
+        Returns: cache entry
+        """
+        entry = self.entries.get(file_path)
+        if entry is None:
+            self.count("misses")
+            return self.refresh(file_path).result()
+        self.count("hits")
+        if time.time() > entry.expires_at:
+            self.count("stale_hits")
+            self.refresh(file_path)
+        return entry
+
+    def warm(self, file_paths: Iterable[str]):
+        """Loads files in parallel, e.g. at startup so no request waits for them"""
+        for file_path, future in [(path, self.refresh(path)) for path in file_paths]:
+            try:
+                future.result()
+            except Exception:
+                LOGGER.exception(f"Could not warm up {file_path}")
+
+    def metrics(self) -> dict:
+        """Request and refresh counts, refresh latency histogram and age of
+        cached files"""
+        now = time.time()
+        return {
+            **{name: self.counts[name] for name in METRIC_COUNTS},
+            "refresh_seconds": self.refresh_seconds.snapshot(),
+            "age_seconds": {
+                file_path: round(now - entry.checked_at, 1)
+                for file_path, entry in self.entries.items()
+            },
+        }
+
+
+ARTIFACT_CACHE = ArtifactCache()
+ARTIFACT_CACHE.register(
+    GRAPH_FILE,
+    lambda artifact: GraphData.from_json(artifact.body, artifact.content_hash),
+)
+ARTIFACT_CACHE.register(
+    TABLE_FILE,
+    lambda artifact: TableData.from_parquet(artifact.body, artifact.content_hash),
+)
+
+
+def get_artifact(file_path: str) -> Optional[S3Artifact]:
+    """Gets file from s3 through cache
+    Args:
+        file_path: file location on s3 bucket
+
+    Returns: file, None if it does not exist
+    """
+    return ARTIFACT_CACHE.get(file_path).artifact
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    """Content encodings accepted by client, from Accept-Encoding header"""
+    encodings = set()
+    for value in accept_encoding.lower().split(","):
+        encoding, _, params = value.partition(";")
+        params = params.replace(" ", "")
+        try:
+            # Encodings with zero quality are refused
+            if params.startswith("q=") and float(params[2:]) == 0:
+                continue
+        except ValueError:
+            pass
+        encodings.add(encoding.strip())
+    return encodings
 
 
-def read_s3_file_to_memory(file_path):
-    """Reads file to memory from s3
+def get_encoded_artifact(file_path: str, accept_encoding: str) -> Optional[S3Artifact]:
+    """Gets best pre-compressed variant of file accepted by client
     Args:
         file_path: file location on s3 bucket
+        accept_encoding: Accept-Encoding header of request
 
-    Returns: file contents
+    Returns: file variant, None if file does not exist
     """
-    s3 = boto3.resource("s3")
-    bucket = s3.Bucket(BUCKET)
-    return bucket.Object(file_path).get()["Body"].read().decode("utf-8")
+    encodings = accepted_encodings(accept_encoding)
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if encoding in encodings:
+            artifact = get_artifact(file_path + suffix)
+            if artifact is not None:
+                return artifact
+    return get_artifact(file_path)
 
 
-@cachetools.func.ttl_cache(ttl=CACHE_TIME)
-def get_graph_data():
-    """Gets graph data from s3 for dash app"""
-    LOGGER.info("Getting Graph data from s3")
-    return read_s3_file_to_memory(GRAPH_FILE)
+def get_graph_data() -> GraphData:
+    """Gets graph from s3 for dash app, it is parsed again only when graph
+    file changed"""
+    return ARTIFACT_CACHE.get(GRAPH_FILE).value
 
 
-@cachetools.func.ttl_cache(ttl=CACHE_TIME)
-def get_dataframe_data():
-    """Gets dataframe data from s3 for flask"""
-    LOGGER.info("Getting Dataframe data from s3")
-    return read_s3_file_to_memory(DATAFRAME_FILE)
+def get_table_data() -> TableData:
+    """Gets car table from s3 for table api, it is parsed again only when
+    table file changed"""
+    return ARTIFACT_CACHE.get(TABLE_FILE).value
 
 
 def get_landing_page():
@@ -0,0 +1,73 @@
+import json
+import os
+from typing import Iterable
+
+import boto3
+
+BUCKET = "car-scraper-vu-bucket"
+TABLE_NAME = "car_table"
+OUTPUT_PREFIX = "output_files/"
+
+
+def create_car_table():
+    """Creates car table in moto DynamoDB, as scraper and ETL expect it"""
+    return boto3.resource("dynamodb").create_table(
+        TableName=TABLE_NAME,
+        KeySchema=[{"AttributeName": "url", "KeyType": "HASH"}],
+        AttributeDefinitions=[{"AttributeName": "url", "AttributeType": "S"}],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def put_items(table, items: Iterable[dict]):
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def create_bucket():
+    boto3.client("s3").create_bucket(
+        Bucket=BUCKET,
+        CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+    )
+
+
+def artifacts_dir(options: dict, size: int) -> str:
+    """Folder of files published by ETL run of data set size"""
+    return os.path.join(options["work_dir"], "artifacts", f"{options['seed']}_{size}")
+
+
+def save_artifacts(directory: str):
+    """Saves files published by ETL with their s3 headers, for web app suite"""
+    s3 = boto3.client("s3")
+    os.makedirs(directory, exist_ok=True)
+    manifest = {}
+    response = s3.list_objects_v2(Bucket=BUCKET, Prefix=OUTPUT_PREFIX)
+    for item in response.get("Contents", []):
+        obj = s3.get_object(Bucket=BUCKET, Key=item["Key"])
+        file_name = item["Key"][len(OUTPUT_PREFIX) :]
+        with open(os.path.join(directory, file_name), "wb") as f:
+            f.write(obj["Body"].read())
+        manifest[file_name] = {
+            "ContentType": obj["ContentType"],
+            "Metadata": obj["Metadata"],
+            **(
+                {"ContentEncoding": obj["ContentEncoding"]}
+                if obj.get("ContentEncoding")
+                else {}
+            ),
+        }
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f)
+
+
+def upload_artifacts(directory: str):
+    """Uploads files saved by save_artifacts to moto s3"""
+    s3 = boto3.client("s3")
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    for file_name, params in manifest.items():
+        with open(os.path.join(directory, file_name), "rb") as f:
+            s3.put_object(
+                Bucket=BUCKET, Key=OUTPUT_PREFIX + file_name, Body=f.read(), **params
+            )
@@ -0,0 +1,429 @@
+import multiprocessing
+import os
+import shutil
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from moto import mock_aws
+
+import etl_car_scraper
+import etl_model
+from bench_aws import (
+    artifacts_dir,
+    create_bucket,
+    create_car_table,
+    put_items,
+    save_artifacts,
+)
+import bench_reference_etl
+from bench_fixtures import (
+    LinkStubServer,
+    ReplayServer,
+    RssSampler,
+    generate_items,
+    listing_path,
+)
+from etl_features import FeaturePreprocessor
+from etl_model import PriceModel, SegmentedPriceModel
+from etl_state import save_snapshot
+from get_requests import get_link_statuses
+from metrics_etl import stage
+
+# Listing links of data sets not served by replay server
+OFFLINE_URL = "http://localhost/"
+# Distinct listings generated for in memory tables, larger tables repeat them
+FRAME_LISTINGS = 50000
+# Every n-th link is found not working by out of core suite
+DEAD_LINK_EVERY = 20
+
+
+def run_etl_suite(size: int, options: dict, collector) -> dict:
+    """Runs ETL on car table of data set and saves published files. Memory of
+    the ETL run is sampled apart from moto tables, which stay in memory
+    """
+    shutil.rmtree(etl_car_scraper.STATE_LOCATION, ignore_errors=True)
+    with ReplayServer(size, options["seed"], options["latency"]) as server, mock_aws():
+        table = create_car_table()
+        create_bucket()
+        start = time.perf_counter()
+        items = generate_items(size, server.base_url, options["seed"])
+        put_items(table, items)
+        setup_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with RssSampler() as rss:
+            etl_car_scraper.run_etl(chunked=options["chunked"])
+        wall_seconds = time.perf_counter() - start
+        save_artifacts(artifacts_dir(options, size))
+
+    stages = collector.stages()
+    run = stages.pop("run_etl")
+    return {
+        "setup_seconds": round(setup_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {"rows_per_second": round(len(items) / wall_seconds, 1)},
+        "chunked": options["chunked"],
+        "etl_rss": rss.result(),
+        "http_latency": run.pop("http_latency", None),
+        "counts": run,
+        "stages": stages,
+    }
+
+
+def scan_items(table) -> pd.DataFrame:
+    """Extraction as before segmented scan, one sequential scan of all
+    attributes into a list of dicts
+    """
+    items = []
+    for page in etl_car_scraper.scan_table_pages(table):
+        items.extend(page)
+    return pd.DataFrame(items)
+
+
+def run_scan_suite(size: int, options: dict, collector) -> dict:
+    """Scans car table of data set with sequential scan of items and with
+    segmented projected scan into columns. Moto serves every page and segment
+    by going over the whole table, so it dominates scan times of large sizes
+    """
+    with mock_aws():
+        table = create_car_table()
+        start = time.perf_counter()
+        put_items(table, generate_items(size, OFFLINE_URL, options["seed"]))
+        setup_seconds = time.perf_counter() - start
+
+        scans = {
+            "sequential_items": lambda: scan_items(table),
+            "segmented_columns": etl_car_scraper.scan_car_table,
+        }
+        results = {}
+        start = time.perf_counter()
+        for name, scan in scans.items():
+            scan_start = time.perf_counter()
+            df = scan()
+            scan_seconds = time.perf_counter() - scan_start
+            results[name] = {
+                "seconds": round(scan_seconds, 3),
+                "rows_per_second": round(len(df) / scan_seconds, 1),
+                "frame_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+            }
+            del df
+        wall_seconds = time.perf_counter() - start
+
+    return {
+        "setup_seconds": round(setup_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "rows_per_second": results["segmented_columns"]["rows_per_second"]
+        },
+        "scans": results,
+        "stages": collector.stages(),
+    }
+
+
+def run_link_check_suite(size: int, options: dict, collector) -> dict:
+    """Checks links of all cars of data set against aiohttp stub server"""
+    server = LinkStubServer(
+        size, options["seed"], options["latency"], options["throttle"]
+    )
+    with server:
+        urls = [server.base_url + listing_path(i) for i in range(size)]
+        start = time.perf_counter()
+        with stage("link_check"):
+            link_statuses = get_link_statuses(urls)
+        wall_seconds = time.perf_counter() - start
+
+    run = collector.stages()["link_check"]
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {"links_per_second": round(size / wall_seconds, 1)},
+        "links": {
+            "not_working": sum(not status.working for status in link_statuses),
+            "errors": sum(status.error is not None for status in link_statuses),
+        },
+        "http_latency": run.pop("http_latency", None),
+        "counts": run,
+    }
+
+
+def car_frame(size: int, seed: int = 0) -> pd.DataFrame:
+    """Car table data of data set as scanned, numbers converted from Decimal.
+    Listings repeat after FRAME_LISTINGS, urls stay unique
+    """
+    items = generate_items(min(size, FRAME_LISTINGS), OFFLINE_URL, seed)
+    df = pd.DataFrame(
+        {
+            column: [item.get(column) for item in items]
+            for column in etl_car_scraper.EXTRACT_COLUMNS
+        }
+    )
+    for column in etl_car_scraper.INTEGER_COLUMNS + etl_car_scraper.FLOAT_COLUMNS:
+        df[column] = pd.to_numeric(df[column])
+    df = df.iloc[np.arange(size) % len(df)].reset_index(drop=True)
+    df["url"] = OFFLINE_URL + pd.Series(np.arange(size)).astype(str)
+    return df
+
+
+def measure(function: Callable, *args) -> Tuple[float, float]:
+    """Runs function twice, timed and then with traced allocations
+    Returns: seconds and peak MB allocated while function ran
+    """
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args)
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return round(seconds, 3), round(peak_mb, 1)
+
+
+def run_transform_suite(size: int, options: dict, collector) -> dict:
+    """Transforms car table of data set into model features with column by
+    column transform it replaced and with fitted preprocessor
+    """
+    df = car_frame(size, options["seed"])
+    preprocessor = FeaturePreprocessor().fit(df)
+    transforms = {
+        "column_by_column": lambda: bench_reference_etl.transform_data(df),
+        "preprocessor_fit_transform": lambda: etl_car_scraper.transform_data(df),
+        "preprocessor_transform": lambda: etl_car_scraper.transform_data(
+            df, preprocessor
+        ),
+    }
+    results = {}
+    start = time.perf_counter()
+    for name, transform in transforms.items():
+        seconds, peak_mb = measure(transform)
+        results[name] = {
+            "seconds": seconds,
+            "rows_per_second": round(size / seconds, 1),
+            "peak_mb": peak_mb,
+        }
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "rows_per_second": results["preprocessor_fit_transform"]["rows_per_second"]
+        },
+        "frame_mb": round(df.memory_usage(deep=True).sum() / 2**20, 1),
+        "transforms": results,
+    }
+
+
+def measure_fresh(
+    function: Callable, make_args: Callable[[], tuple]
+) -> Tuple[float, float]:
+    """Like measure, with fresh arguments for each run as function may modify
+    them. Arguments are made before allocations are traced
+    Returns: seconds and peak MB allocated above arguments while function ran
+    """
+    args = make_args()
+    start = time.perf_counter()
+    function(*args)
+    seconds = time.perf_counter() - start
+    args = make_args()
+    tracemalloc.start()
+    function(*args)
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return round(seconds, 3), round(peak_mb, 1)
+
+
+def run_final_table_suite(size: int, options: dict, collector) -> dict:
+    """Assembles final table from scored car table of data set with the chain
+    of joins, copies and merge it replaced and with in place prepare_final_df
+    """
+    scored = car_frame(size, options["seed"])
+    x, y, preprocessor = etl_car_scraper.transform_data(scored)
+    model = PriceModel(preprocessor).fit(x, y)
+    scored["price_pred"] = model.predict(x)
+    scored["model_version"] = model.version
+    target = pd.Series(y, index=scored.index)
+    updated_links_df = checked_links(scored)
+    scaler_dict = preprocessor.scaler_dict
+    del x
+
+    assemblies = {
+        "join_copy_merge": (
+            bench_reference_etl.final_table,
+            lambda: (scored.copy(), target, scaler_dict, updated_links_df),
+        ),
+        "in_place": (
+            lambda df: etl_car_scraper.prepare_final_df(
+                df,
+                scaler_dict,
+                etl_car_scraper.good_links_mask(df, updated_links_df),
+            ),
+            lambda: (scored.copy(),),
+        ),
+    }
+    results = {}
+    start = time.perf_counter()
+    for name, (assemble, make_args) in assemblies.items():
+        seconds, peak_mb = measure_fresh(assemble, make_args)
+        results[name] = {
+            "seconds": seconds,
+            "rows_per_second": round(size / seconds, 1),
+            "peak_mb": peak_mb,
+        }
+    wall_seconds = time.perf_counter() - start
+
+    assemble, make_args = assemblies["in_place"]
+    final_df = assemble(*make_args())
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {"rows_per_second": results["in_place"]["rows_per_second"]},
+        "frame_mb": round(scored.memory_usage(deep=True).sum() / 2**20, 1),
+        "final_rows": len(final_df),
+        "final_mb": round(final_df.memory_usage(deep=True).sum() / 2**20, 1),
+        "assemblies": results,
+    }
+
+
+def run_segments_suite(size: int, options: dict, collector) -> dict:
+    """Fits segment models of car table of data set with each number of worker
+    processes, against global model alone, and reports error of each segment.
+    Process pool is used at any size here, so its startup cost is measured too
+    """
+    df = car_frame(size, options["seed"])
+    x, y, preprocessor = etl_car_scraper.transform_data(df)
+    etl_model.PARALLEL_SEGMENT_ROWS = 0
+
+    start = time.perf_counter()
+    global_model = PriceModel(preprocessor).fit(x, y)
+    global_seconds = time.perf_counter() - start
+
+    model = SegmentedPriceModel(preprocessor, max_workers=1).fit(x, y, df)
+    dense = model.dense_features(x)
+    segment_rows = {key: model.segment_rows(df)[key] for key in model.segments}
+    fit_seconds = {}
+    wall_start = time.perf_counter()
+    for max_workers in options["workers"]:
+        start = time.perf_counter()
+        etl_model.fit_segments(dense, y, segment_rows, max_workers)
+        fit_seconds[max_workers] = time.perf_counter() - start
+    wall_seconds = time.perf_counter() - wall_start
+
+    # Ratios use unrounded times, small data sets are fit in under a millisecond.
+    # Speedups are left out when there are no segments to fit
+    baseline = fit_seconds.get(1)
+    workers = {
+        max_workers: {
+            "seconds": round(seconds, 3),
+            "speedup": (
+                round((baseline or seconds) / seconds, 2)
+                if seconds and segment_rows
+                else None
+            ),
+        }
+        for max_workers, seconds in fit_seconds.items()
+    }
+    best_seconds = min(fit_seconds.values())
+    price_std = preprocessor.scaler_dict[preprocessor.target]["std"]
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "segments_per_second": (
+                round(len(segment_rows) / best_seconds, 1) if best_seconds else None
+            )
+        },
+        "cpu_count": os.cpu_count(),
+        "segments": len(segment_rows),
+        "global_model": {
+            "seconds": round(global_seconds, 3),
+            "mae": round(global_model.train_error * price_std, 1),
+        },
+        "segmented_mae": round(model.train_error * price_std, 1),
+        "workers": workers,
+        "segment_errors": {
+            "+".join(key): {name: round(value, 1) for name, value in error.items()}
+            for key, error in model.segment_errors.items()
+        },
+    }
+
+
+def write_car_parquet(size: int, path: str, seed: int = 0):
+    """Writes car table data of data set to parquet file as spooled by chunked
+    ETL, FRAME_LISTINGS rows at a time
+    """
+    listings = car_frame(min(size, FRAME_LISTINGS), seed)
+    schema = etl_car_scraper.CHUNK_SCHEMA
+    with pq.ParquetWriter(path, schema) as writer:
+        for start in range(0, size, FRAME_LISTINGS):
+            df = listings.iloc[: size - start]
+            df = df.assign(url=OFFLINE_URL + pd.Series(start + df.index).astype(str))
+            writer.write_table(pa.Table.from_pandas(df, schema=schema))
+
+
+def checked_links(df: pd.DataFrame) -> pd.DataFrame:
+    """Link check results with every DEAD_LINK_EVERY-th link not working"""
+    return pd.DataFrame(
+        {"url": df["url"], "working_link": np.arange(len(df)) % DEAD_LINK_EVERY != 0}
+    )
+
+
+def transform_in_memory(path: str, snapshot_path: str) -> pd.DataFrame:
+    """In memory ETL of spooled car table, without DynamoDB and link requests"""
+    df = pq.read_table(path).to_pandas()
+    model, _ = etl_car_scraper.score_prices(df, None)
+    updated_links_df = checked_links(df)
+    etl_car_scraper.apply_working_links(df, updated_links_df)
+    save_snapshot(df, snapshot_path)
+    rows = etl_car_scraper.good_links_mask(df, updated_links_df)
+    return etl_car_scraper.prepare_final_df(df, model.preprocessor.scaler_dict, rows)
+
+
+def transform_chunked(path: str, snapshot_path: str) -> pd.DataFrame:
+    """Chunked ETL of spooled car table, without DynamoDB and link requests"""
+    scored_path, model = etl_car_scraper.score_chunked([path])
+    links_df = pq.read_table(scored_path, columns=etl_car_scraper.LINK_COLUMNS)
+    updated_links_df = checked_links(links_df.to_pandas())
+    del links_df
+    final_df = etl_car_scraper.prepare_final_df_chunked(
+        scored_path, model.preprocessor.scaler_dict, updated_links_df, snapshot_path
+    )
+    os.remove(scored_path)
+    return final_df
+
+
+def run_out_of_core_suite(size: int, options: dict, collector) -> dict:
+    """Turns spooled car table of data set into final table in memory, or chunk
+    by chunk with --chunked. Run both to compare memory: DynamoDB and link
+    requests are left out, so moto tables and responses do not hide it
+    """
+    work_dir = os.path.join(options["work_dir"], "out_of_core")
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, "car_table.parquet")
+    snapshot_path = os.path.join(work_dir, "snapshot.parquet")
+    # Written by another process, so memory freed by setup is not reused by run
+    start = time.perf_counter()
+    setup = multiprocessing.get_context("spawn").Process(
+        target=write_car_parquet, args=(size, path, options["seed"])
+    )
+    setup.start()
+    setup.join()
+    setup_seconds = time.perf_counter() - start
+
+    transform = transform_chunked if options["chunked"] else transform_in_memory
+    start = time.perf_counter()
+    with RssSampler() as rss:
+        final_df = transform(path, snapshot_path)
+    wall_seconds = time.perf_counter() - start
+    shutil.rmtree(work_dir)
+
+    return {
+        "setup_seconds": round(setup_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {"rows_per_second": round(size / wall_seconds, 1)},
+        "chunked": options["chunked"],
+        "rss": rss.result(),
+        "final_rows": len(final_df),
+        "final_mb": round(final_df.memory_usage(deep=True).sum() / 2**20, 1),
+        "stages": collector.stages(),
+    }
@@ -0,0 +1,449 @@
+import asyncio
+import html
+import http.server
+import multiprocessing
+import os
+import random
+import re
+import threading
+import time
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+# Listings per search page, as on autogidas.lt
+LISTINGS_PER_PAGE = 20
+# Share of listings shown as sold on search pages and gone on link checks
+SOLD_SHARE = 0.05
+DAY = 24 * 60 * 60
+# Retry-After of responses throttled by replay server, in seconds
+THROTTLE_RETRY_AFTER = 1
+# Every n-th link of link stub server answers HEAD with 405, as some sites do
+HEAD_UNSUPPORTED_EVERY = 10
+# Scrape times are spread over this period, so some links are due for a check
+SCRAPED_WITHIN = 10 * DAY
+
+BRANDS = {
+    "Audi": (["A3", "A4", "A6", "Q5", "Q7"], 1.3),
+    "BMW": (["116", "320", "520", "X3", "X5"], 1.35),
+    "Volkswagen": (["Golf", "Passat", "Touran", "Tiguan", "Polo"], 1.0),
+    "Toyota": (["Corolla", "Avensis", "RAV4", "Yaris", "Auris"], 1.1),
+    "Opel": (["Astra", "Zafira", "Insignia", "Corsa", "Vectra"], 0.8),
+    "Skoda": (["Octavia", "Superb", "Fabia", "Kodiaq", "Rapid"], 0.95),
+    "Ford": (["Focus", "Mondeo", "Fiesta", "Kuga", "S-Max"], 0.85),
+    "Renault": (["Megane", "Laguna", "Clio", "Scenic", "Kadjar"], 0.75),
+}
+FUELS = ["Dyzelinas", "Benzinas", "Benzinas / dujos", "Elektra", "Hibridas"]
+BODIES = ["Sedanas", "Universalas", "Hečbekas", "Visureigis", "Vienatūris"]
+COLORS = ["Juoda", "Pilka", "Balta", "Mėlyna", "Raudona", "Sidabrinė"]
+TRANSMISSIONS = ["Mechaninė", "Automatinė"]
+WHEEL_DRIVES = ["Priekiniai", "Galiniai", "Visi varantys"]
+DEFECTS = ["Be defektų", "Daužtas", "Pavarų dėžės defektas"]
+
+
+def generate_listing(i: int, seed: int = 0) -> dict:
+    """Creates synthetic car listing, the same for the same index and seed
+    Args:
+        i: listing index
+        seed: data set seed
+
+    Returns: car page parameters as shown on autogidas.lt, plus listing id
+    """
+    rng = random.Random(seed * 1_000_003 + i)
+    brand = rng.choice(list(BRANDS))
+    models, brand_factor = BRANDS[brand]
+    year = rng.randint(2000, 2022)
+    engine = rng.choice([1.2, 1.4, 1.6, 1.9, 2.0, 2.5, 3.0])
+    kw = int(engine * rng.uniform(45, 75))
+    milage = max(0, int((2023 - year) * rng.uniform(8000, 30000)))
+    price = int(
+        brand_factor
+        * 30000
+        * 0.87 ** (2023 - year)
+        * (1 + kw / 300)
+        * rng.uniform(0.75, 1.25)
+    )
+    params = {
+        "Kaina": f"{price:,} €".replace(",", " "),
+        "Markė": brand,
+        "Modelis": rng.choice(models),
+        "Metai": f"{year}-{rng.randint(1, 12):02d}",
+        "Variklis": f"{engine} l., {kw} kW ({int(kw * 1.36)} AG)",
+        "Kuro tipas": rng.choice(FUELS),
+        "Kėbulo tipas": rng.choice(BODIES),
+        "Spalva": rng.choice(COLORS),
+        "Pavarų dėžė": rng.choice(TRANSMISSIONS),
+        "Rida": f"{milage:,} km".replace(",", " "),
+        "Varomieji ratai": rng.choice(WHEEL_DRIVES),
+        "Defektai": rng.choice(DEFECTS),
+        "Vairo padėtis": "Kairėje",
+        "Durų skaičius": rng.choice(["4/5", "2/3"]),
+        "TA iki": f"{rng.randint(2023, 2026)}-{rng.randint(1, 12):02d}",
+        "Mieste": f"{rng.uniform(4, 12):.1f}",
+        "Užmiestyje": f"{rng.uniform(3.5, 8):.1f}",
+        "Mišrus": f"{rng.uniform(4, 10):.1f}",
+    }
+    return {
+        "id": i,
+        "sold": rng.random() < SOLD_SHARE,
+        "scraped_ago": rng.uniform(0, SCRAPED_WITHIN),
+        "params": params,
+    }
+
+
+def listing_path(i: int) -> str:
+    return f"skelbimas/{i}.html"
+
+
+def render_search_page(page_nr: int, n_listings: int, seed: int = 0) -> str:
+    """Renders search page with listing articles and page numbers
+    Args:
+        page_nr: page number, from 1
+        n_listings: number of listings in data set
+        seed: data set seed
+
+    Returns: page HTML
+    """
+    last_page = max(1, -(-n_listings // LISTINGS_PER_PAGE))
+    start = (page_nr - 1) * LISTINGS_PER_PAGE
+    articles = []
+    for i in range(start, min(start + LISTINGS_PER_PAGE, n_listings)):
+        listing = generate_listing(i, seed)
+        params = listing["params"]
+        sold = '<div class="sold-item">Parduota</div>' if listing["sold"] else ""
+        articles.append(
+            f'<article class="list-item"><a class="item-link" '
+            f'href="{listing_path(i)}"><h2>{html.escape(params["Markė"])} '
+            f'{html.escape(params["Modelis"])}</h2></a>'
+            f'<div class="item-price">{params["Kaina"]}</div>'
+            f'<div class="item-description">{params["Metai"]}, '
+            f'{params["Variklis"]}, {params["Rida"]}</div>{sold}</article>'
+        )
+    # Only first and last page numbers, scraper picks last page by page text
+    pages = "".join(f'<div class="page">{nr}</div>' for nr in sorted({1, last_page}))
+    return (
+        "<!DOCTYPE html><html><head><title>Automobiliai</title></head><body>"
+        f'<header><nav>{"<a href=#>Meniu</a>" * 20}</nav></header>'
+        f'<main><section class="items">{"".join(articles)}</section>'
+        f'<div class="paginator">{pages}</div></main>'
+        "<footer>autogidas.lt</footer></body></html>"
+    )
+
+
+def render_car_page(i: int, seed: int = 0) -> str:
+    """Renders car page with a parameter block per car detail
+    Args:
+        i: listing index
+        seed: data set seed
+
+    Returns: page HTML
+    """
+    params = generate_listing(i, seed)["params"]
+    blocks = "".join(
+        f'<div class="param"><div class="left">{html.escape(name)}</div>'
+        f'<div class="right">{html.escape(value)}</div></div>'
+        for name, value in params.items()
+    )
+    return (
+        "<!DOCTYPE html><html><head><title>Skelbimas</title></head><body>"
+        f'<header><nav>{"<a href=#>Meniu</a>" * 20}</nav></header>'
+        f'<main><div class="params-block">{blocks}</div>'
+        '<div class="param extra"><div class="left">Kontaktai</div>'
+        '<div class="right">+370</div></div>'
+        f'<div class="description">{"Tvarkingas automobilis. " * 30}</div></main>'
+        "<footer>autogidas.lt</footer></body></html>"
+    )
+
+
+def listing_to_item(listing: dict, base_url: str, now: float) -> dict:
+    """Converts synthetic listing to DynamoDB item as written by scraper
+    Args:
+        listing: synthetic listing
+        base_url: url of replay server, listing links point to it
+        now: unix time of data set creation
+
+    Returns: car table item
+    """
+    params = listing["params"]
+    engine, kw = re.match(r"([\d.]+) l\., (\d+) kW", params["Variklis"]).groups()
+    return {
+        "url": base_url + listing_path(listing["id"]),
+        "price": int(re.sub(r"\D", "", params["Kaina"])),
+        "brand": params["Markė"],
+        "model": params["Modelis"],
+        "year": params["Metai"],
+        "engine": Decimal(engine),
+        "kw": int(kw),
+        "fuel": params["Kuro tipas"],
+        "body": params["Kėbulo tipas"],
+        "color": params["Spalva"],
+        "transmission": params["Pavarų dėžė"],
+        "milage": int(re.sub(r"\D", "", params["Rida"])),
+        "wheel_drive": params["Varomieji ratai"],
+        "defects": params["Defektai"],
+        "steering_wheel": params["Vairo padėtis"],
+        "doors": params["Durų skaičius"],
+        "docs": params["TA iki"],
+        "rims": None,
+        "first_registration": None,
+        "consumption_city": Decimal(params["Mieste"]),
+        "consumption_road": Decimal(params["Užmiestyje"]),
+        "consumption_mixed": Decimal(params["Mišrus"]),
+        "working_link": True,
+        "scraped_at": int(now - listing["scraped_ago"]),
+    }
+
+
+def generate_items(n_listings: int, base_url: str, seed: int = 0) -> List[dict]:
+    """DynamoDB items of all synthetic listings, sold ones were scraped before
+    they sold, so their links are found not working by ETL link checks
+    """
+    now = time.time()
+    return [
+        listing_to_item(generate_listing(i, seed), base_url, now)
+        for i in range(n_listings)
+    ]
+
+
+class ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """Serves synthetic autogidas.lt pages. Search pages are served at
+    /skelbimai/?page=N, car pages at /skelbimas/N.html, sold cars are 404.
+    Throttles like a busy site: a random share of requests and requests over
+    max_concurrent in flight get 429 with Retry-After or 503 without it
+    """
+
+    protocol_version = "HTTP/1.1"
+    n_listings = 0
+    seed = 0
+    latency = 0.0
+    throttle = 0.0
+    max_concurrent = 0
+    in_flight = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def page(self) -> Optional[bytes]:
+        search = re.search(r"page=(\d+)", self.path)
+        if search:
+            page = render_search_page(int(search.group(1)), self.n_listings, self.seed)
+            return page.encode("utf-8")
+        car = re.search(r"skelbimas/(\d+)\.html", self.path)
+        if car and int(car.group(1)) < self.n_listings:
+            i = int(car.group(1))
+            if not generate_listing(i, self.seed)["sold"]:
+                return render_car_page(i, self.seed).encode("utf-8")
+        return None
+
+    def is_throttled(self) -> bool:
+        with self.lock:
+            overloaded = self.max_concurrent and self.in_flight > self.max_concurrent
+        return bool(overloaded) or random.random() < self.throttle
+
+    def respond(self, send_body: bool):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if self.is_throttled():
+                self.send_throttled()
+                return
+            body = self.page()
+            self.send_body(200 if body is not None else 404, body, send_body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def send_throttled(self):
+        if random.random() < 0.5:
+            self.send_response(429)
+            self.send_header("Retry-After", str(THROTTLE_RETRY_AFTER))
+        else:
+            self.send_response(503)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def send_body(self, status: int, body: Optional[bytes], send_body: bool):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body or b"")))
+        self.end_headers()
+        if send_body and body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+
+def serve(n_listings: int, seed: int, latency: float, throttle: dict, connection):
+    """Runs replay server until process is terminated, sends its port first"""
+    handler = type(
+        "Handler",
+        (ReplayHandler,),
+        {"n_listings": n_listings, "seed": seed, "latency": latency, **throttle},
+    )
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+def serve_links(n_listings: int, seed: int, latency: float, throttle: dict, connection):
+    """Runs aiohttp stub of car page links until process is terminated, sends
+    its port first. Answers with status only: sold cars are 404, a random
+    share of requests is throttled and some links do not support HEAD
+    """
+
+    async def check_link(request: web.Request) -> web.Response:
+        if latency:
+            await asyncio.sleep(latency)
+        if random.random() < throttle["throttle"]:
+            if random.random() < 0.5:
+                return web.Response(
+                    status=429, headers={"Retry-After": str(THROTTLE_RETRY_AFTER)}
+                )
+            return web.Response(status=503)
+        i = int(request.match_info["i"])
+        if request.method == "HEAD" and i % HEAD_UNSUPPORTED_EVERY == 0:
+            return web.Response(status=405)
+        if i >= n_listings or generate_listing(i, seed)["sold"]:
+            return web.Response(status=404)
+        return web.Response(text="ok")
+
+    async def start():
+        app = web.Application()
+        app.router.add_route("*", r"/skelbimas/{i:\d+}.html", check_link)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        connection.send(runner.addresses[0][1])
+        await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+
+class ReplayServer:
+    """Local HTTP server replaying autogidas.lt pages of a synthetic data set.
+    Runs in its own process, so rendering pages does not load the benchmarked one
+    Args:
+        n_listings: number of listings in data set
+        seed: data set seed
+        latency: seconds each response is delayed, to mimic network
+        throttle: share of requests throttled at random
+        max_concurrent: requests in flight over this are throttled, 0 for no limit
+    """
+
+    # Function running server in its process
+    serve = staticmethod(serve)
+
+    def __init__(
+        self,
+        n_listings: int,
+        seed: int = 0,
+        latency: float = 0.0,
+        throttle: float = 0.0,
+        max_concurrent: int = 0,
+    ):
+        self.n_listings = n_listings
+        self.port = None
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=self.serve,
+            args=(
+                n_listings,
+                seed,
+                latency,
+                {"throttle": throttle, "max_concurrent": max_concurrent},
+                child_connection,
+            ),
+            daemon=True,
+        )
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/"
+
+    @property
+    def search_page(self) -> str:
+        return self.base_url + "skelbimai/?page={page_nr}"
+
+    @property
+    def n_pages(self) -> int:
+        return max(1, -(-self.n_listings // LISTINGS_PER_PAGE))
+
+    def __enter__(self) -> "ReplayServer":
+        self.process.start()
+        self.port = self.connection.recv()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.process.terminate()
+        self.process.join()
+
+
+class LinkStubServer(ReplayServer):
+    """Local aiohttp server answering link checks of car pages of a synthetic
+    data set, at the same paths as ReplayServer
+    """
+
+    serve = staticmethod(serve_links)
+
+
+def percentiles(values: List[float], scale: float = 1000.0) -> Dict[str, float]:
+    """p50, p90, p99 and max of values, in milliseconds for seconds by default"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def at(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale, 3)
+
+    return {"p50": at(0.5), "p90": at(0.9), "p99": at(0.99), "max": at(1.0)}
+
+
+def rss_mb() -> float:
+    """Current resident memory of the process"""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+class RssSampler:
+    """Samples resident memory in a background thread, so peak memory of a part
+    of the run is measured even when setup, e.g. moto tables, used more before it
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = 0.0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while not self.stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def __enter__(self) -> "RssSampler":
+        self.start_mb = self.peak_mb = rss_mb()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+
+    def result(self) -> Dict[str, float]:
+        return {
+            "start_mb": round(self.start_mb, 1),
+            "peak_mb": round(self.peak_mb, 1),
+            "delta_mb": round(self.peak_mb - self.start_mb, 1),
+        }
@@ -0,0 +1,163 @@
+"""ETL steps as they were before being optimized, kept to benchmark the
+current ones against
+"""
+
+import datetime
+from typing import Iterable, List, Tuple
+
+import pandas as pd
+
+FEATURES_TO_USE = [
+    "docs",
+    "steering_wheel",
+    "consumption_road",
+    "consumption_city",
+    "consumption_mixed",
+    "wheel_drive",
+    "fuel",
+    "brand",
+    "kw",
+    "doors",
+    "milage",
+    "defects",
+    "year",
+    "price",
+    "engine",
+    "body",
+    "transmission",
+]
+FEATURES_TO_ENCODE = [
+    "steering_wheel",
+    "wheel_drive",
+    "fuel",
+    "brand",
+    "doors",
+    "defects",
+    "body",
+    "transmission",
+]
+
+
+def one_hot_encode(df: pd.DataFrame, columns: list) -> pd.DataFrame:
+    return pd.get_dummies(df, columns=columns)
+
+
+def feature_transform_and_normalization(
+    df: pd.DataFrame, features_to_norm: Iterable[str], date_features: List[str]
+) -> Tuple[pd.DataFrame, dict]:
+    transformed_df = df.copy()
+    for feature in features_to_norm:
+        if feature in date_features:
+            transformed_df[feature] = (
+                datetime.datetime.today()
+                - pd.to_datetime(transformed_df[feature], format="%Y-%m")
+            ).dt.days
+        else:
+            transformed_df[feature] = pd.to_numeric(
+                transformed_df[feature], errors="raise"
+            )
+    scaler_dict = pd.DataFrame(
+        [transformed_df.mean(numeric_only=True), transformed_df.std(numeric_only=True)],
+        index=["mean", "std"],
+    ).to_dict()
+    for feature in features_to_norm:
+        transformed_df[feature] = (
+            transformed_df[feature] - scaler_dict[feature]["mean"]
+        ) / scaler_dict[feature]["std"]
+
+    return transformed_df, scaler_dict
+
+
+def transform_data(df: pd.DataFrame) -> Tuple[pd.DataFrame, dict]:
+    features_to_normalize = set(FEATURES_TO_USE) - set(FEATURES_TO_ENCODE)
+    norm_df, normalization_params = feature_transform_and_normalization(
+        df, features_to_normalize, ["docs", "year"]
+    )
+    one_hot_df = one_hot_encode(norm_df[FEATURES_TO_USE], FEATURES_TO_ENCODE)
+    return one_hot_df, normalization_params
+
+
+def scale_back_price(trained_df, scalar_dict):
+    df = trained_df.copy()
+    df["true_price"] = (
+        df["price"] * scalar_dict["price"]["std"] + scalar_dict["price"]["mean"]
+    ).round()
+    df["predicted_price"] = (
+        (df["price_pred"] * scalar_dict["price"]["std"] + scalar_dict["price"]["mean"])
+        .round()
+        .clip(lower=0)
+    )
+    return df[["true_price", "predicted_price"]]
+
+
+def prepare_final_df(initial_df, output_df):
+    final_df = initial_df.join(output_df)
+    final_df = final_df.astype({"true_price": "int", "predicted_price": "int"})
+    final_df["price_dif"] = final_df["predicted_price"] - final_df["true_price"]
+    return final_df.drop(columns="price").sort_values("price_dif", ascending=False)
+
+
+def filter_out_good_links(final_df: pd.DataFrame, updated_links_df: pd.DataFrame):
+    working_links = updated_links_df[updated_links_df["working_link"]]
+    return final_df.merge(
+        working_links, how="inner", on=["url"], suffixes=("", "_updated")
+    )
+
+
+def final_table(
+    df: pd.DataFrame,
+    target: pd.Series,
+    scalar_dict: dict,
+    updated_links_df: pd.DataFrame,
+) -> pd.DataFrame:
+    """Final table assembly of scored car data, as run_etl chained it"""
+    trained_df = pd.DataFrame(
+        {"price": target, "price_pred": df["price_pred"]}, index=df.index
+    )
+    output_df = scale_back_price(trained_df, scalar_dict)
+    final_df = prepare_final_df(df, output_df)
+    return filter_out_good_links(final_df, updated_links_df)
+
+
+def create_dataframe_html(dataframe: pd.DataFrame):
+    main_cols = [
+        "brand",
+        "model",
+        "year",
+        "engine",
+        "kw",
+        "fuel",
+        "milage",
+        "docs",
+        "transmission",
+        "defects",
+        "true_price",
+        "predicted_price",
+        "price_dif",
+        "url",
+    ]
+    other_cols = list(set(dataframe.columns) - set(main_cols))
+    df_to_use = dataframe[main_cols + other_cols]
+
+    table_html = df_to_use.to_html(table_id="table", render_links=True, escape=False)
+    html = f"""
+    <html>
+    <header>
+        <link href="https://cdn.datatables.net/1.11.5/css/jquery.dataTables.min.css" rel="stylesheet">
+    </header>
+    <body>
+    {table_html}
+    <script src="https://code.jquery.com/jquery-3.6.0.slim.min.js" integrity="sha256-u7e5khyithlIdTpu22PHhENmPcRdFiHRjhAuHcs05RI=" crossorigin="anonymous"></script>
+    <script type="text/javascript" src="https://cdn.datatables.net/1.11.5/js/jquery.dataTables.min.js"></script>
+    <script>
+        $(document).ready( function () {{
+            $('#table').DataTable({{
+                // paging: true,
+                // scrollY: 400,
+            }});
+        }});
+    </script>
+    </body>
+    </html>
+    """
+    return html
@@ -0,0 +1,242 @@
+import functools
+import json
+import re
+import time
+import tracemalloc
+from decimal import Decimal
+from typing import Optional, Tuple
+
+from bs4 import BeautifulSoup
+from moto import mock_aws
+
+import scraper_main
+from bench_aws import create_car_table
+from bench_fixtures import (
+    LISTINGS_PER_PAGE,
+    ReplayServer,
+    generate_listing,
+    render_car_page,
+    render_search_page,
+)
+from scraper_car_page import Car, extract_mileage_or_price, parse_car_details
+from scraper_client import ScraperClient
+from scraper_search_page import HEADER, parse_search_page
+
+PARSERS = ["html.parser", "lxml"]
+
+
+def run_scraper_suite(size: int, options: dict, collector) -> dict:
+    """Scrapes all search and car pages of data set into DynamoDB"""
+    server = ReplayServer(
+        size,
+        options["seed"],
+        options["latency"],
+        options["throttle"],
+        options["max_concurrent"],
+    )
+    with server, mock_aws():
+        create_car_table()
+        scraper_main.SEARCH_PAGE = server.search_page
+        scraper_main.MAIN_PAGE = server.base_url
+        # Politeness delays of the real website would only measure themselves
+        scraper_main.ScraperClient = functools.partial(
+            ScraperClient, requests_per_second=None
+        )
+        start = time.perf_counter()
+        scraper_main.run_scraper(pages=server.n_pages)
+        wall_seconds = time.perf_counter() - start
+
+    stages = collector.stages()
+    run = stages.pop("run_scraper")
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "cars_per_second": round(run.get("written_cars", 0) / wall_seconds, 1),
+            "requests_per_second": round(run.get("http_requests", 0) / wall_seconds, 1),
+        },
+        "http_latency": run.pop("http_latency", None),
+        "counts": run,
+        "stages": stages,
+    }
+
+
+def run_concurrency_suite(size: int, options: dict, collector) -> dict:
+    """Scrapes search and car pages of data set with each number of workers.
+    Use --latency to mimic network, without it fetching is bound by CPU
+    """
+    results = {}
+    with ReplayServer(size, options["seed"], options["latency"]) as server:
+        for workers in options["workers"]:
+            client = ScraperClient(max_workers=workers, requests_per_second=None)
+            collector.records.clear()
+            start = time.perf_counter()
+            cars = scraper_main.scrape_pages(
+                server.n_pages, server.search_page, server.base_url, HEADER, client
+            )
+            wall_seconds = time.perf_counter() - start
+            run = collector.stages()["scrape_pages"]
+            results[workers] = {
+                "wall_seconds": round(wall_seconds, 3),
+                "cars": len(cars),
+                "pages_per_second": round(run["http_requests"] / wall_seconds, 1),
+                "http_latency": run["http_latency"],
+            }
+
+    fastest = max(results.values(), key=lambda result: result["pages_per_second"])
+    return {
+        "wall_seconds": round(sum(r["wall_seconds"] for r in results.values()), 3),
+        "throughput": {"pages_per_second": fastest["pages_per_second"]},
+        "workers": results,
+    }
+
+
+def parse_unstrained(page_text: str) -> dict:
+    """Car page parsing as before strainers, full html.parser tree is built"""
+    soup = BeautifulSoup(page_text, "html.parser")
+    params = filter(
+        lambda tag: tag["class"] == ["param"], soup.find_all("div", class_="param")
+    )
+    return {
+        param.find("div", class_="left")
+        .text.strip(): param.find("div", class_="right")
+        .text.strip()
+        for param in params
+    }
+
+
+def run_parser_suite(size: int, options: dict, collector) -> dict:
+    """Parses rendered car and search pages of data set with each parser backend"""
+    car_pages = [render_car_page(i, options["seed"]) for i in range(size)]
+    search_pages = [
+        render_search_page(nr, size, options["seed"])
+        for nr in range(1, -(-size // LISTINGS_PER_PAGE) + 1)
+    ]
+    parsers = {
+        "unstrained": (parse_unstrained, None),
+        **{
+            parser: (
+                functools.partial(parse_car_details, parser=parser),
+                functools.partial(parse_search_page, main_page="", parser=parser),
+            )
+            for parser in PARSERS
+        },
+    }
+
+    results = {}
+    start = time.perf_counter()
+    for name, (parse_car_page, parse_search) in parsers.items():
+        parse_start = time.perf_counter()
+        for page_text in car_pages:
+            parse_car_page(page_text)
+        car_seconds = time.perf_counter() - parse_start
+        results[name] = {
+            "car_page_ms": round(1000 * car_seconds / size, 3),
+            "car_pages_per_second": round(size / car_seconds, 1),
+        }
+        if parse_search:
+            parse_start = time.perf_counter()
+            for page_text in search_pages:
+                parse_search(page_text)
+            search_seconds = time.perf_counter() - parse_start
+            results[name]["search_page_ms"] = round(
+                1000 * search_seconds / len(search_pages), 3
+            )
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "car_pages_per_second": max(
+                result["car_pages_per_second"] for result in results.values()
+            )
+        },
+        "parsers": results,
+    }
+
+
+def extract_engine_and_kw_nested(s: str) -> Tuple[Optional[float], Optional[int]]:
+    """Engine liters and power as found before precompiled patterns"""
+    try:
+        liters = float(re.findall(r"[\d.]+", (re.findall(r"\d+.*l", s)[0]))[0])
+    except (IndexError, TypeError):
+        liters = None
+    try:
+        kw = int(re.findall(r"\d+", (re.findall(r"\d+ kW", s)[0]))[0])
+    except (IndexError, TypeError):
+        kw = None
+    return liters, kw
+
+
+# noinspection SpellCheckingInspection
+class DictCar:
+    """Car as before slots, fields are kept in instance dict and items are
+    converted through json
+    """
+
+    def __init__(self, link: str, **kwargs):
+        self.price = extract_mileage_or_price(kwargs.get("Kaina"))
+        self.brand = kwargs.get("Markė")
+        self.model = kwargs.get("Modelis")
+        self.year = kwargs.get("Metai")
+        self.engine, self.kw = extract_engine_and_kw_nested(kwargs.get("Variklis"))
+        self.fuel = kwargs.get("Kuro tipas")
+        self.body = kwargs.get("Kėbulo tipas")
+        self.color = kwargs.get("Spalva")
+        self.transmission = kwargs.get("Pavarų dėžė")
+        self.milage = extract_mileage_or_price(kwargs.get("Rida"))
+        self.wheel_drive = kwargs.get("Varomieji ratai")
+        self.defects = kwargs.get("Defektai")
+        self.steering_wheel = kwargs.get("Vairo padėtis")
+        self.doors = kwargs.get("Durų skaičius")
+        self.docs = kwargs.get("TA iki")
+        self.rims = kwargs.get("Ratlankiai")
+        self.first_registration = kwargs.get("Pirmosios registracijos šalis")
+        self.consumption_city = (
+            None if not kwargs.get("Mieste") else float(kwargs.get("Mieste"))
+        )
+        self.consumption_road = (
+            None if not kwargs.get("Užmiestyje") else float(kwargs.get("Užmiestyje"))
+        )
+        self.consumption_mixed = (
+            None if not kwargs.get("Mišrus") else float(kwargs.get("Mišrus"))
+        )
+
+        self.url = link
+        self.working_link = True
+
+    def get_json(self):
+        return json.loads(json.dumps(self.__dict__), parse_float=Decimal)
+
+
+def run_car_model_suite(size: int, options: dict, collector) -> dict:
+    """Builds cars and their DynamoDB items from car page parameters of data
+    set, with slotted Car and with dict based Car it replaced
+    """
+    params = [generate_listing(i, options["seed"])["params"] for i in range(size)]
+    results = {}
+    start = time.perf_counter()
+    for name, model in {"dict": DictCar, "slots": Car}.items():
+        tracemalloc.start()
+        build_start = time.perf_counter()
+        cars = [model(link=str(i), **car_params) for i, car_params in enumerate(params)]
+        build_seconds = time.perf_counter() - build_start
+        cars_mb = tracemalloc.get_traced_memory()[0] / 2**20
+        tracemalloc.stop()
+        items_start = time.perf_counter()
+        for car in cars:
+            car.get_json()
+        items_seconds = time.perf_counter() - items_start
+        results[name] = {
+            "build_seconds": round(build_seconds, 3),
+            "items_seconds": round(items_seconds, 3),
+            "cars_per_second": round(size / (build_seconds + items_seconds), 1),
+            "cars_mb": round(cars_mb, 1),
+        }
+        del cars
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {"cars_per_second": results["slots"]["cars_per_second"]},
+        "models": results,
+    }
@@ -0,0 +1,255 @@
+import http.client
+import io
+import random
+import socket
+import threading
+import time
+from typing import Tuple
+
+import boto3
+import numpy as np
+import pandas as pd
+import uvicorn
+from fastapi.responses import HTMLResponse
+from fastapi.testclient import TestClient
+from moto import mock_aws
+
+import bench_reference_etl
+from bench_aws import (
+    BUCKET,
+    OUTPUT_PREFIX,
+    artifacts_dir,
+    create_bucket,
+    upload_artifacts,
+)
+from bench_fixtures import generate_items, percentiles
+
+TABLE_PAGE_LENGTH = 50
+SEARCH_TERMS = ["audi", "golf", "benzinas", "2015", "automatinė"]
+# Distinct listings generated for final tables, larger tables repeat them
+TABLE_LISTINGS = 50000
+# Requests per page of table load suite
+LOAD_REQUESTS = 20
+# Rows DataTables requests on first draw
+FIRST_PAGE_LENGTH = 10
+
+
+def dash_zoom_request(low: float, high: float) -> dict:
+    """Dash callback request redrawing graph zoomed to price range"""
+    view = {"x_range": [0, 10000], "y_range": [0, 10000], "hidden_traces": []}
+    relayout = {
+        "xaxis.range[0]": low,
+        "xaxis.range[1]": high,
+        "yaxis.range[0]": low,
+        "yaxis.range[1]": high,
+    }
+    return {
+        "output": "..fig.figure...view.data..",
+        "outputs": [
+            {"id": "fig", "property": "figure"},
+            {"id": "view", "property": "data"},
+        ],
+        "inputs": [
+            {"id": "fig", "property": "relayoutData", "value": relayout},
+            {"id": "fig", "property": "restyleData", "value": None},
+        ],
+        "changedPropIds": ["fig.relayoutData"],
+        "state": [{"id": "view", "property": "data", "value": view}],
+    }
+
+
+def run_web_suite(size: int, options: dict, collector) -> dict:
+    """Sends mixed table, search, sort, file and graph requests to web app"""
+    with mock_aws():
+        create_bucket()
+        upload_artifacts(artifacts_dir(options, size))
+        import main
+
+        start = time.perf_counter()
+        with TestClient(main.app) as client:
+            startup_seconds = time.perf_counter() - start
+            first_page = client.get("/api/table?draw=1&length=1").json()
+            n_rows = first_page["recordsTotal"]
+            n_columns = len(first_page["data"][0]) if first_page["data"] else 1
+            page = f"&length={TABLE_PAGE_LENGTH}"
+
+            def start_row(rng: random.Random) -> int:
+                return rng.randrange(max(1, n_rows - TABLE_PAGE_LENGTH))
+
+            scenarios = {
+                "table_page": lambda rng: client.get(
+                    f"/api/table?draw=1&start={start_row(rng)}{page}"
+                ),
+                "table_sort": lambda rng: client.get(
+                    f"/api/table?draw=1&start={start_row(rng)}{page}"
+                    f"&order[0][column]={rng.randrange(n_columns)}"
+                    f"&order[0][dir]={rng.choice(['asc', 'desc'])}"
+                ),
+                "table_search": lambda rng: client.get(
+                    f"/api/table?draw=1&start=0{page}"
+                    f"&search[value]={rng.choice(SEARCH_TERMS)}"
+                ),
+                "table_arrow": lambda rng: client.get(
+                    f"/api/table?format=arrow&start={start_row(rng)}{page}"
+                ),
+                "graph_file": lambda rng: client.get(
+                    "/data/car_graph.json", headers={"Accept-Encoding": "br, gzip"}
+                ),
+                "graph_zoom": lambda rng: client.post(
+                    "/graph/_dash-update-component",
+                    json=dash_zoom_request(*sorted(rng.sample(range(0, 40000), 2))),
+                ),
+            }
+            rng = random.Random(options["seed"])
+            latencies = {name: [] for name in scenarios}
+            response_bytes = {name: 0 for name in scenarios}
+            start = time.perf_counter()
+            for _ in range(options["requests"]):
+                name = rng.choice(list(scenarios))
+                request_start = time.perf_counter()
+                response = scenarios[name](rng)
+                latencies[name].append(time.perf_counter() - request_start)
+                response.raise_for_status()
+                response_bytes[name] += len(response.content)
+            wall_seconds = time.perf_counter() - start
+
+    return {
+        "startup_seconds": round(startup_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "requests_per_second": round(options["requests"] / wall_seconds, 1)
+        },
+        "latency_ms": {
+            name: {
+                "requests": len(values),
+                **percentiles(values),
+                "mean_bytes": response_bytes[name] // max(1, len(values)),
+            }
+            for name, values in latencies.items()
+        },
+        "table_rows": n_rows,
+        "stages": collector.stages(),
+    }
+
+
+def final_table(size: int, seed: int = 0) -> pd.DataFrame:
+    """Final table of data set as published by ETL, predicted prices are
+    listing prices with noise. Listings repeat after TABLE_LISTINGS, urls stay
+    unique
+    """
+    items = generate_items(min(size, TABLE_LISTINGS), "http://localhost/", seed)
+    df = pd.DataFrame(items).drop(columns=["working_link", "scraped_at"])
+    for column in ["price", "engine", "kw", "milage"] + [
+        f"consumption_{kind}" for kind in ["city", "road", "mixed"]
+    ]:
+        df[column] = pd.to_numeric(df[column])
+    df = df.iloc[np.arange(size) % len(df)].reset_index(drop=True)
+    df["url"] = "http://localhost/" + pd.Series(np.arange(size)).astype(str)
+    noise = np.random.default_rng(seed).normal(1, 0.15, size)
+    df["true_price"] = df.pop("price").astype(np.int32)
+    df["predicted_price"] = (df["true_price"] * noise).round().astype(np.int32)
+    df["price_dif"] = df["predicted_price"] - df["true_price"]
+    return df.sort_values("price_dif", ascending=False, ignore_index=True)
+
+
+class AppServer:
+    """Serves web app over HTTP from a background thread, so responses are
+    timed as browsers receive them"""
+
+    def __init__(self, app):
+        self.server = uvicorn.Server(uvicorn.Config(app, log_level="warning"))
+        self.socket = socket.socket()
+        self.socket.bind(("127.0.0.1", 0))
+        self.port = self.socket.getsockname()[1]
+        self.thread = threading.Thread(
+            target=self.server.run, kwargs={"sockets": [self.socket]}, daemon=True
+        )
+
+    def __enter__(self) -> "AppServer":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join()
+        self.socket.close()
+
+    def get(self, path: str) -> Tuple[float, float, int]:
+        """Requests path on a new connection
+        Returns: seconds to response headers and to last byte, and body size
+        """
+        connection = http.client.HTTPConnection("127.0.0.1", self.port)
+        start = time.perf_counter()
+        connection.request("GET", path)
+        response = connection.getresponse()
+        first_byte = time.perf_counter() - start
+        body = response.read()
+        last_byte = time.perf_counter() - start
+        connection.close()
+        if response.status != 200:
+            raise RuntimeError(f"{path} answered {response.status}")
+        return first_byte, last_byte, len(body)
+
+
+def run_table_load_suite(size: int, options: dict, collector) -> dict:
+    """Loads car table of data set as the single HTML file it was published as
+    before, and as first API page of rows DataTables requests after table page.
+    Old HTML file is served from memory, as the web app cached it
+    """
+    df = final_table(size, options["seed"])
+    start = time.perf_counter()
+    html = bench_reference_etl.create_dataframe_html(df)
+    html_seconds = time.perf_counter() - start
+    parquet = io.BytesIO()
+    df.to_parquet(parquet, index=False, compression="zstd")
+    del df
+
+    with mock_aws():
+        create_bucket()
+        s3 = boto3.client("s3")
+        s3.put_object(
+            Bucket=BUCKET, Key=OUTPUT_PREFIX + "car_graph.json", Body=b'{"data": []}'
+        )
+        s3.put_object(
+            Bucket=BUCKET,
+            Key=OUTPUT_PREFIX + "car_table.parquet",
+            Body=parquet.getvalue(),
+        )
+        import main
+
+        main.app.add_api_route("/dataframe_html", lambda: HTMLResponse(html))
+        first_page = f"/api/table?draw=1&start=0&length={FIRST_PAGE_LENGTH}"
+        loads = {
+            "html_file": "/dataframe_html",
+            "api_json": first_page,
+            "api_arrow": first_page + "&format=arrow",
+        }
+        results = {}
+        start = time.perf_counter()
+        with AppServer(main.app) as server:
+            for name, path in loads.items():
+                timings = [server.get(path) for _ in range(LOAD_REQUESTS)]
+                results[name] = {
+                    "ttfb_ms": percentiles([timing[0] for timing in timings]),
+                    "load_ms": percentiles([timing[1] for timing in timings]),
+                    "bytes": timings[-1][2],
+                }
+            # Table page is a template sent before API rows, same for all sizes
+            table = main.get_table_data()
+            table_page = main.templates.get_template("table.html").render(
+                columns=table.columns, url_column=table.columns.index("url")
+            )
+        wall_seconds = time.perf_counter() - start
+
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "loads_per_second": round(len(loads) * LOAD_REQUESTS / wall_seconds, 1)
+        },
+        "html_render_seconds": round(html_seconds, 3),
+        "table_page_bytes": len(table_page.encode("utf-8")),
+        "table_file_bytes": len(parquet.getvalue()),
+        "loads": results,
+    }
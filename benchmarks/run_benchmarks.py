@@ -0,0 +1,241 @@
+"""Offline end to end benchmarks of scraper, ETL and web app
+
+Scraper scrapes a local server replaying autogidas.lt style pages of a
+synthetic data set, ETL and web app run against moto DynamoDB and S3. Each
+suite and size runs in its own process, so peak memory is measured per run.
+Web app is benchmarked on the files published by ETL run of the same size.
+
+    pip install -r Scraper/requirements.txt -r ETL/requirements.txt \\
+        -r Webpage/requirements.txt -r benchmarks/requirements.txt
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000
+
+Results are saved as json to benchmarks/results, named by time and commit.
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from bench_aws import artifacts_dir
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+WORK_DIR = "/tmp/car_scraper_benchmarks"
+# Source folder, logger and metrics modules of each package
+PACKAGES = {
+    "scraper": ("Scraper", "logger_scraper", "metrics_scraper"),
+    "etl": ("ETL", "logger_etl", "metrics_etl"),
+    "web": ("Webpage/app", "logger_webpage", "metrics_webpage"),
+}
+# Package, module and function of each suite
+SUITES = {
+    "scraper": ("scraper", "bench_scraper", "run_scraper_suite"),
+    "scraper_concurrency": ("scraper", "bench_scraper", "run_concurrency_suite"),
+    "parser": ("scraper", "bench_scraper", "run_parser_suite"),
+    "car_model": ("scraper", "bench_scraper", "run_car_model_suite"),
+    "etl": ("etl", "bench_etl", "run_etl_suite"),
+    "scan": ("etl", "bench_etl", "run_scan_suite"),
+    "link_check": ("etl", "bench_etl", "run_link_check_suite"),
+    "transform": ("etl", "bench_etl", "run_transform_suite"),
+    "out_of_core": ("etl", "bench_etl", "run_out_of_core_suite"),
+    "segments": ("etl", "bench_etl", "run_segments_suite"),
+    "final_table": ("etl", "bench_etl", "run_final_table_suite"),
+    "web": ("web", "bench_web", "run_web_suite"),
+    "table_load": ("web", "bench_web", "run_table_load_suite"),
+}
+# End to end suites, run when no suites are given
+DEFAULT_SUITES = ["scraper", "etl", "web"]
+DEFAULT_SIZES = [1000, 10000]
+WEB_REQUESTS = 300
+DEFAULT_WORKERS = [1, 2, 4, 8, 16]
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def git_commit() -> Dict[str, str]:
+    """Commit benchmarks run on, and whether tree had uncommitted changes"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": False}
+    return {"commit": commit, "dirty": bool(status.strip())}
+
+
+class RecordCollector(logging.Handler):
+    """Keeps stage metrics logged by package metrics module"""
+
+    def __init__(self):
+        super().__init__()
+        self.records: List[dict] = []
+
+    def emit(self, record: logging.LogRecord):
+        self.records.append(json.loads(record.getMessage()))
+
+    def stages(self) -> Dict[str, dict]:
+        stages = {}
+        for record in self.records:
+            record.pop("_aws", None)
+            record.pop("Service", None)
+            stages[record.pop("Stage")] = record
+        return stages
+
+
+def setup_process(package: str, options: dict) -> RecordCollector:
+    """Prepares benchmark process for package: imports, working folder, fake
+    AWS credentials, state location and quiet logs
+    """
+    package_dir, logger_module, metrics_module = PACKAGES[package]
+    package_dir = os.path.join(REPO_DIR, package_dir)
+    sys.path.insert(0, package_dir)
+    # Web app reads its templates relative to working folder
+    os.chdir(package_dir)
+    os.environ.update(
+        AWS_ACCESS_KEY_ID="benchmark",
+        AWS_SECRET_ACCESS_KEY="benchmark",
+        AWS_DEFAULT_REGION="eu-central-1",
+        ETL_STATE_LOCATION=os.path.join(options["work_dir"], "etl_state"),
+    )
+    logger = importlib.import_module(logger_module).LOGGER
+    metrics = importlib.import_module(metrics_module)
+    if not options["verbose"]:
+        logger.setLevel(logging.WARNING)
+    collector = RecordCollector()
+    metrics.METRICS_LOGGER.handlers = [collector]
+    return collector
+
+
+def run_in_process(suite: str, size: int, options: dict) -> dict:
+    package, module, function = SUITES[suite]
+    collector = setup_process(package, options)
+    runner = getattr(importlib.import_module(module), function)
+    setup_rss_mb = peak_rss_mb()
+    result = runner(size, options, collector)
+    return {
+        "suite": suite,
+        "size": size,
+        **result,
+        "setup_rss_mb": round(setup_rss_mb, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def run_suite(suite: str, size: int, options: dict) -> dict:
+    """Runs suite in a new process, so its imports and peak memory are its own"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_in_process, suite, size, options).result()
+
+
+def summary_line(result: dict) -> str:
+    throughput = ", ".join(f"{v} {k}" for k, v in result["throughput"].items())
+    return (
+        f"{result['suite']:>20} {result['size']:>7}: {result['wall_seconds']:8.2f}s, "
+        f"{throughput}, peak {result['peak_rss_mb']} MB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--suites", nargs="+", choices=list(SUITES), default=DEFAULT_SUITES
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to each response"
+    )
+    parser.add_argument(
+        "--throttle",
+        type=float,
+        default=0.0,
+        help="share of scraper requests throttled with 429 or 503",
+    )
+    parser.add_argument(
+        "--max-concurrent",
+        type=int,
+        default=0,
+        help="scraper requests in flight over this are throttled",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=DEFAULT_WORKERS,
+        help="workers compared by scraper_concurrency and segments suites",
+    )
+    parser.add_argument(
+        "--chunked",
+        action="store_true",
+        help="etl and out_of_core suites run ETL chunk by chunk",
+    )
+    parser.add_argument("--requests", type=int, default=WEB_REQUESTS)
+    parser.add_argument("--work-dir", default=WORK_DIR)
+    parser.add_argument(
+        "--output", help="results file, saved to results dir if not set"
+    )
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    args.work_dir = os.path.abspath(args.work_dir)
+    options = vars(args)
+
+    results = []
+    for size in args.sizes:
+        for suite in args.suites:
+            if (
+                suite == "web"
+                and "etl" not in args.suites
+                and not os.path.exists(artifacts_dir(options, size))
+            ):
+                print(f"Running ETL to publish files of {size} cars for web app")
+                run_suite("etl", size, options)
+            result = run_suite(suite, size, options)
+            print(summary_line(result))
+            results.append(result)
+
+    created_at = datetime.datetime.now(datetime.timezone.utc)
+    git = git_commit()
+    report = {
+        "created_at": created_at.isoformat(timespec="seconds"),
+        **git,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "options": {k: v for k, v in options.items() if k != "output"},
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{created_at:%Y%m%dT%H%M%S}_{git['commit'][:8]}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved results to {output}")
+
+
+if __name__ == "__main__":
+    main()
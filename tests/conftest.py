@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Packages are deployed separately and import their modules flat
+for package in ["Scraper", "ETL", os.path.join("Webpage", "app")]:
+    sys.path.insert(0, os.path.join(ROOT, package))
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures")
+# Size of the fake website walked by scraper tests
+SITE_PAGES = 4
+LISTINGS_PER_PAGE = 3
+
+
+def listing_url(page_nr: int, i: int) -> str:
+    return f"https://autogidas.lt/skelbimas/{page_nr}-{i}.html"
+
+
+class FakeSite:
+    """Search pages with listing fingerprints, records requested pages"""
+
+    def __init__(self, n_pages: int):
+        self.pages = {
+            page_nr: {listing_url(page_nr, i): "v1" for i in range(LISTINGS_PER_PAGE)}
+            for page_nr in range(1, n_pages + 1)
+        }
+        self.requested_pages = []
+        # Car pages whose fetching fails
+        self.failing_cars = set()
+
+    def get_listings(self, search_page, main_page, header, client=None):
+        page_nr = int(search_page.rsplit("=", 1)[1])
+        self.requested_pages.append(page_nr)
+        return dict(self.pages[page_nr]), len(self.pages)
+
+    def get_car_details(self, link, header, client=None):
+        from scraper_car_page import Car
+
+        if link in self.failing_cars:
+            raise ValueError(f"{link}, failed to fetch")
+        return Car(link=link)
+
+    def listings(self, *page_nrs: int) -> dict:
+        return {
+            url: fingerprint
+            for page_nr in page_nrs
+            for url, fingerprint in self.pages[page_nr].items()
+        }
+
+
+@pytest.fixture
+def site(monkeypatch):
+    """Fake website walked by scraper_main instead of autogidas.lt"""
+    import scraper_main
+
+    site = FakeSite(SITE_PAGES)
+    monkeypatch.setattr(
+        scraper_main, "get_listings_from_search_page", site.get_listings
+    )
+    monkeypatch.setattr(scraper_main, "get_car_details", site.get_car_details)
+    return site
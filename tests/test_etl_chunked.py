@@ -0,0 +1,93 @@
+import random
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import etl_car_scraper
+import etl_state
+
+N_LISTINGS = 2000
+CHUNK_ROWS = 300
+# Every n-th link is found not working
+DEAD_EVERY = 7
+BRANDS = {"Audi": ["A4", "A6"], "Opel": ["Astra", "Zafira"], "Toyota": ["Corolla"]}
+
+
+def car_data(n: int) -> pd.DataFrame:
+    """Car table data as spooled by chunked ETL"""
+    rng = random.Random(0)
+    rows = []
+    for i in range(n):
+        brand = rng.choice(list(BRANDS))
+        year = rng.randint(2000, 2022)
+        rows.append(
+            {
+                "url": f"https://autogidas.lt/skelbimas/{i}.html",
+                "price": int(3000 + 900 * (year - 2000) * rng.uniform(0.8, 1.2)),
+                "brand": brand,
+                "model": rng.choice(BRANDS[brand]),
+                "year": f"{year}-{rng.randint(1, 12):02d}",
+                "engine": rng.choice([1.4, 1.6, 2.0]),
+                "kw": rng.randint(60, 150),
+                "fuel": rng.choice(["Dyzelinas", "Benzinas"]),
+                "body": rng.choice(["Sedanas", "Universalas"]),
+                "milage": rng.randint(10000, 300000),
+                "working_link": True,
+                "scraped_at": 1700000000 + i,
+            }
+        )
+    df = pd.DataFrame(rows).reindex(columns=etl_car_scraper.EXTRACT_COLUMNS)
+    etl_car_scraper.convert_numbers(df)
+    return df
+
+
+@pytest.fixture
+def spooled_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl_car_scraper, "LOCAL_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(etl_state, "LOCAL_STATE_DIR", str(tmp_path))
+    path = str(tmp_path / "car_table.parquet")
+    table = pa.Table.from_pandas(
+        car_data(N_LISTINGS), schema=etl_car_scraper.CHUNK_SCHEMA, preserve_index=False
+    )
+    pq.write_table(table, path, row_group_size=CHUNK_ROWS)
+    return path
+
+
+def checked_links(df: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(
+        {"url": df["url"], "working_link": np.arange(len(df)) % DEAD_EVERY != 0}
+    )
+
+
+def test_chunked_final_table_matches_in_memory(spooled_path, tmp_path):
+    df = pq.read_table(spooled_path).to_pandas()
+    model, _ = etl_car_scraper.score_prices(df, None)
+    updated_links_df = checked_links(df)
+    etl_car_scraper.apply_working_links(df, updated_links_df)
+    snapshot = df.copy()
+    rows = etl_car_scraper.good_links_mask(df, updated_links_df)
+    expected = etl_car_scraper.prepare_final_df(
+        df, model.preprocessor.scaler_dict, rows
+    )
+
+    scored_path, chunked_model = etl_car_scraper.score_chunked(
+        [spooled_path], CHUNK_ROWS
+    )
+    links_df = pq.read_table(scored_path, columns=etl_car_scraper.LINK_COLUMNS)
+    snapshot_path = str(tmp_path / "snapshot.parquet")
+    final_df = etl_car_scraper.prepare_final_df_chunked(
+        scored_path,
+        chunked_model.preprocessor.scaler_dict,
+        checked_links(links_df.to_pandas()),
+        snapshot_path,
+        CHUNK_ROWS,
+    )
+
+    assert len(final_df) == N_LISTINGS - len(range(0, N_LISTINGS, DEAD_EVERY))
+    pd.testing.assert_frame_equal(final_df, expected, check_exact=False, atol=1)
+    saved = pq.read_table(snapshot_path).to_pandas()
+    pd.testing.assert_series_equal(saved["working_link"], snapshot["working_link"])
+    np.testing.assert_allclose(saved["price_pred"], snapshot["price_pred"], atol=1e-6)
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import os
+
+import boto3
+import brotli
+import pytest
+from moto import mock_aws
+
+from etl_export import STAGING_SUFFIX, ArtifactUpload, S3MultipartWriter
+
+BUCKET = "car-scraper-vu-bucket"
+KEY = "output_files/car_graph.json"
+VARIANT_KEYS = [KEY, KEY + ".gz", KEY + ".br"]
+MIN_PART_SIZE = 5 * 1024 * 1024
+CONTENT = json.dumps({"data": [{"x": list(range(5000))}]}).encode()
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+        )
+        yield s3
+
+
+def stored(s3) -> dict:
+    """Contents of all objects in bucket"""
+    objects = s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])
+    return {
+        item["Key"]: s3.get_object(Bucket=BUCKET, Key=item["Key"])["Body"].read()
+        for item in objects
+    }
+
+
+def pending_uploads(s3) -> list:
+    return s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads", [])
+
+
+def publish(s3, content: bytes):
+    with ArtifactUpload(s3, BUCKET, KEY, "application/json", True) as upload:
+        for start in range(0, len(content), 1000):
+            upload.write(content[start : start + 1000])
+
+
+def fail_on_call(s3, monkeypatch, method: str, call: int):
+    """Makes given call of s3 client method fail"""
+    calls = []
+    original = getattr(s3, method)
+
+    def failing(**params):
+        calls.append(params)
+        if len(calls) == call:
+            raise ConnectionError(f"{method} failed")
+        return original(**params)
+
+    monkeypatch.setattr(s3, method, failing)
+
+
+def test_writer_uploads_body_in_parts(s3):
+    body = os.urandom(2 * MIN_PART_SIZE + 12345)
+
+    writer = S3MultipartWriter(s3, BUCKET, "parts.bin", part_size=MIN_PART_SIZE)
+    for start in range(0, len(body), 1024 * 1024):
+        writer.write(body[start : start + 1024 * 1024])
+    assert len(writer.parts) == 2
+    assert writer.tell() == len(body)
+    writer.close()
+
+    assert [part["PartNumber"] for part in writer.parts] == [1, 2, 3]
+    assert stored(s3) == {"parts.bin": body}
+    assert pending_uploads(s3) == []
+
+
+def test_writer_without_data_uploads_empty_object(s3):
+    writer = S3MultipartWriter(s3, BUCKET, "empty.bin")
+    writer.close()
+
+    assert stored(s3) == {"empty.bin": b""}
+
+
+def test_writer_abort_drops_parts(s3):
+    writer = S3MultipartWriter(s3, BUCKET, "parts.bin", part_size=MIN_PART_SIZE)
+    writer.write(os.urandom(MIN_PART_SIZE + 1))
+    writer.abort()
+
+    assert stored(s3) == {}
+    assert pending_uploads(s3) == []
+
+
+def test_variants_decompress_to_published_content(s3):
+    publish(s3, CONTENT)
+
+    objects = stored(s3)
+    assert sorted(objects) == sorted(VARIANT_KEYS)
+    assert objects[KEY] == CONTENT
+    assert gzip.decompress(objects[KEY + ".gz"]) == CONTENT
+    assert brotli.decompress(objects[KEY + ".br"]) == CONTENT
+    assert len(objects[KEY + ".gz"]) < len(CONTENT)
+    for key, encoding in zip(VARIANT_KEYS, [None, "gzip", "br"]):
+        head = s3.head_object(Bucket=BUCKET, Key=key)
+        assert head["Metadata"] == {
+            "content-sha256": hashlib.sha256(CONTENT).hexdigest()
+        }
+        assert head["ContentType"] == "application/json"
+        assert head.get("ContentEncoding") == encoding
+    assert pending_uploads(s3) == []
+
+
+def test_failure_while_writing_keeps_published_artifact(s3):
+    publish(s3, CONTENT)
+    published = stored(s3)
+
+    with pytest.raises(RuntimeError):
+        with ArtifactUpload(s3, BUCKET, KEY, "application/json", True) as upload:
+            upload.write(b'{"data": ')
+            raise RuntimeError("graph could not be created")
+
+    assert stored(s3) == published
+    assert pending_uploads(s3) == []
+
+
+@pytest.mark.parametrize(
+    "method, call",
+    [
+        ("create_multipart_upload", 2),
+        ("upload_part", 3),
+        ("complete_multipart_upload", 2),
+        ("copy_object", 2),
+    ],
+)
+def test_failed_upload_leaves_no_staged_objects(s3, monkeypatch, method, call):
+    publish(s3, CONTENT)
+    published = stored(s3)
+    fail_on_call(s3, monkeypatch, method, call)
+
+    with pytest.raises(ConnectionError):
+        publish(s3, CONTENT[::-1])
+
+    objects = stored(s3)
+    assert not [key for key in objects if key.endswith(STAGING_SUFFIX)]
+    assert sorted(objects) == sorted(VARIANT_KEYS)
+    if method != "copy_object":
+        assert objects == published
+    assert pending_uploads(s3) == []
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+from etl_features import FeaturePreprocessor
+
+
+def car_frame() -> pd.DataFrame:
+    """Raw car data with missing numbers, missing categories and a category
+    missing in all rows"""
+    return pd.DataFrame(
+        {
+            "price": [5000, 7000, None, 12000],
+            "brand": ["Audi", None, "Opel", "Audi"],
+            "year": ["2010-01", "2015-06", "2012-03", None],
+            "docs": ["2025-01", None, "2024-05", "2026-02"],
+            "consumption_road": [5.1, None, 4.2, 6.0],
+            "consumption_city": [7.0, 8.5, None, 9.1],
+            "consumption_mixed": [None, None, None, None],
+            "kw": [85, 110, 66, 0],
+            "milage": [200000, 120000, None, 180000],
+            "engine": [2.0, 1.6, 1.4, 2.0],
+            "steering_wheel": ["Kairėje", "Kairėje", None, "Dešinėje"],
+            "wheel_drive": [None, None, None, None],
+            "fuel": ["Dyzelinas", "Benzinas", "Dyzelinas", None],
+            "doors": ["4/5", "2/3", "4/5", "4/5"],
+            "defects": [None, "Be defektų", None, "Be defektų"],
+            "body": ["Sedanas", "Universalas", None, "Sedanas"],
+            "transmission": ["Mechaninė", "Automatinė", "Mechaninė", None],
+        }
+    )
+
+
+def dense_features(preprocessor: FeaturePreprocessor, df: pd.DataFrame) -> np.ndarray:
+    """Dense features built from fitted params and categories"""
+    numeric = preprocessor.numeric_features
+    values = preprocessor.standardize(preprocessor.numeric_values(df, numeric), numeric)
+    columns = list(values.T)
+    for feature in preprocessor.categorical_features + preprocessor.sparse_features:
+        for category in preprocessor.categories[feature]:
+            columns.append((df[feature] == category).to_numpy(dtype=float))
+    return np.column_stack(columns)
+
+
+def test_fit_transform_matches_fit_then_transform():
+    df = car_frame()
+    preprocessor = FeaturePreprocessor()
+
+    x, y = preprocessor.fit_transform(df)
+
+    assert x.dtype == np.float32
+    assert x.has_canonical_format
+    assert x.shape == (len(df), len(preprocessor.feature_names))
+    np.testing.assert_allclose(x.toarray(), dense_features(preprocessor, df), atol=1e-6)
+    assert (x != preprocessor.transform(df)).nnz == 0
+    np.testing.assert_allclose(y, preprocessor.transform_target(df))
+    assert preprocessor.categories["wheel_drive"] == []
+
+
+def test_unknown_categories_are_left_out():
+    df = car_frame()
+    preprocessor = FeaturePreprocessor().fit(df.iloc[:2])
+    df.loc[3, "brand"] = "Toyota"
+
+    x = preprocessor.transform(df)
+
+    assert "brand_Toyota" not in preprocessor.feature_names
+    np.testing.assert_allclose(x.toarray(), dense_features(preprocessor, df), atol=1e-6)
@@ -0,0 +1,138 @@
+import random
+import time
+from decimal import Decimal
+
+import boto3
+import numpy as np
+import pytest
+from moto import mock_aws
+
+import etl_car_scraper
+from etl_model import PriceModel, SegmentedPriceModel
+from etl_state import save_snapshot
+
+N_LISTINGS = 1000
+N_SCRAPED_AGAIN = 100
+BRANDS = {"Audi": ["A4", "A6"], "Opel": ["Astra", "Zafira"], "Toyota": ["Corolla"]}
+
+
+def generate_item(i: int, scraped_at: int, price_change: int = 0) -> dict:
+    """Car table item as written by scraper, the same for the same index"""
+    rng = random.Random(i)
+    brand = rng.choice(list(BRANDS))
+    year = rng.randint(2000, 2022)
+    return {
+        "url": f"https://autogidas.lt/skelbimas/{i}.html",
+        "price": int(3000 + 900 * (year - 2000) * rng.uniform(0.8, 1.2)) + price_change,
+        "brand": brand,
+        "model": rng.choice(BRANDS[brand]),
+        "year": f"{year}-{rng.randint(1, 12):02d}",
+        "engine": Decimal(str(rng.choice([1.4, 1.6, 2.0]))),
+        "kw": rng.randint(60, 150),
+        "fuel": rng.choice(["Dyzelinas", "Benzinas"]),
+        "body": rng.choice(["Sedanas", "Universalas"]),
+        "transmission": rng.choice(["Mechaninė", "Automatinė"]),
+        "milage": rng.randint(10000, 300000),
+        "docs": f"{rng.randint(2023, 2026)}-{rng.randint(1, 12):02d}",
+        "consumption_mixed": Decimal(f"{rng.uniform(4, 9):.1f}"),
+        "working_link": True,
+        "scraped_at": scraped_at,
+    }
+
+
+@pytest.fixture
+def car_table(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    with mock_aws():
+        yield boto3.resource("dynamodb").create_table(
+            TableName=etl_car_scraper.TABLE_NAME,
+            KeySchema=[{"AttributeName": "url", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "url", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def put_items(table, items):
+    with table.batch_writer() as batch:
+        for item in items:
+            batch.put_item(Item=item)
+
+
+def run_incremental(snapshot_path: str, model, segmented: bool):
+    """Extracts and scores car table as run_etl does, saving the snapshot"""
+    df, replaced = etl_car_scraper.extract_data(snapshot_location=snapshot_path)
+    model, _ = etl_car_scraper.score_prices(df, model, segmented, replaced)
+    save_snapshot(df, snapshot_path)
+    return df, replaced, model
+
+
+def assert_matches_refit(model, df):
+    """Model equals one fitted from scratch on current data with its preprocessor"""
+    x, y, _ = etl_car_scraper.transform_data(df, model.preprocessor)
+    refit = type(model)(model.preprocessor).fit(x, y, df)
+    assert model.n_rows == len(df)
+    np.testing.assert_allclose(model.coef, refit.coef, atol=1e-6)
+    if isinstance(model, SegmentedPriceModel):
+        assert model.segments.keys() == refit.segments.keys()
+    for key, segment in getattr(model, "segments", {}).items():
+        assert segment.n_rows == refit.segments[key].n_rows
+        np.testing.assert_allclose(segment.coef, refit.segments[key].coef, atol=1e-6)
+
+
+@pytest.mark.parametrize("segmented", [False, True])
+def test_scraped_again_listings_are_counted_once(car_table, tmp_path, segmented):
+    snapshot_path = str(tmp_path / "car_table.parquet")
+    scraped_at = int(time.time()) - 100
+    put_items(car_table, (generate_item(i, scraped_at) for i in range(N_LISTINGS)))
+    df, replaced, model = run_incremental(snapshot_path, None, segmented)
+    assert replaced is None
+    assert isinstance(model, SegmentedPriceModel if segmented else PriceModel)
+    assert model.n_rows == N_LISTINGS
+
+    # Unchanged listings scraped again keep their scores
+    put_items(
+        car_table, (generate_item(i, scraped_at + 10) for i in range(N_SCRAPED_AGAIN))
+    )
+    df, replaced, model = run_incremental(snapshot_path, model, segmented)
+    assert replaced.empty
+    assert len(df) == N_LISTINGS
+    assert (df["model_version"] == model.version).all()
+    assert_matches_refit(model, df)
+
+    # Changed listings replace their previous contribution
+    put_items(
+        car_table,
+        (generate_item(i, scraped_at + 20, 500) for i in range(N_SCRAPED_AGAIN)),
+    )
+    df, replaced, model = run_incremental(snapshot_path, model, segmented)
+    assert len(replaced) == N_SCRAPED_AGAIN
+    assert (df["model_version"] == model.version).all()
+    assert_matches_refit(model, df)
+
+    # Nothing is scanned or scored without new writes
+    df, replaced, model = run_incremental(snapshot_path, model, segmented)
+    assert replaced.empty
+    assert_matches_refit(model, df)
+
+
+def test_items_stored_after_run_with_older_stamp_are_read(car_table, tmp_path):
+    snapshot_path = str(tmp_path / "car_table.parquet")
+    scraped_at = int(time.time()) - 100
+    n_stored = N_LISTINGS - N_SCRAPED_AGAIN
+    put_items(car_table, (generate_item(i, scraped_at) for i in range(n_stored)))
+    df, _, model = run_incremental(snapshot_path, None, False)
+    assert len(df) == n_stored
+
+    # Queued by the scraper before the items above, but stored after the run
+    put_items(
+        car_table,
+        (generate_item(i, scraped_at - 60) for i in range(n_stored, N_LISTINGS)),
+    )
+    df, replaced, model = run_incremental(snapshot_path, model, False)
+
+    assert len(df) == N_LISTINGS
+    assert replaced.empty
+    assert (df["model_version"] == model.version).all()
+    assert_matches_refit(model, df)
@@ -0,0 +1,93 @@
+import pandas as pd
+
+import etl_car_scraper
+from etl_link_cache import DAY, LinkLivenessCache
+from get_requests import LinkStatus
+
+NOW = 1700000000.0
+BUDGET = 3
+
+
+def link(i: int) -> str:
+    return f"https://autogidas.lt/skelbimas/{i}.html"
+
+
+def old_entry(checked_ago: float) -> dict:
+    return {
+        "first_seen": NOW - 30 * DAY,
+        "checked_at": NOW - checked_ago,
+        "working": True,
+    }
+
+
+def test_most_overdue_links_are_selected_within_budget():
+    cache = LinkLivenessCache(
+        {link(i): old_entry(DAY + i * 3600) for i in range(BUDGET + 2)}
+    )
+    cache.entries[link(99)] = old_entry(DAY / 2)
+
+    due = cache.select_due(BUDGET, now=NOW)
+
+    assert due == [link(i) for i in range(BUDGET + 1, 1, -1)]
+
+
+def test_fresh_listings_are_rechecked_less_often():
+    cache = LinkLivenessCache()
+    cache.track(
+        [link(0), link(1), link(2), link(3)],
+        [NOW - 2 * DAY, NOW - 3 * DAY, NOW - 30 * DAY, NOW - 30 * DAY],
+    )
+    cache.entries[link(3)]["checked_at"] = NOW - DAY / 2
+    cache.entries[link(2)]["checked_at"] = NOW - DAY
+
+    due = cache.select_due(BUDGET, now=NOW)
+
+    # Listing seen 2 days ago is fresh and checked within 3 days, listing
+    # checked half a day ago is old but checked within a day
+    assert sorted(due) == [link(1), link(2)]
+
+
+def test_failed_and_unchecked_links_stay_due():
+    cache = LinkLivenessCache()
+    cache.track([link(0), link(1), link(2)], [NOW - 2 * DAY, None, NOW - 30 * DAY])
+    assert cache.select_due(BUDGET, now=NOW) == [link(1), link(2)]
+
+    cache.record(LinkStatus(link(1), True, error="timeout"), now=NOW)
+    cache.record(LinkStatus(link(2), False, status=404), now=NOW)
+
+    assert cache.select_due(BUDGET, now=NOW + 1) == [link(1)]
+    assert cache.is_working(link(1))
+    assert not cache.is_working(link(2))
+
+
+def test_update_working_links_checks_only_due_links(monkeypatch):
+    monkeypatch.setattr(etl_car_scraper, "LINK_CHECK_BUDGET", BUDGET)
+    requested = []
+
+    def get_link_statuses(urls, on_result=None):
+        statuses = []
+        for url in urls:
+            requested.append(url)
+            statuses.append(
+                LinkStatus(url, True, error="timeout")
+                if url == link(0)
+                else LinkStatus(url, False, status=404)
+            )
+            on_result(statuses[-1])
+        return statuses
+
+    monkeypatch.setattr(etl_car_scraper, "get_link_statuses", get_link_statuses)
+    trained_df = pd.DataFrame(
+        {
+            "url": [link(i) for i in range(BUDGET + 2)],
+            "working_link": True,
+            "scraped_at": [float(i) for i in range(BUDGET + 2)],
+        }
+    )
+    cache = LinkLivenessCache()
+
+    links_df = etl_car_scraper.update_working_links(trained_df, cache)
+
+    assert requested == [link(i) for i in range(BUDGET)]
+    assert links_df["working_link"].tolist() == [True, False, False, True, True]
+    assert cache.select_due(BUDGET) == [link(0), link(3), link(4)]
@@ -0,0 +1,143 @@
+import json
+import threading
+
+import boto3
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+from moto import mock_aws
+
+import etl_car_scraper
+
+N_LINKS = 3000
+# Every n-th link is dead
+DEAD_EVERY = 3
+THROTTLED = {
+    "Error": {
+        "Code": "ProvisionedThroughputExceededException",
+        "Message": "Throughput exceeds the current capacity of your table",
+    }
+}
+
+
+class ThrottledResponse:
+    status_code = 400
+
+
+@pytest.fixture
+def car_table(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    monkeypatch.setattr(etl_car_scraper, "UPDATE_BACKOFF_SECONDS", 0)
+    with mock_aws():
+        table = boto3.resource("dynamodb").create_table(
+            TableName=etl_car_scraper.TABLE_NAME,
+            KeySchema=[{"AttributeName": "url", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "url", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        with table.batch_writer() as batch:
+            for i in range(N_LINKS):
+                batch.put_item(Item={"url": f"url_{i}", "working_link": True})
+        yield table
+
+
+@pytest.fixture
+def links_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "url": [f"url_{i}" for i in range(N_LINKS)],
+            "working_link": [i % DEAD_EVERY != 0 for i in range(N_LINKS)],
+        }
+    )
+
+
+def throttle_sessions(monkeypatch, is_throttled):
+    """Makes UpdateItem calls of new boto3 sessions fail as throttled when
+    is_throttled(url) is True, before they reach moto
+    """
+    session_class = boto3.session.Session
+
+    def throttle(params, **kwargs):
+        if is_throttled(json.loads(params["body"])["Key"]["url"]["S"]):
+            return ThrottledResponse(), THROTTLED
+        return None
+
+    def session(*args, **kwargs):
+        created = session_class(*args, **kwargs)
+        created.events.register("before-call.dynamodb.UpdateItem", throttle)
+        return created
+
+    monkeypatch.setattr(boto3.session, "Session", session)
+
+
+def working_links(table) -> dict:
+    return {item["url"]: item["working_link"] for item in table.scan()["Items"]}
+
+
+def test_dead_links_are_updated(car_table, links_df):
+    stats = etl_car_scraper.update_dynamodb_table_working_links(links_df)
+
+    n_dead = (~links_df["working_link"]).sum()
+    assert stats["updated"] == n_dead
+    assert stats["failed"] == 0
+    assert working_links(car_table) == dict(zip(links_df.url, links_df.working_link))
+
+
+def test_throttled_updates_are_retried(monkeypatch, car_table, links_df):
+    attempts = set()
+    lock = threading.Lock()
+
+    def first_attempt(url: str) -> bool:
+        with lock:
+            throttled = url not in attempts
+            attempts.add(url)
+        return throttled
+
+    throttle_sessions(monkeypatch, first_attempt)
+    stats = etl_car_scraper.update_dynamodb_table_working_links(links_df)
+
+    assert len(attempts) == (~links_df["working_link"]).sum()
+    assert stats["updated"] == len(attempts)
+    assert stats["failed"] == 0
+    assert working_links(car_table) == dict(zip(links_df.url, links_df.working_link))
+
+
+def test_updates_failing_after_retries_are_counted(monkeypatch, car_table, links_df):
+    throttle_sessions(monkeypatch, lambda url: url == "url_0")
+    stats = etl_car_scraper.update_dynamodb_table_working_links(links_df)
+
+    assert stats["updated"] == (~links_df["working_link"]).sum() - 1
+    assert stats["failed"] == 1
+    assert working_links(car_table)["url_0"] is True
+
+
+def test_set_link_not_working_retries_throttling(car_table):
+    update_params = {
+        "Key": {"url": "url_0"},
+        "UpdateExpression": "SET working_link = :val1",
+        "ExpressionAttributeValues": {":val1": False},
+        "TableName": etl_car_scraper.TABLE_NAME,
+    }
+    with Stubber(car_table.meta.client) as stubber:
+        for _ in range(etl_car_scraper.UPDATE_RETRIES):
+            stubber.add_client_error(
+                "update_item", "ProvisionedThroughputExceededException"
+            )
+        stubber.add_response("update_item", {}, update_params)
+
+        etl_car_scraper.set_link_not_working(car_table, "url_0")
+
+        stubber.assert_no_pending_responses()
+
+
+def test_set_link_not_working_raises_other_errors(car_table):
+    with Stubber(car_table.meta.client) as stubber:
+        stubber.add_client_error("update_item", "ValidationException")
+
+        with pytest.raises(ClientError):
+            etl_car_scraper.set_link_not_working(car_table, "url_0")
+
+        stubber.assert_no_pending_responses()
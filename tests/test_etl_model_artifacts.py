@@ -0,0 +1,85 @@
+import os
+from types import SimpleNamespace
+
+import boto3
+import pytest
+from moto import mock_aws
+
+import etl_state
+from etl_model import MODEL_ARTIFACTS_KEPT, load_model, save_model
+from etl_state import read_json_state
+
+BUCKET = "car-scraper-vu-bucket"
+N_SAVED = MODEL_ARTIFACTS_KEPT + 2
+
+
+@pytest.fixture
+def local_state_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(etl_state, "LOCAL_STATE_DIR", str(tmp_path / "local"))
+
+
+@pytest.fixture
+def s3_location(local_state_dir, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    with mock_aws():
+        boto3.client("s3").create_bucket(
+            Bucket=BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+        )
+        yield f"s3://{BUCKET}/etl_state/models"
+
+
+def saved_artifacts(location: str) -> set:
+    s3_location = etl_state.split_s3_location(location)
+    if not s3_location:
+        return {name for name in os.listdir(location) if name.endswith(".pkl")}
+    bucket, prefix = s3_location
+    objects = boto3.client("s3").list_objects_v2(Bucket=bucket, Prefix=prefix)
+    return {
+        item["Key"].rsplit("/", 1)[1]
+        for item in objects.get("Contents", [])
+        if item["Key"].endswith(".pkl")
+    }
+
+
+def save_models(location: str) -> list:
+    models = [SimpleNamespace(version=f"2024010100000{i}") for i in range(N_SAVED)]
+    for model in models:
+        save_model(model, location)
+    return models
+
+
+def check_latest_kept(location: str, models: list):
+    latest = read_json_state(f"{location}/latest.json")
+    assert len(latest["artifacts"]) == MODEL_ARTIFACTS_KEPT
+    assert latest["artifacts"][0] == latest["artifact"]
+    assert saved_artifacts(location) == set(latest["artifacts"])
+    assert [artifact.split("_")[2] for artifact in latest["artifacts"]] == [
+        model.version for model in models[::-1][:MODEL_ARTIFACTS_KEPT]
+    ]
+    assert load_model(location).version == models[-1].version
+
+
+def test_only_latest_local_artifacts_are_kept(tmp_path, local_state_dir):
+    location = str(tmp_path / "models")
+
+    check_latest_kept(location, save_models(location))
+
+
+def test_only_latest_s3_artifacts_are_kept(s3_location):
+    check_latest_kept(s3_location, save_models(s3_location))
+
+
+def test_artifact_saved_before_retention_is_deleted_in_turn(tmp_path, local_state_dir):
+    location = str(tmp_path / "models")
+    etl_state.write_pickle_state(f"{location}/price_model_old.pkl", None)
+    etl_state.write_json_state(
+        f"{location}/latest.json", {"artifact": "price_model_old.pkl"}
+    )
+
+    save_model(SimpleNamespace(version="20240101000000"), location)
+    assert "price_model_old.pkl" in saved_artifacts(location)
+
+    check_latest_kept(location, save_models(location))
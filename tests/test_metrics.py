@@ -0,0 +1,78 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import metrics_etl
+from metrics_etl import count, stage, with_stages
+
+ALLOCATED_MB = 200
+
+
+class RecordCollector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.stages = {}
+
+    def emit(self, record: logging.LogRecord):
+        metrics = json.loads(record.getMessage())
+        self.stages[metrics["Stage"]] = metrics
+
+
+@pytest.fixture
+def records(monkeypatch):
+    collector = RecordCollector()
+    monkeypatch.setattr(metrics_etl.METRICS_LOGGER, "handlers", [collector])
+    return collector.stages
+
+
+def test_concurrent_stages_keep_their_own_counts(records):
+    both_started = threading.Barrier(2)
+
+    def run_stage(name: str, items: int):
+        with stage(name):
+            both_started.wait()
+            count("items", items)
+            both_started.wait()
+
+    threads = [
+        threading.Thread(target=run_stage, args=(name, items))
+        for name, items in [("first", 1), ("second", 2)]
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert records["first"]["items"] == 1
+    assert records["second"]["items"] == 2
+
+
+def test_worker_threads_report_to_stages_they_were_handed(records):
+    with stage("outer"):
+        with stage("inner"):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(with_stages(count), ["items"] * 10))
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(count, ["unreported"] * 10))
+
+    assert records["inner"]["items"] == 10
+    assert records["outer"]["items"] == 10
+    assert "unreported" not in records["outer"]
+
+
+def test_memory_is_measured_within_stage(records):
+    with stage("allocating"):
+        allocated = np.ones(ALLOCATED_MB * 2**20, dtype=np.uint8)
+        time.sleep(10 * metrics_etl.RSS_SAMPLE_SECONDS)
+        del allocated
+    with stage("idle"):
+        time.sleep(10 * metrics_etl.RSS_SAMPLE_SECONDS)
+
+    assert records["allocating"]["rss_delta_mb"] > 0.8 * ALLOCATED_MB
+    assert records["idle"]["rss_delta_mb"] < 0.2 * ALLOCATED_MB
+    assert records["idle"]["peak_rss_mb"] < records["allocating"]["peak_rss_mb"]
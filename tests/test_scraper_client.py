@@ -0,0 +1,183 @@
+import datetime
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+import scraper_client
+from scraper_client import (
+    AdaptiveConcurrency,
+    HostRateLimiter,
+    ScraperClient,
+    parse_retry_after,
+)
+
+URL = "https://autogidas.lt/skelbimas/1.html"
+OTHER_URL = "https://autogidas.lt/skelbimas/2.html"
+START = 1700000000.0
+
+
+class FakeClock:
+    """Stands in for time module of scraper_client, sleeping only moves it on"""
+
+    def __init__(self):
+        self.now = START
+        self.sleeps = []
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeSession:
+    """Answers requests with given responses, or raises given exceptions"""
+
+    def __init__(self, clock: FakeClock, responses: list):
+        self.clock = clock
+        self.responses = responses
+        self.requested_at = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requested_at.append(self.clock.now)
+        result = self.responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        status, headers = result
+        response = requests.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response.url = url
+        response._content = b"<html></html>"
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scraper_client, "time", clock)
+    # Backoff waits as long as it can
+    monkeypatch.setattr(
+        scraper_client, "random", SimpleNamespace(uniform=lambda low, high: high)
+    )
+    return clock
+
+
+def client_answering(clock: FakeClock, responses: list) -> ScraperClient:
+    client = ScraperClient(max_workers=8, requests_per_second=None)
+    client.session = FakeSession(clock, responses)
+    return client
+
+
+def http_date(seconds_from_now: float, clock: FakeClock) -> str:
+    moment = datetime.datetime.fromtimestamp(
+        clock.now + seconds_from_now, datetime.timezone.utc
+    )
+    return format_datetime(moment, usegmt=True)
+
+
+def test_retry_after_is_read_as_seconds_or_date(clock):
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(http_date(30, clock)) == 30.0
+    assert parse_retry_after(http_date(-30, clock)) == 0.0
+    assert parse_retry_after("100000") == scraper_client.MAX_RETRY_AFTER
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+@pytest.mark.parametrize("retry_after", ["7", "date"])
+def test_retry_after_pauses_host(clock, retry_after):
+    if retry_after == "date":
+        retry_after = http_date(7, clock)
+    client = client_answering(clock, [(429, {"Retry-After": retry_after}), (200, {})])
+
+    page = client.request(URL, {})
+
+    assert page.status_code == 200
+    assert clock.sleeps == [7.0]
+    assert client.session.requested_at == [START, START + 7]
+    assert client.concurrency.limit == 4
+
+
+def test_paused_host_holds_all_its_requests(clock):
+    limiter = HostRateLimiter(requests_per_second=None)
+    limiter.pause(URL, 5)
+
+    limiter.wait("https://example.com/")
+    assert clock.sleeps == []
+    limiter.wait(OTHER_URL)
+    assert clock.now == START + 5
+
+
+def test_failed_requests_are_retried_with_exponential_backoff(clock):
+    client = client_answering(
+        clock,
+        [(503, {}), (500, {}), requests.ConnectionError("reset"), (200, {})],
+    )
+
+    page = client.request(URL, {})
+
+    assert page.status_code == 200
+    assert clock.sleeps == [1.0, 2.0, 4.0]
+
+
+@pytest.mark.parametrize(
+    "failure, error",
+    [((503, {}), requests.HTTPError), (requests.Timeout(), requests.Timeout)],
+)
+def test_error_is_raised_when_retries_run_out(clock, failure, error):
+    client = client_answering(clock, [failure] * (scraper_client.MAX_RETRIES + 1))
+
+    with pytest.raises(error):
+        client.request(URL, {})
+
+    assert len(client.session.requested_at) == scraper_client.MAX_RETRIES + 1
+    assert client.session.responses == []
+
+
+def test_not_found_is_returned_without_retries(clock):
+    client = client_answering(clock, [(404, {})])
+
+    assert client.request(URL, {}).status_code == 404
+    assert clock.sleeps == []
+
+
+def test_concurrency_is_halved_when_throttled_and_grows_back(clock):
+    concurrency = AdaptiveConcurrency(max_limit=8)
+    for _ in range(3):
+        concurrency.acquire()
+
+    concurrency.release(0.1, overloaded=True)
+    assert concurrency.limit == 4
+    # Requests sent before the cut report the same overload
+    concurrency.release(0.1, overloaded=True)
+    assert concurrency.limit == 4
+    clock.now += scraper_client.DECREASE_INTERVAL + 0.1
+    concurrency.release(None, overloaded=True)
+    assert concurrency.limit == 2
+    assert concurrency.in_flight == 0
+
+    for limit in [3, 4]:
+        for _ in range(scraper_client.INCREASE_AFTER):
+            assert concurrency.limit == limit - 1
+            concurrency.acquire()
+            concurrency.release(0.1)
+        assert concurrency.limit == limit
+
+
+def test_slow_responses_count_as_overload(clock):
+    concurrency = AdaptiveConcurrency(max_limit=8)
+    for seconds in [0.2] + [5.0] * 10:
+        concurrency.acquire()
+        concurrency.release(seconds)
+
+    assert concurrency.limit == 4
@@ -0,0 +1,54 @@
+import json
+import os
+
+import pytest
+
+from conftest import FIXTURES
+from scraper_car_page import Car, parse_car_details
+from scraper_search_page import parse_search_page
+
+MAIN_PAGE = "https://autogidas.lt/"
+PARSERS = ["html.parser", "lxml"]
+# Results of parsing fixtures with full html.parser trees, before strainers
+# and selectable backends were added
+with open(os.path.join(FIXTURES, "expected.json"), encoding="utf-8") as f:
+    EXPECTED = json.load(f)
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize(
+    "fixture", [name for name in EXPECTED if name.startswith("car_page")]
+)
+def test_car_page_parity(fixture, parser):
+    details = parse_car_details(read_fixture(fixture), parser)
+    car = Car(link=MAIN_PAGE + "skelbimas/" + fixture, **details)
+
+    assert {field: getattr(car, field) for field in Car.__slots__} == EXPECTED[fixture]
+
+
+@pytest.mark.parametrize(
+    "fixture", [name for name in EXPECTED if name.startswith("car_page")]
+)
+def test_backends_parse_same_car_details(fixture):
+    page_text = read_fixture(fixture)
+
+    assert parse_car_details(page_text, "lxml") == parse_car_details(
+        page_text, "html.parser"
+    )
+
+
+@pytest.mark.parametrize("parser", PARSERS)
+@pytest.mark.parametrize(
+    "fixture", [name for name in EXPECTED if name.startswith("search_page")]
+)
+def test_search_page_parity(fixture, parser):
+    listings, last_page = parse_search_page(read_fixture(fixture), MAIN_PAGE, parser)
+
+    assert listings == EXPECTED[fixture]["listings"]
+    assert list(listings) == sorted(listings)
+    assert last_page == EXPECTED[fixture]["last_page"]
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+import scraper_main
+from conftest import SITE_PAGES, listing_url
+from scraper_client import ScraperClient
+from scraper_state import SeenListings
+
+
+def scrape(seen_listings: SeenListings, stop_on_known_page: bool) -> list:
+    return [
+        car.url
+        for _, cars in scraper_main.iter_scraped_pages(
+            SITE_PAGES,
+            scraper_main.SEARCH_PAGE,
+            scraper_main.MAIN_PAGE,
+            scraper_main.HEADER,
+            ScraperClient(max_workers=2),
+            seen_listings,
+            stop_on_known_page,
+        )
+        for car in cars
+    ]
+
+
+def test_seen_listings_round_trip(tmp_path):
+    location = str(tmp_path / "state" / "seen_listings.json")
+    seen_listings = SeenListings({listing_url(1, 0): "v1"})
+    seen_listings.add(listing_url(1, 1), "v2")
+    seen_listings.save(location)
+
+    loaded = SeenListings.load(location)
+
+    assert loaded.fingerprints == seen_listings.fingerprints
+    assert loaded.is_known(listing_url(1, 1), "v2")
+    assert not loaded.is_known(listing_url(1, 1), "v1")
+    assert len(SeenListings.load(str(tmp_path / "missing.json"))) == 0
+
+
+def test_changed_listing_is_scraped_again(site):
+    seen_listings = SeenListings(site.listings(*site.pages))
+    changed_url = listing_url(2, 1)
+    site.pages[2][changed_url] = "v2"
+
+    scraped = scrape(seen_listings, stop_on_known_page=False)
+
+    assert scraped == [changed_url]
+    assert site.requested_pages == list(site.pages)
+    assert seen_listings.is_known(changed_url, "v2")
+
+
+def test_walk_stops_at_first_page_with_only_seen_listings(site):
+    seen_listings = SeenListings(site.listings(2, 3))
+
+    scraped = scrape(seen_listings, stop_on_known_page=True)
+
+    assert scraped == list(site.pages[1])
+    assert site.requested_pages == [1, 2]
+    assert seen_listings.fingerprints == site.listings(1, 2, 3)
+
+
+def test_seen_listings_saved_only_after_write(site, tmp_path, monkeypatch):
+    location = str(tmp_path / "seen_listings.json")
+
+    def failing_write(cars):
+        raise RuntimeError("DynamoDB unavailable")
+
+    monkeypatch.setattr(scraper_main, "write_to_db", failing_write)
+    with pytest.raises(RuntimeError):
+        scraper_main.run_scraper(
+            pages=SITE_PAGES, incremental=True, seen_listings_location=location
+        )
+    assert not os.path.exists(location)
+
+    written = []
+    monkeypatch.setattr(scraper_main, "write_to_db", written.extend)
+    scraper_main.run_scraper(
+        pages=SITE_PAGES, incremental=True, seen_listings_location=location
+    )
+
+    assert sorted(car.url for car in written) == sorted(site.listings(*site.pages))
+    assert SeenListings.load(location).fingerprints == site.listings(*site.pages)
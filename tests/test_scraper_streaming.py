@@ -0,0 +1,116 @@
+import boto3
+import pytest
+from moto import mock_aws
+
+import scraper_main
+import scraper_sink
+from conftest import SITE_PAGES, LISTINGS_PER_PAGE, listing_url
+from scraper_car_page import Car
+from scraper_client import ScraperClient
+from scraper_sink import DynamoDbSink
+from scraper_state import Checkpoint, SeenListings
+
+
+@pytest.fixture
+def car_table(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    with mock_aws():
+        yield boto3.resource("dynamodb").create_table(
+            TableName=scraper_sink.TABLE_NAME,
+            KeySchema=[{"AttributeName": "url", "KeyType": "HASH"}],
+            AttributeDefinitions=[{"AttributeName": "url", "AttributeType": "S"}],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+
+def stored_urls(table) -> set:
+    return {item["url"] for item in table.scan()["Items"]}
+
+
+def scraped_pages(n_pages: int):
+    for page_nr in range(1, n_pages + 1):
+        yield page_nr, [
+            Car(link=listing_url(page_nr, i)) for i in range(LISTINGS_PER_PAGE)
+        ]
+
+
+@pytest.mark.parametrize("flush_pages, flushed_pages", [(1, [1, 2, 3]), (2, [2, 3])])
+def test_sink_flushes_pages_as_they_are_written(car_table, flush_pages, flushed_pages):
+    flushed = []
+
+    def on_flush(page_nr: int):
+        stored = {
+            listing_url(nr, i)
+            for nr in range(1, page_nr + 1)
+            for i in range(LISTINGS_PER_PAGE)
+        }
+        assert stored_urls(car_table) == stored
+        flushed.append(page_nr)
+
+    last_page_nr = scraper_main.stream_to_sink(
+        scraped_pages(3),
+        DynamoDbSink(car_table),
+        on_flush=on_flush,
+        flush_pages=flush_pages,
+    )
+
+    assert last_page_nr == 3
+    assert flushed == flushed_pages
+    assert all("scraped_at" in item for item in car_table.scan()["Items"])
+
+
+def test_stream_resumes_after_last_completed_page(site, car_table, tmp_path):
+    checkpoint_location = str(tmp_path / "checkpoint.json")
+    seen_listings_location = str(tmp_path / "seen_listings.json")
+    site.failing_cars.add(listing_url(3, 1))
+
+    with pytest.raises(ValueError):
+        scraper_main.stream_scraper(
+            SITE_PAGES,
+            ScraperClient(max_workers=2),
+            seen_listings=SeenListings(),
+            seen_listings_location=seen_listings_location,
+            checkpoint_location=checkpoint_location,
+            sink=DynamoDbSink(car_table),
+        )
+
+    assert Checkpoint.load(checkpoint_location).last_completed_page == 2
+    assert stored_urls(car_table) == set(site.listings(1, 2))
+    seen_listings = SeenListings.load(seen_listings_location)
+    assert seen_listings.fingerprints == site.listings(1, 2)
+
+    site.failing_cars.clear()
+    site.requested_pages.clear()
+    scraper_main.stream_scraper(
+        SITE_PAGES - 2,
+        ScraperClient(max_workers=2),
+        seen_listings=seen_listings,
+        seen_listings_location=seen_listings_location,
+        checkpoint_location=checkpoint_location,
+        sink=DynamoDbSink(car_table),
+    )
+
+    assert site.requested_pages == [3, 4]
+    assert Checkpoint.load(checkpoint_location).last_completed_page == SITE_PAGES
+    assert stored_urls(car_table) == set(site.listings(*site.pages))
+    assert SeenListings.load(seen_listings_location).fingerprints == site.listings(
+        *site.pages
+    )
+
+
+def test_checkpoint_resets_when_walk_ends_before_page_limit(site, car_table, tmp_path):
+    checkpoint_location = str(tmp_path / "checkpoint.json")
+    Checkpoint(2).save(checkpoint_location)
+
+    scraper_main.stream_scraper(
+        SITE_PAGES,
+        ScraperClient(max_workers=2),
+        checkpoint_location=checkpoint_location,
+        sink=DynamoDbSink(car_table),
+    )
+
+    assert site.requested_pages == [3, 4]
+    assert Checkpoint.load(checkpoint_location).last_completed_page == 0
+    assert stored_urls(car_table) == set(site.listings(3, 4))
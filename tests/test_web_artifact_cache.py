@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+import utilities
+from utilities import ArtifactCache, S3Artifact
+
+FILE = "output_files/car_graph.json"
+N_THREADS = 8
+
+
+def artifact(body: bytes) -> S3Artifact:
+    return S3Artifact(body, f'"{body.hex()}"', body.hex(), "application/json")
+
+
+class StubFetch:
+    """Stands in for s3, returns given artifacts and records requests. Unless
+    released, a fetch waits for release"""
+
+    def __init__(self):
+        self.calls = []
+        self.result = artifact(b"v1")
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, file_path, cached=None):
+        self.calls.append((file_path, cached))
+        assert self.release.wait(5)
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+@pytest.fixture
+def fetch(monkeypatch):
+    fetch = StubFetch()
+    monkeypatch.setattr(utilities, "fetch_s3_artifact", fetch)
+    return fetch
+
+
+def wait_for(condition):
+    deadline = time.time() + 5
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.01)
+
+
+def test_concurrent_requests_for_cold_file_fetch_it_once(fetch):
+    cache = ArtifactCache()
+    loads = []
+    cache.register(FILE, lambda fetched: loads.append(fetched) or fetched.body)
+    fetch.release.clear()
+    entries = []
+
+    threads = [
+        threading.Thread(target=lambda: entries.append(cache.get(FILE)))
+        for _ in range(N_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: cache.counts["misses"] == N_THREADS)
+    # Lets threads counted as misses join the running refresh
+    time.sleep(0.1)
+    fetch.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert fetch.calls == [(FILE, None)]
+    assert len(loads) == 1
+    assert [entry.value for entry in entries] == [b"v1"] * N_THREADS
+
+
+def test_stale_file_is_served_while_refreshed(fetch):
+    cache = ArtifactCache(ttl=0)
+    loads = []
+    cache.register(FILE, lambda fetched: loads.append(fetched) or fetched.body)
+    first = cache.get(FILE)
+    fetch.release.clear()
+    fetch.result = artifact(b"v2")
+
+    stale = cache.get(FILE)
+    refresh = cache.refresh(FILE)
+
+    assert stale is first
+    assert not refresh.done()
+    assert cache.counts["stale_hits"] == 1
+    fetch.release.set()
+    assert refresh.result().value == b"v2"
+    assert fetch.calls[-1] == (FILE, first.artifact)
+    assert cache.get(FILE).value == b"v2"
+
+    # File not modified since is not loaded again
+    fetch.result = cache.entries[FILE].artifact
+    cache.refresh(FILE).result()
+    assert len(loads) == 2
+    assert cache.get(FILE).value == b"v2"
+
+
+def test_failed_refresh_keeps_stale_file(fetch):
+    cache = ArtifactCache(ttl=0)
+    first = cache.get(FILE)
+    fetch.result = ConnectionError("s3 unavailable")
+
+    stale = cache.get(FILE)
+    refreshed = cache.refresh(FILE).result()
+
+    assert stale is first
+    assert refreshed.artifact is first.artifact
+    assert refreshed.expires_at > time.time() + utilities.REFRESH_RETRY_TIME / 2
+    assert cache.counts["refresh_errors"] == 1
+    # Retried only after retry time, stale file is served until then
+    n_calls = len(fetch.calls)
+    assert cache.get(FILE).artifact is first.artifact
+    assert len(fetch.calls) == n_calls
+
+
+def test_failed_fetch_of_cold_file_is_raised(fetch):
+    cache = ArtifactCache()
+    fetch.result = ConnectionError("s3 unavailable")
+
+    with pytest.raises(ConnectionError):
+        cache.get(FILE)
+    assert FILE not in cache.entries
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+from dash_app_graph import axis_range, hidden_traces
+from graph_data import GRID_SIZE, MAX_POINTS, GraphData
+
+N_TRACES = 3
+POINTS_PER_TRACE = 40000
+X_RANGE = (1000, 8000)
+Y_RANGE = (2000, 8000)
+
+
+def figure() -> dict:
+    """Scatter figure with a trace per brand, points spread over 10000 x 10000"""
+    rng = np.random.default_rng(0)
+    return {
+        "data": [
+            {
+                "name": f"brand_{i}",
+                "mode": "markers",
+                "x": rng.uniform(0, 10000, POINTS_PER_TRACE).tolist(),
+                "y": rng.uniform(0, 10000, POINTS_PER_TRACE).tolist(),
+                "customdata": [[f"url_{i}_{j}"] for j in range(POINTS_PER_TRACE)],
+            }
+            for i in range(N_TRACES)
+        ],
+        "layout": {"title": "Cars"},
+    }
+
+
+@pytest.fixture(scope="module")
+def graph():
+    return GraphData(figure(), version="abc")
+
+
+def grid_cells(graph: GraphData, points: np.ndarray, x_range, y_range) -> np.ndarray:
+    cells = np.zeros(len(points), dtype=np.int64)
+    for values, (low, high) in [
+        (graph.point_x[points], x_range),
+        (graph.point_y[points], y_range),
+    ]:
+        cell = ((values - low) * GRID_SIZE / (high - low)).astype(np.int64)
+        cells = cells * GRID_SIZE + np.clip(cell, 0, GRID_SIZE - 1)
+    return cells
+
+
+def test_whole_graph_is_thinned_to_max_points(graph):
+    points = graph.select_points()
+
+    assert len(points) == MAX_POINTS
+    assert len(np.unique(points)) == MAX_POINTS
+    # Spread over the whole graph, not just its first points
+    assert set(graph.point_trace[points]) == set(range(N_TRACES))
+    assert graph.point_x[points].min() < 100
+    assert graph.point_x[points].max() > 9900
+
+
+def test_zoomed_view_keeps_one_point_per_cell_within_range(graph):
+    in_range = (
+        (graph.point_x >= X_RANGE[0])
+        & (graph.point_x <= X_RANGE[1])
+        & (graph.point_y >= Y_RANGE[0])
+        & (graph.point_y <= Y_RANGE[1])
+    )
+    assert in_range.sum() > MAX_POINTS
+
+    points = graph.select_points(X_RANGE, Y_RANGE)
+
+    assert len(points) <= MAX_POINTS
+    assert in_range[points].all()
+    # Grid spans points in range
+    x = graph.point_x[in_range]
+    y = graph.point_y[in_range]
+    cells = grid_cells(graph, points, (x.min(), x.max()), (y.min(), y.max()))
+    assert len(np.unique(cells)) == len(points)
+
+
+def test_small_view_draws_all_its_points(graph):
+    x_range, y_range = (1000, 1500), (5000, 5500)
+    in_range = (
+        (graph.point_x >= 1000)
+        & (graph.point_x <= 1500)
+        & (graph.point_y >= 5000)
+        & (graph.point_y <= 5500)
+    )
+
+    # Reversed axis gives its range high end first
+    points = graph.select_points(x_range[::-1], y_range)
+
+    assert sorted(points) == sorted(np.flatnonzero(in_range))
+
+
+def test_hidden_traces_are_left_out(graph):
+    points = graph.select_points(X_RANGE, Y_RANGE, hidden_traces=[0, 2])
+    assert set(graph.point_trace[points]) == {1}
+
+    view = graph.figure(X_RANGE, Y_RANGE, hidden_traces=[0, 2])
+
+    assert [trace["visible"] for trace in view["data"] if "visible" in trace] == [
+        "legendonly",
+        "legendonly",
+    ]
+    assert len(view["data"][0]["x"]) == len(view["data"][2]["x"]) == 0
+    shown = view["data"][1]
+    assert shown["type"] == "scattergl"
+    assert len(shown["x"]) == len(points)
+    assert all(X_RANGE[0] <= x <= X_RANGE[1] for x in shown["x"])
+    # Points keep their customdata
+    assert all(url[0].startswith("url_1_") for url in shown["customdata"])
+    assert view["layout"]["xaxis"]["range"] == list(X_RANGE)
+    assert view["layout"]["uirevision"] == "abc"
+
+
+@pytest.mark.parametrize(
+    "relayout_data, expected",
+    [
+        ({"xaxis.range[0]": 100, "xaxis.range[1]": 200}, [100, 200]),
+        ({"xaxis.range": [300, 400]}, [300, 400]),
+        ({"xaxis.autorange": True}, None),
+        ({"yaxis.range[0]": 1, "yaxis.range[1]": 2}, [0, 10000]),
+        ({"dragmode": "pan"}, [0, 10000]),
+    ],
+)
+def test_zoom_sets_axis_range(relayout_data, expected):
+    assert axis_range(relayout_data, "xaxis", [0, 10000]) == expected
+
+
+@pytest.mark.parametrize(
+    "restyle_data, current, expected",
+    [
+        # Legend click on one trace
+        ([{"visible": ["legendonly"]}, [1]], [], [1]),
+        ([{"visible": [True]}, [1]], [1, 2], [2]),
+        # Legend double click isolating a trace
+        ([{"visible": [True, "legendonly", "legendonly"]}, [0, 1, 2]], [], [1, 2]),
+        # Deselect All and Select All buttons restyle every trace
+        ([{"visible": "legendonly"}, None], [], [0, 1, 2]),
+        ([{"visible": True}, None], [0, 2], []),
+        ([{"marker.size": 5}, [0]], [2], [2]),
+    ],
+)
+def test_legend_changes_set_hidden_traces(restyle_data, current, expected):
+    assert hidden_traces(restyle_data, N_TRACES, current) == expected
@@ -0,0 +1,118 @@
+import json
+import os
+
+import boto3
+import pytest
+from fastapi.testclient import TestClient
+from moto import mock_aws
+
+from conftest import ROOT
+import utilities
+from etl_export import ArtifactUpload
+
+GRAPH = json.dumps({"data": [{"x": list(range(500)), "y": [0] * 500}]}).encode()
+
+
+def publish(s3, key: str, content: bytes, content_type: str):
+    """Publishes file and its pre-compressed variants as ETL does"""
+    with ArtifactUpload(s3, utilities.BUCKET, key, content_type, True) as upload:
+        upload.write(content)
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    # Files are fetched again from this test's bucket
+    monkeypatch.setattr(utilities.ARTIFACT_CACHE, "entries", {})
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(
+            Bucket=utilities.BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+        )
+        publish(s3, utilities.GRAPH_FILE, GRAPH, "application/json")
+        yield s3
+
+
+@pytest.fixture
+def client(s3, monkeypatch):
+    # Web app mounts static files and templates relative to working folder
+    monkeypatch.chdir(os.path.join(ROOT, "Webpage", "app"))
+    import main
+
+    # Not entered as context manager, so files are loaded on first request
+    return TestClient(main.app)
+
+
+def test_unchanged_file_gets_304(client):
+    headers = {"Accept-Encoding": "identity"}
+    response = client.get("/data/car_graph.json", headers=headers)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+
+    for if_none_match in [etag, f"W/{etag}", f'"other", {etag}']:
+        response = client.get(
+            "/data/car_graph.json", headers={**headers, "If-None-Match": if_none_match}
+        )
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+
+    response = client.get(
+        "/data/car_graph.json", headers={**headers, "If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, encoding",
+    [
+        ("gzip, deflate, br", "br"),
+        ("br;q=0, gzip", "gzip"),
+        ("gzip;q=0.5", "gzip"),
+        ("deflate", None),
+        ("identity", None),
+    ],
+)
+def test_best_accepted_variant_is_served(client, accept_encoding, encoding):
+    response = client.get(
+        "/data/car_graph.json", headers={"Accept-Encoding": accept_encoding}
+    )
+
+    assert response.status_code == 200
+    assert response.headers.get("Content-Encoding") == encoding
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["Content-Type"] == "application/json"
+    # Variants share content hash, ETag tells them apart
+    identity_etag = client.get(
+        "/data/car_graph.json", headers={"Accept-Encoding": "identity"}
+    ).headers["ETag"]
+    if encoding:
+        assert response.headers["ETag"] == f'{identity_etag[:-1]}-{encoding}"'
+        assert int(response.headers["Content-Length"]) < len(GRAPH)
+    else:
+        assert response.headers["ETag"] == identity_etag
+    # Decoded by test client as told by Content-Encoding
+    assert response.content == GRAPH
+
+
+def test_unknown_or_unpublished_file_gets_404(client):
+    assert client.get("/data/secrets.json").status_code == 404
+    assert client.get("/data/car_table.parquet").status_code == 404
+
+
+def test_unchanged_s3_file_keeps_cached_bytes(s3):
+    cached = utilities.fetch_s3_artifact(utilities.GRAPH_FILE)
+    assert cached.body == GRAPH
+    assert cached.content_encoding is None
+
+    assert utilities.fetch_s3_artifact(utilities.GRAPH_FILE, cached) is cached
+
+    publish(s3, utilities.GRAPH_FILE, GRAPH + b" ", "application/json")
+    changed = utilities.fetch_s3_artifact(utilities.GRAPH_FILE, cached)
+    assert changed.body == GRAPH + b" "
+    assert changed.s3_etag != cached.s3_etag
+    assert changed.content_hash != cached.content_hash
+    assert utilities.fetch_s3_artifact("output_files/missing.json") is None
@@ -0,0 +1,111 @@
+import io
+import os
+
+import boto3
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+from moto import mock_aws
+
+from conftest import ROOT
+import utilities
+from table_data import TableData
+
+N_ROWS = 30
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-central-1")
+    # Web app mounts static files and templates relative to working folder
+    monkeypatch.chdir(os.path.join(ROOT, "Webpage", "app"))
+    table = pd.DataFrame(
+        {
+            "brand": ["Audi", "Opel", "Toyota"] * (N_ROWS // 3),
+            "price_dif": range(N_ROWS),
+            "url": [f"https://autogidas.lt/skelbimas/{i}.html" for i in range(N_ROWS)],
+        }
+    )
+    parquet = io.BytesIO()
+    table.to_parquet(parquet, index=False)
+    with mock_aws():
+        s3 = boto3.client("s3")
+        s3.create_bucket(
+            Bucket=utilities.BUCKET,
+            CreateBucketConfiguration={"LocationConstraint": "eu-central-1"},
+        )
+        s3.put_object(
+            Bucket=utilities.BUCKET, Key=utilities.GRAPH_FILE, Body=b'{"data": []}'
+        )
+        s3.put_object(
+            Bucket=utilities.BUCKET, Key=utilities.TABLE_FILE, Body=parquet.getvalue()
+        )
+        import main
+
+        # Not entered as context manager, so files are loaded on first request
+        yield TestClient(main.app)
+
+
+def test_page_is_sorted_and_filtered(client):
+    response = client.get(
+        "/api/table?draw=3&start=2&length=4&search[value]=opel"
+        "&order[0][column]=1&order[0][dir]=desc"
+    )
+
+    assert response.status_code == 200
+    page = response.json()
+    assert page["draw"] == 3
+    assert page["recordsTotal"] == N_ROWS
+    assert page["recordsFiltered"] == N_ROWS // 3
+    assert [row[1] for row in page["data"]] == [22, 19, 16, 13]
+
+
+def test_all_rows_are_requested_with_negative_length(client):
+    response = client.get("/api/table?length=-1")
+
+    assert response.status_code == 200
+    assert len(response.json()["data"]) == N_ROWS
+
+
+def test_start_past_last_row_gives_empty_page(client):
+    response = client.get(f"/api/table?start={10**30}")
+
+    assert response.status_code == 200
+    assert response.json()["data"] == []
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "start=abc",
+        "start=-1",
+        "length=-2",
+        "length=1.5",
+        "draw=-1",
+        "draw=x",
+        "order[0][column]=-1",
+        "order[0][column]=3",
+        "order[0][column]=name",
+    ],
+)
+def test_invalid_params_are_rejected(client, query):
+    response = client.get(f"/api/table?{query}")
+
+    assert response.status_code == 422
+
+
+class ClearedByOtherThread(dict):
+    """Search mask cache cleared by another request right after each insert"""
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.clear()
+
+
+def test_search_mask_survives_cache_cleared_by_other_thread():
+    table = TableData(pd.DataFrame({"brand": ["Audi", "Opel", None, "audi"]}))
+    table.search_masks = ClearedByOtherThread()
+
+    assert table.search_mask("AUDI").tolist() == [True, False, False, True]